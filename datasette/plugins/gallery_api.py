@@ -0,0 +1,414 @@
+import asyncio
+import datetime
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+
+from datasette import hookimpl
+from datasette.utils.asgi import Response
+
+_src_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "src"))
+if _src_dir not in sys.path:
+    sys.path.insert(0, _src_dir)
+from gallery_tables import (
+    PLACE_KINDS,
+    create_gallery_tables,
+    create_photo_places_table,
+    refresh,
+    table_columns,
+)
+
+logger = logging.getLogger(__name__)
+
+_default_database_dir = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "database")
+)
+MEDIAMETA_DB_PATH = os.getenv(
+    "MEDIAMETA_DB_PATH",
+    os.path.join(_default_database_dir, "mediameta.db"),
+)
+
+GALLERY_DEFAULT_LIMIT = 100
+GALLERY_MAX_LIMIT = 500
+
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+# Compact row layout of /-/gallery.json. version is the thumbnail's content
+# hash, passed as /thumb/<key>?v=<version> so the response can be cached
+# for good.
+GALLERY_COLUMNS = ["key", "file", "date", "blurhash", "color", "version"]
+
+TIMELINE_GRANULARITIES = {"year": 4, "month": 7, "day": 10}
+
+# A place filter matches a city, region or country name from photo_places
+# (scripts/build_photo_places.py); each column has its own index
+PLACE_FILTER = (
+    "g.path IN (SELECT path FROM photo_places"
+    " WHERE city = :place OR region = :place OR country = :place)"
+)
+
+_local = threading.local()
+# Histogram buckets per granularity and the place list, rebuilt after
+# mediameta.db changes
+_timeline_cache = {}
+_places_cache = {}
+
+
+def _get_connection() -> sqlite3.Connection:
+    """Return this thread's read-only connection to mediameta.db."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(
+            f"file:{MEDIAMETA_DB_PATH}?mode=ro", uri=True, check_same_thread=False
+        )
+        _local.conn = conn
+        _local.data_version = None
+    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    if data_version != _local.data_version:
+        _local.data_version = data_version
+        _timeline_cache.clear()
+        _places_cache.clear()
+        _local.has_placeholders = (
+            conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='thumb_placeholders'"
+            ).fetchone()
+            is not None
+        )
+        _local.has_versions = "etag" in table_columns(conn, "gallery_items")
+    return conn
+
+
+def _valid_date(value: str) -> bool:
+    if not _DATE_RE.match(value):
+        return False
+    try:
+        datetime.date.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+
+def encode_cursor(taken_at: str, path: str) -> str:
+    """
+    Cursor for the item (taken_at, path): ``<taken_at>|<key>``, where key is
+    the path without the leading ``./`` (as in /thumb/<key>).
+    """
+    key = path[2:] if path.startswith("./") else path
+    return f"{taken_at}|{key}"
+
+
+def decode_cursor(cursor: str):
+    """Return (taken_at, path) for a cursor, or None if it is malformed."""
+    taken_at, sep, key = cursor.partition("|")
+    if not sep or not taken_at or not key:
+        return None
+    return taken_at, "./" + key
+
+
+def _date_filters(start_date: str, end_date: str, place: str = "") -> tuple:
+    """
+    Return (where clauses, params) for the gallery's inclusive date range
+    and optional place name.
+    """
+    clauses = []
+    params = {}
+    if place:
+        clauses.append(PLACE_FILTER)
+        params["place"] = place
+    if start_date:
+        clauses.append("g.taken_at >= :start")
+        params["start"] = start_date
+    if end_date:
+        # taken_at is normalized to 'YYYY-MM-DD HH:MM:SS'
+        clauses.append("g.taken_at <= :end || ' 23:59:59'")
+        params["end"] = end_date
+    return clauses, params
+
+
+def gallery_page(
+    start_date: str = "",
+    end_date: str = "",
+    after=None,
+    before=None,
+    at=None,
+    limit: int = GALLERY_DEFAULT_LIMIT,
+    place: str = "",
+) -> dict:
+    """
+    Fetch one page of gallery items with a (taken_at, path) keyset.
+
+    Items are sorted like /gallery: oldest first when a start date is set,
+    newest first otherwise. ``after`` continues forwards from a cursor,
+    ``before`` pages backwards and ``at`` starts with the cursor's own item
+    (as used by /-/timeline.json buckets). Either way the query is a range
+    scan of gallery_items' primary key from the cursor, so deep pages cost
+    the same as the first.
+    """
+    conn = _get_connection()
+    ascending = bool(start_date)
+    clauses, params = _date_filters(start_date, end_date, place)
+
+    # Walking backwards means scanning in the opposite order from the cursor
+    backwards = before is not None and after is None and at is None
+    scan_ascending = ascending != backwards
+    cursor = before if backwards else after
+    if at is not None:
+        cursor = at
+    if cursor is not None:
+        op = ">" if scan_ascending else "<"
+        if at is not None:
+            op += "="
+        clauses.append(f"(g.taken_at, g.path) {op} (:cursor_date, :cursor_file)")
+        params["cursor_date"], params["cursor_file"] = cursor
+
+    direction = "ASC" if scan_ascending else "DESC"
+    placeholder_columns = "p.blurhash, p.color"
+    placeholder_join = "LEFT JOIN thumb_placeholders p ON p.path = g.path"
+    if not _local.has_placeholders:
+        placeholder_columns = "NULL, NULL"
+        placeholder_join = ""
+    version_column = "g.etag" if _local.has_versions else "NULL"
+    sql = f"""
+        SELECT g.path, g.file_name, g.taken_at, {placeholder_columns}, {version_column}
+        FROM gallery_items g
+        {placeholder_join}
+        {"WHERE " + " AND ".join(clauses) if clauses else ""}
+        ORDER BY g.taken_at {direction}, g.path {direction}
+        LIMIT :limit
+    """
+    params["limit"] = limit + 1
+    rows = conn.execute(sql, params).fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = cursor is not None, has_more
+
+    return {
+        "columns": GALLERY_COLUMNS,
+        "rows": [
+            [path[2:], file_name, taken_at, blurhash, color, version]
+            for path, file_name, taken_at, blurhash, color, version in rows
+        ],
+        "order": "asc" if ascending else "desc",
+        "next": encode_cursor(rows[-1][2], rows[-1][0]) if rows and has_next else None,
+        "prev": encode_cursor(rows[0][2], rows[0][0]) if rows and has_prev else None,
+    }
+
+
+async def gallery_json_handler(request, datasette):
+    """
+    Keyset-paginated gallery data.
+
+    Query params: start_date, end_date (YYYY-MM-DD), place (a city, region
+    or country name), limit, and one of after=<cursor> / before=<cursor>
+    taken from a previous response's ``next`` / ``prev``, or at=<cursor>
+    from a /-/timeline.json bucket.
+    """
+    start_date = request.args.get("start_date", "").strip()
+    end_date = request.args.get("end_date", "").strip()
+    place = request.args.get("place", "").strip()
+    for value in (start_date, end_date):
+        if value and not _valid_date(value):
+            return Response.json({"error": "Dates must be YYYY-MM-DD"}, status=400)
+
+    try:
+        limit = int(request.args.get("limit", GALLERY_DEFAULT_LIMIT))
+    except ValueError:
+        return Response.json({"error": "Invalid limit"}, status=400)
+    limit = max(1, min(limit, GALLERY_MAX_LIMIT))
+
+    cursors = {}
+    for name in ("after", "before", "at"):
+        value = request.args.get(name)
+        if value:
+            cursors[name] = decode_cursor(value)
+            if cursors[name] is None:
+                return Response.json({"error": f"Invalid {name} cursor"}, status=400)
+
+    loop = asyncio.get_running_loop()
+    try:
+        page = await loop.run_in_executor(
+            None,
+            lambda: gallery_page(
+                start_date,
+                end_date,
+                after=cursors.get("after"),
+                before=cursors.get("before"),
+                at=cursors.get("at"),
+                limit=limit,
+                place=place,
+            ),
+        )
+    except sqlite3.Error as e:
+        logger.error("Error fetching gallery page: %s", e)
+        return Response.json({"error": "Internal server error"}, status=500)
+    return Response.json(page)
+
+
+def timeline_buckets(granularity: str) -> list:
+    """
+    Aggregate gallery_day_counts into year, month or day buckets.
+
+    Each bucket is {"key", "count", "first", "last"}, where first/last are
+    the cursors of its oldest and newest item, in ascending key order.
+    The result is cached until mediameta.db changes.
+    """
+    conn = _get_connection()
+    buckets = _timeline_cache.get(granularity)
+    if buckets is not None:
+        return buckets
+
+    width = TIMELINE_GRANULARITIES[granularity]
+    buckets = []
+    for day, n, first_cursor, last_cursor in conn.execute(
+        "SELECT day, n, first_cursor, last_cursor FROM gallery_day_counts ORDER BY day"
+    ):
+        key = day[:width]
+        if buckets and buckets[-1]["key"] == key:
+            bucket = buckets[-1]
+            bucket["count"] += n
+            bucket["last"] = last_cursor
+        else:
+            buckets.append(
+                {"key": key, "count": n, "first": first_cursor, "last": last_cursor}
+            )
+    _timeline_cache[granularity] = buckets
+    return buckets
+
+
+async def timeline_json_handler(request, datasette):
+    """
+    Date histogram of gallery_items.
+
+    Query params: by=year|month|day (default month), and optional
+    start_date/end_date (YYYY-MM-DD) to limit the buckets returned. Pass a
+    bucket's ``first`` cursor as /-/gallery.json?start_date=...&at=<cursor>
+    (oldest first) or its ``last`` cursor as ?at=<cursor> (newest first) to
+    open the gallery at that bucket.
+    """
+    granularity = request.args.get("by", "month")
+    if granularity not in TIMELINE_GRANULARITIES:
+        return Response.json({"error": "by must be year, month or day"}, status=400)
+    start_date = request.args.get("start_date", "").strip()
+    end_date = request.args.get("end_date", "").strip()
+    for value in (start_date, end_date):
+        if value and not _valid_date(value):
+            return Response.json({"error": "Dates must be YYYY-MM-DD"}, status=400)
+
+    loop = asyncio.get_running_loop()
+    try:
+        buckets = await loop.run_in_executor(None, timeline_buckets, granularity)
+    except sqlite3.Error as e:
+        logger.error("Error loading timeline: %s", e)
+        return Response.json({"error": "Internal server error"}, status=500)
+
+    width = TIMELINE_GRANULARITIES[granularity]
+    if start_date:
+        buckets = [b for b in buckets if b["key"] >= start_date[:width]]
+    if end_date:
+        buckets = [b for b in buckets if b["key"] <= end_date[:width]]
+    return Response.json(
+        {
+            "by": granularity,
+            "total": sum(b["count"] for b in buckets),
+            "max": max((b["count"] for b in buckets), default=0),
+            "buckets": buckets,
+        },
+        headers={"Cache-Control": "public, max-age=60"},
+    )
+
+
+def place_names() -> list:
+    """
+    Return every city, region and country in photo_places as
+    {"name", "kind", "count"}, most photos first. Cached until mediameta.db
+    changes.
+    """
+    conn = _get_connection()
+    places = _places_cache.get("all")
+    if places is not None:
+        return places
+
+    places = []
+    for kind in PLACE_KINDS:
+        places.extend(
+            {"name": name, "kind": kind, "count": n}
+            for name, n in conn.execute(
+                f"""SELECT {kind}, COUNT(*) FROM photo_places
+                    WHERE {kind} IS NOT NULL GROUP BY {kind}"""
+            )
+        )
+    places.sort(key=lambda p: (-p["count"], p["name"]))
+    _places_cache["all"] = places
+    return places
+
+
+async def places_json_handler(request, datasette):
+    """Place names usable as the gallery's and /search's place= filter."""
+    loop = asyncio.get_running_loop()
+    try:
+        places = await loop.run_in_executor(None, place_names)
+    except sqlite3.Error as e:
+        logger.error("Error loading place names: %s", e)
+        return Response.json({"error": "Internal server error"}, status=500)
+    return Response.json(
+        {"places": places}, headers={"Cache-Control": "public, max-age=60"}
+    )
+
+
+@hookimpl
+def startup(datasette):
+    # The gallery template, contact sheets and date-filtered search read
+    # gallery_items (and photo_places for place filters), so create them and
+    # bring gallery_items up to date with exif/thumbImages, which the shell
+    # import scripts may have changed since the last run. The refresh only
+    # applies the difference, so an unchanged database costs one read of
+    # each table.
+    async def inner():
+        try:
+            db = datasette.get_database("mediameta")
+        except KeyError:
+            return
+        if not db.is_mutable:
+            return
+
+        def create(conn):
+            create_gallery_tables(conn)
+            create_photo_places_table(conn)
+            try:
+                return refresh(conn)
+            except sqlite3.OperationalError as e:
+                # No exif or thumbImages table yet
+                logger.warning("Could not refresh gallery_items: %s", e)
+                return None
+
+        result = await db.execute_write_fn(create)
+        if result is not None and (
+            result["inserted"] or result["deleted"] or result["updated"]
+        ):
+            logger.info(
+                "Refreshed gallery_items: %d inserted, %d deleted, %d new thumbnails, "
+                "%d days recounted",
+                result["inserted"],
+                result["deleted"],
+                result["updated"],
+                result["days"],
+            )
+
+    return inner
+
+
+@hookimpl
+def register_routes():
+    return [
+        (r"^/-/gallery\.json$", gallery_json_handler),
+        (r"^/-/timeline\.json$", timeline_json_handler),
+        (r"^/-/places\.json$", places_json_handler),
+    ]
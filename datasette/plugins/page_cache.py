@@ -0,0 +1,307 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode
+
+from datasette import hookimpl
+from datasette.utils.asgi import Response
+
+logger = logging.getLogger(__name__)
+
+_default_database_dir = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "database")
+)
+MEDIAMETA_DB_PATH = os.getenv(
+    "MEDIAMETA_DB_PATH",
+    os.path.join(_default_database_dir, "mediameta.db"),
+)
+
+# Byte budget for rendered pages (default 32 MB; a gallery page is ~100 KB).
+PAGE_CACHE_BYTES = int(os.getenv("PAGE_CACHE_BYTES", str(32 * 1024 * 1024)))
+
+# Pages also depend on things outside mediameta.db (the photo page checks
+# whether the original's drive is connected), so entries expire after this
+# many seconds even when the database has not changed.
+PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", "600"))
+
+# Rendered pages that only depend on mediameta.db and the query string
+CACHED_PATHS = re.compile(r"^/(gallery|photo/[^/]+)$")
+PHOTO_PATH = re.compile(r"^/photo/([^/]+)$")
+
+# Set by photo_detail.py on its background renders of a photo's neighbours.
+# Those renders are there to warm up photo_detail's own caches and must run
+# the template, so they are never served from or stored in the page cache.
+WARM_UP_HEADER = b"x-photo-warm-up"
+
+
+class _PageLRU:
+    """Thread-safe LRU of rendered pages bounded by total body size."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires"] < time.monotonic():
+                self.current_bytes -= len(self._entries.pop(key)["body"])
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        size = len(entry["body"])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= len(old["body"])
+            self._entries[key] = entry
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted["body"])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": PAGE_CACHE_TTL,
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+_cache = _PageLRU(PAGE_CACHE_BYTES)
+# Neighbour warm-up requests in flight, held so they are not garbage collected
+_warm_tasks = set()
+_version_lock = threading.Lock()
+_version = {"conn": None, "inode": None, "token": None}
+
+
+def _database_version():
+    """
+    Return a token that changes whenever mediameta.db does.
+
+    PRAGMA data_version on a long-lived connection changes when any other
+    connection or process commits. The file's inode, size and mtime cover a
+    database that was replaced on disk, which the open connection cannot
+    see. Both are checked on every request, in the executor since the lock
+    and the PRAGMA can block.
+    """
+    with _version_lock:
+        try:
+            st = os.stat(MEDIAMETA_DB_PATH)
+        except OSError:
+            return None
+        if _version["conn"] is None or st.st_ino != _version["inode"]:
+            if _version["conn"] is not None:
+                _version["conn"].close()
+            _version["conn"] = sqlite3.connect(
+                f"file:{MEDIAMETA_DB_PATH}?mode=ro", uri=True, check_same_thread=False
+            )
+            _version["inode"] = st.st_ino
+        data_version = _version["conn"].execute("PRAGMA data_version").fetchone()[0]
+        token = (st.st_ino, st.st_size, st.st_mtime_ns, data_version)
+        if token != _version["token"]:
+            if _version["token"] is not None:
+                logger.info("mediameta.db changed, clearing page cache")
+                _cache.clear()
+            _version["token"] = token
+        return token
+
+
+def normalize_query(query_string: bytes) -> str:
+    """
+    Sort the query parameters and drop empty ones, so ``?b=2&a=1&c=`` and
+    ``?a=1&b=2`` (what the gallery form submits with blank fields) share a
+    cache entry.
+    """
+    params = parse_qsl(query_string.decode("latin-1"), keep_blank_values=False)
+    return urlencode(sorted(params))
+
+
+def _is_authenticated(headers: dict) -> bool:
+    # Signed-in users (datasette-auth-passwords sets ds_actor) may see
+    # different pages and are the ones making writes, so they always get a
+    # fresh render
+    if b"authorization" in headers:
+        return True
+    return b"ds_actor=" in headers.get(b"cookie", b"")
+
+
+async def _send_cached(send, entry: dict, headers: dict, method: str):
+    etag = entry["etag"]
+    response_headers = entry["headers"] + [
+        (b"etag", etag),
+        (b"x-page-cache", b"hit"),
+    ]
+    status = 200
+    body = entry["body"]
+    if headers.get(b"if-none-match") == etag:
+        status = 304
+        response_headers = [h for h in response_headers if h[0] != b"content-length"]
+    if status == 304 or method == "HEAD":
+        body = b""
+    await send(
+        {"type": "http.response.start", "status": status, "headers": response_headers}
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _warm_neighbours(datasette, photo_id: str, query_string: bytes):
+    """
+    Warm up the neighbours of a photo page served from the cache. The cached
+    render skips the template that would do this, so ask photo_detail.py
+    through /-/photo.json, which warms up the previous and next photo.
+    """
+    params = [("file", photo_id)] + [
+        (name, value)
+        for name, value in parse_qsl(query_string.decode("latin-1"))
+        if name != "file"
+    ]
+    try:
+        await datasette.client.get("/-/photo.json?" + urlencode(params))
+    except Exception as e:
+        logger.warning("Warm-up of neighbours of %s failed: %s", photo_id, e)
+
+
+def _schedule_warm(datasette, scope):
+    match = PHOTO_PATH.match(scope["path"])
+    if not match or scope["method"] != "GET":
+        return
+    task = asyncio.get_running_loop().create_task(
+        _warm_neighbours(datasette, match.group(1), scope.get("query_string", b""))
+    )
+    _warm_tasks.add(task)
+    task.add_done_callback(_warm_tasks.discard)
+
+
+def _wrap(app, datasette):
+    async def page_cache(scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in ("GET", "HEAD")
+            or not CACHED_PATHS.match(scope["path"])
+        ):
+            await app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        if WARM_UP_HEADER in headers:
+            await app(scope, receive, send)
+            return
+        if _is_authenticated(headers):
+            _cache.bypassed += 1
+            await app(scope, receive, send)
+            return
+
+        loop = asyncio.get_running_loop()
+        version = await loop.run_in_executor(None, _database_version)
+        key = (scope["path"], normalize_query(scope.get("query_string", b"")))
+        entry = _cache.get(key) if version is not None else None
+        if entry is not None:
+            await _send_cached(send, entry, headers, scope["method"])
+            _schedule_warm(datasette, scope)
+            return
+        if scope["method"] == "HEAD":
+            await app(scope, receive, send)
+            return
+
+        response = {}
+        chunks = []
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = list(message.get("headers") or [])
+                message = dict(message)
+                message["headers"] = response["headers"] + [
+                    (b"x-page-cache", b"miss")
+                ]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body"):
+                    response["complete"] = True
+            await send(message)
+
+        await app(scope, receive, capture)
+
+        cacheable = (
+            version is not None
+            and response.get("status") == 200
+            and response.get("complete")
+            and not any(
+                name.lower() == b"set-cookie" for name, _ in response["headers"]
+            )
+        )
+        # Only store the render if the database did not change under it
+        if (
+            cacheable
+            and await loop.run_in_executor(None, _database_version) == version
+        ):
+            body = b"".join(chunks)
+            _cache.put(
+                key,
+                {
+                    "body": body,
+                    "headers": [
+                        (name, value)
+                        for name, value in response["headers"]
+                        if name.lower() not in (b"content-length", b"etag")
+                    ]
+                    + [(b"content-length", str(len(body)).encode())],
+                    "etag": (
+                        '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+                    ).encode(),
+                    "expires": time.monotonic() + PAGE_CACHE_TTL,
+                },
+            )
+
+    return page_cache
+
+
+async def page_cache_stats_handler(request, datasette):
+    return Response.json(_cache.stats())
+
+
+@hookimpl
+def asgi_wrapper(datasette):
+    def wrap(app):
+        return _wrap(app, datasette)
+
+    return wrap
+
+
+@hookimpl
+def register_routes():
+    return [
+        (r"^/-/page-cache$", page_cache_stats_handler),
+    ]
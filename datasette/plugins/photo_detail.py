@@ -0,0 +1,322 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from urllib.parse import quote, urlencode
+
+from datasette import hookimpl
+from datasette.utils.asgi import Response
+
+logger = logging.getLogger(__name__)
+
+_default_database_dir = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "database")
+)
+MEDIAMETA_DB_PATH = os.getenv(
+    "MEDIAMETA_DB_PATH",
+    os.path.join(_default_database_dir, "mediameta.db"),
+)
+
+# Photo details kept in memory, so a neighbour that was warmed up renders
+# without touching the database. Cleared when mediameta.db changes.
+DETAIL_CACHE_SIZE = 256
+
+# Rendition the photo page shows while the original loads; warmed up for
+# the previous and next photo.
+WARM_THUMB_SIZE = 512
+
+# Query params the photo page passes on to its Previous/Next links
+NAV_PARAMS = ("q", "start_date", "end_date", "place", "page")
+
+# Marks background warm-up requests, so a warmed page does not warm its own
+# neighbours in turn
+WARM_UP_HEADER = "x-photo-warm-up"
+
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+# Columns of the optional per-photo tables, when present. exif_camera is
+# built with alter=True, so only the columns that exist are selected.
+CAMERA_COLUMNS = (
+    "Make",
+    "Model",
+    "LensModel",
+    "FocalLength",
+    "FocalLengthIn35mm",
+    "FNumber",
+    "ExposureTime",
+    "ISO",
+    "ExposureProgram",
+    "MeteringMode",
+    "Flash",
+    "WhiteBalance",
+)
+PLACE_COLUMNS = ("city", "region", "country")
+
+_local = threading.local()
+_detail_cache = OrderedDict()
+_cache_lock = threading.Lock()
+# Warm-up tasks in flight (held so they are not garbage collected) and the
+# keys they cover, so rapid stepping does not queue the same work twice
+_warm_tasks = set()
+_warming = set()
+
+
+def _get_connection() -> sqlite3.Connection:
+    """
+    Return this thread's read-only connection to mediameta.db, with the
+    detail query rebuilt for the tables that currently exist.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(
+            f"file:{MEDIAMETA_DB_PATH}?mode=ro", uri=True, check_same_thread=False
+        )
+        _local.conn = conn
+        _local.data_version = None
+    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    if data_version != _local.data_version:
+        if _local.data_version is not None:
+            with _cache_lock:
+                _detail_cache.clear()
+        _local.data_version = data_version
+        _local.fields, _local.joins, _local.has_gallery = _detail_fields(conn)
+    return conn
+
+
+def _table_columns(conn: sqlite3.Connection, name: str) -> list:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({name})")]
+
+
+def _detail_fields(conn: sqlite3.Connection) -> tuple:
+    """
+    Return ([(group, name, sql expression)], [join clauses], has_gallery)
+    for the detail query. Optional tables that have not been built are left
+    out; without gallery_items the photo has no neighbours.
+    """
+    fields = [
+        ("exif", name, f'e."{name}"')
+        for name in _table_columns(conn, "exif_with_fullpath")
+    ]
+    joins = []
+    if _table_columns(conn, "image_description"):
+        joins.append("LEFT JOIN image_description d ON d.file = e.SourceFile")
+        fields.append(("description", "description", "d.description"))
+    if _table_columns(conn, "image_sharpness"):
+        joins.append("LEFT JOIN image_sharpness s ON s.SourceFile = e.SourceFile")
+        fields.append(("sharpness", "sharpness", "s.sharpness"))
+    camera_columns = set(_table_columns(conn, "exif_camera"))
+    if camera_columns:
+        joins.append("LEFT JOIN exif_camera c ON c.SourceFile = e.SourceFile")
+        fields.extend(
+            ("camera", name, f'c."{name}"')
+            for name in CAMERA_COLUMNS
+            if name in camera_columns
+        )
+    if _table_columns(conn, "photo_places"):
+        joins.append("LEFT JOIN photo_places pl ON pl.path = e.SourceFile")
+        fields.extend(("place", name, f"pl.{name}") for name in PLACE_COLUMNS)
+    has_gallery = bool(_table_columns(conn, "gallery_items"))
+    if has_gallery:
+        joins.append("LEFT JOIN gallery_items g ON g.path = e.SourceFile")
+    return fields, joins, has_gallery
+
+
+def _neighbour_sql(op: str, direction: str, filters: list) -> str:
+    """
+    Correlated subquery for the adjacent gallery item: a range scan of
+    gallery_items' (taken_at, path) key starting at the current photo.
+    """
+    where = " AND ".join([f"(n.taken_at, n.path) {op} (g.taken_at, g.path)"] + filters)
+    return f"""(SELECT json_array(n.file_name, substr(n.path, 3))
+        FROM gallery_items n WHERE {where}
+        ORDER BY n.taken_at {direction}, n.path {direction} LIMIT 1)"""
+
+
+def photo_detail(
+    filename: str, start_date: str = "", end_date: str = "", place: str = ""
+):
+    """
+    Return everything the photo page shows for ``filename`` in one query,
+    or None if there is no such photo.
+
+    The result has the exif_with_fullpath row (``exif``), ``description``,
+    ``sharpness``, ``camera`` and ``place``, plus ``prev``/``next``
+    ({"file", "key"} or None): the neighbours in gallery order under the
+    same date/place filters (oldest first when start_date is set, newest
+    first otherwise).
+    """
+    cache_key = (filename, start_date, end_date, place)
+    conn = _get_connection()
+    with _cache_lock:
+        if cache_key in _detail_cache:
+            _detail_cache.move_to_end(cache_key)
+            return _detail_cache[cache_key]
+
+    params = {"filename": filename}
+    filters = []
+    if start_date:
+        filters.append("n.taken_at >= :start")
+        params["start"] = start_date
+    if end_date:
+        filters.append("n.taken_at <= :end || ' 23:59:59'")
+        params["end"] = end_date
+    if place:
+        filters.append(
+            "n.path IN (SELECT path FROM photo_places"
+            " WHERE city = :place OR region = :place OR country = :place)"
+        )
+        params["place"] = place
+
+    if _local.has_gallery:
+        # Gallery order is ascending when a start date is set
+        older = _neighbour_sql("<", "DESC", filters)
+        newer = _neighbour_sql(">", "ASC", filters)
+        prev_sql, next_sql = (older, newer) if start_date else (newer, older)
+    else:
+        # gallery_items has not been built (e.g. a read-only database)
+        prev_sql = next_sql = "NULL"
+
+    fields = _local.fields
+    sql = f"""
+        SELECT {", ".join(expr for _, _, expr in fields)},
+               {prev_sql}, {next_sql}
+        FROM exif_with_fullpath e
+        {" ".join(_local.joins)}
+        WHERE e.FileName = :filename
+        LIMIT 1
+    """
+    row = conn.execute(sql, params).fetchone()
+    if row is None:
+        return None
+
+    detail = {"exif": {}, "description": None, "sharpness": None}
+    for (group, name, _), value in zip(fields, row):
+        if group == "exif":
+            detail["exif"][name] = value
+        elif group in ("camera", "place"):
+            detail.setdefault(group, {})[name] = value
+        else:
+            detail[group] = value
+    for group in ("camera", "place"):
+        values = detail.get(group) or {}
+        detail[group] = values if any(v is not None for v in values.values()) else None
+    for name, value in zip(("prev", "next"), row[len(fields) :]):
+        detail[name] = None
+        if value is not None:
+            file_name, key = json.loads(value)
+            detail[name] = {"file": file_name, "key": key}
+
+    with _cache_lock:
+        _detail_cache[cache_key] = detail
+        while len(_detail_cache) > DETAIL_CACHE_SIZE:
+            _detail_cache.popitem(last=False)
+    return detail
+
+
+def _filter_args(args) -> tuple:
+    """Return the gallery's (start_date, end_date, place) from query args."""
+    start_date = args.get("start_date", "").strip()
+    end_date = args.get("end_date", "").strip()
+    if start_date and not _DATE_RE.match(start_date):
+        start_date = ""
+    if end_date and not _DATE_RE.match(end_date):
+        end_date = ""
+    return start_date, end_date, args.get("place", "").strip()
+
+
+def _nav_query(args) -> str:
+    """The query string the photo page passes on to its gallery and neighbour links."""
+    return urlencode([(name, args[name]) for name in NAV_PARAMS if args.get(name)])
+
+
+async def _warm(datasette, neighbours: list, args, filters: tuple):
+    """
+    Render the neighbours' photo pages (filling the detail cache; page_cache.py
+    lets these renders through without storing them) and load their
+    thumbnails.
+    """
+    query = _nav_query(args)
+    for neighbour in neighbours:
+        try:
+            await datasette.client.get(
+                f"/photo/{quote(neighbour['file'])}" + (f"?{query}" if query else ""),
+                headers={WARM_UP_HEADER: "1"},
+            )
+            await datasette.client.get(
+                f"/thumb/{neighbour['key']}?size={WARM_THUMB_SIZE}",
+                headers={"accept": "image/webp,image/*"},
+            )
+        except Exception as e:
+            logger.warning("Warm-up of %s failed: %s", neighbour["file"], e)
+        finally:
+            _warming.discard((neighbour["file"], filters))
+
+
+def _schedule_warm(datasette, detail: dict, args, filters: tuple):
+    neighbours = []
+    for name in ("next", "prev"):
+        neighbour = detail.get(name)
+        if neighbour and (neighbour["file"], filters) not in _warming:
+            _warming.add((neighbour["file"], filters))
+            neighbours.append(neighbour)
+    if not neighbours:
+        return
+    task = asyncio.get_running_loop().create_task(
+        _warm(datasette, neighbours, args, filters)
+    )
+    _warm_tasks.add(task)
+    task.add_done_callback(_warm_tasks.discard)
+
+
+async def load_photo_detail(datasette, filename: str, args, warm: bool = True):
+    """photo_detail() off the event loop, warming up the neighbours after."""
+    filters = _filter_args(args)
+    loop = asyncio.get_running_loop()
+    detail = await loop.run_in_executor(None, photo_detail, filename, *filters)
+    if detail is not None and warm:
+        _schedule_warm(datasette, detail, args, filters)
+    return detail
+
+
+async def photo_json_handler(request, datasette):
+    """
+    Photo page data in one response.
+
+    Query params: file (the FileName, required), plus the gallery's
+    start_date, end_date and place, which decide ``prev`` and ``next``.
+    """
+    filename = request.args.get("file", "").strip()
+    if not filename:
+        return Response.json({"error": "Missing 'file' parameter"}, status=400)
+    try:
+        detail = await load_photo_detail(datasette, filename, request.args)
+    except sqlite3.Error as e:
+        logger.error("Error loading photo detail for %s: %s", filename, e)
+        return Response.json({"error": "Internal server error"}, status=500)
+    if detail is None:
+        return Response.json({"error": "Photo not found"}, status=404)
+    return Response.json(detail)
+
+
+@hookimpl
+def extra_template_vars(datasette, request):
+    warm = request is None or WARM_UP_HEADER not in request.headers
+
+    async def photo_detail_var(filename, args):
+        return await load_photo_detail(datasette, filename, args, warm)
+
+    return {
+        "photo_detail": photo_detail_var,
+        "nav_query": _nav_query(request.args) if request is not None else "",
+    }
+
+
+@hookimpl
+def register_routes():
+    return [
+        (r"^/-/photo\.json$", photo_json_handler),
+    ]
@@ -0,0 +1,263 @@
+import asyncio
+import logging
+import math
+import os
+import sqlite3
+import threading
+
+from datasette import hookimpl
+from datasette.utils.asgi import Response
+
+logger = logging.getLogger(__name__)
+
+_default_database_dir = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "database")
+)
+MEDIAMETA_DB_PATH = os.getenv(
+    "MEDIAMETA_DB_PATH",
+    os.path.join(_default_database_dir, "mediameta.db"),
+)
+
+MAP_DEFAULT_LIMIT = 2000
+MAP_MAX_LIMIT = 10000
+
+# Compact row layout of /-/map/points.json
+POINT_COLUMNS = ["lat", "lng", "key", "file", "date"]
+
+# Must match scripts/build_photo_locations.py: zoom z is clustered on a
+# 2^(z + CELL_SHIFT) Web Mercator grid (64px cells); above
+# MAX_CLUSTER_ZOOM the map gets individual points.
+CELL_SHIFT = 2
+MAX_CLUSTER_ZOOM = 16
+MAX_MERCATOR_LAT = 85.05112878
+
+# Compact row layout of /-/map/clusters.json; key/file are the
+# representative photo
+CLUSTER_COLUMNS = ["lat", "lng", "count", "key", "file"]
+
+_local = threading.local()
+
+
+def _get_connection() -> sqlite3.Connection:
+    """Return this thread's read-only connection to mediameta.db."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(
+            f"file:{MEDIAMETA_DB_PATH}?mode=ro", uri=True, check_same_thread=False
+        )
+        _local.conn = conn
+    return conn
+
+
+def parse_bbox(value: str):
+    """
+    Parse ``west,south,east,north`` in degrees. Returns a list of one or two
+    (west, south, east, north) boxes (two when the box crosses the
+    antimeridian), or None if the value is malformed.
+    """
+    try:
+        west, south, east, north = (float(v) for v in value.split(","))
+    except ValueError:
+        return None
+    south, north = max(-90.0, south), min(90.0, north)
+    if south > north:
+        return None
+    if east - west >= 360:
+        return [(-180.0, south, 180.0, north)]
+    # Leaflet reports longitudes outside -180..180 after panning across
+    # the antimeridian; wrap them back
+    west = (west + 180) % 360 - 180
+    east = (east + 180) % 360 - 180
+    if west <= east:
+        return [(west, south, east, north)]
+    return [(west, south, 180.0, north), (-180.0, south, east, north)]
+
+
+def _bbox_clause(boxes: list) -> tuple:
+    clauses = []
+    params = []
+    for west, south, east, north in boxes:
+        clauses.append(
+            "(r.min_lat <= ? AND r.max_lat >= ? AND r.min_lng <= ? AND r.max_lng >= ?)"
+        )
+        params.extend([north, south, east, west])
+    return "(" + " OR ".join(clauses) + ")", params
+
+
+def points_in_bbox(boxes: list, limit: int) -> dict:
+    """Return the photos inside the bounding boxes, via the R*Tree index."""
+    conn = _get_connection()
+    where, params = _bbox_clause(boxes)
+    rows = conn.execute(
+        f"""SELECT l.lat, l.lng, l.path, l.file_name, l.create_date
+            FROM photo_locations_rtree r
+            JOIN photo_locations l ON l.id = r.id
+            WHERE {where}
+            LIMIT ?""",
+        params + [limit + 1],
+    ).fetchall()
+
+    truncated = len(rows) > limit
+    rows = rows[:limit]
+    count = len(rows)
+    if truncated:
+        count = conn.execute(
+            f"SELECT COUNT(*) FROM photo_locations_rtree r WHERE {where}", params
+        ).fetchone()[0]
+
+    return {
+        "columns": POINT_COLUMNS,
+        "rows": [
+            [
+                round(lat, 5),
+                round(lng, 5),
+                path[2:],
+                file_name,
+                (create_date or "")[:10],
+            ]
+            for lat, lng, path, file_name, create_date in rows
+        ],
+        "count": count,
+        "truncated": truncated,
+    }
+
+
+def location_extent():
+    """Return [south, west, north, east] covering every geotagged photo, or None."""
+    conn = _get_connection()
+    row = conn.execute(
+        """SELECT MIN(min_lat), MIN(min_lng), MAX(max_lat), MAX(max_lng), COUNT(*)
+           FROM photo_locations_rtree"""
+    ).fetchone()
+    if not row[4]:
+        return None
+    return list(row[:4])
+
+
+def _mercator_x(lng: float, scale: int) -> int:
+    return min(scale - 1, max(0, int((lng + 180.0) / 360.0 * scale)))
+
+
+def _mercator_y(lat: float, scale: int) -> int:
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+    sin_lat = math.sin(math.radians(lat))
+    y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return min(scale - 1, max(0, int(y * scale)))
+
+
+def clusters_in_bbox(boxes: list, zoom: int) -> dict:
+    """
+    Return the precomputed clusters at ``zoom`` whose cells overlap the
+    bounding boxes. The cell grid is fixed in screen pixels, so the number
+    of rows depends on the viewport size, not on how many photos there are.
+    """
+    conn = _get_connection()
+    scale = 1 << (zoom + CELL_SHIFT)
+    clauses = []
+    params = [zoom]
+    for west, south, east, north in boxes:
+        # Mercator y grows southwards
+        clauses.append("(x BETWEEN ? AND ? AND y BETWEEN ? AND ?)")
+        params.extend(
+            [
+                _mercator_x(west, scale),
+                _mercator_x(east, scale),
+                _mercator_y(north, scale),
+                _mercator_y(south, scale),
+            ]
+        )
+    rows = conn.execute(
+        f"""SELECT lat, lng, n, path, file_name FROM photo_clusters
+            WHERE zoom = ? AND ({" OR ".join(clauses)})""",
+        params,
+    ).fetchall()
+    return {
+        "columns": CLUSTER_COLUMNS,
+        "rows": [
+            [round(lat, 5), round(lng, 5), n, path[2:], file_name]
+            for lat, lng, n, path, file_name in rows
+        ],
+        "count": sum(row[2] for row in rows),
+    }
+
+
+async def clusters_json_handler(request, datasette):
+    """
+    Photo clusters inside a viewport at a map zoom level.
+
+    Query params: bbox=west,south,east,north and zoom (required). Above
+    MAX_CLUSTER_ZOOM the response is the /-/map/points.json payload, with
+    ``type`` telling the two apart.
+    """
+    boxes = parse_bbox(request.args.get("bbox", ""))
+    if boxes is None:
+        return Response.json(
+            {"error": "bbox must be west,south,east,north"}, status=400
+        )
+    try:
+        zoom = int(request.args.get("zoom", ""))
+    except ValueError:
+        return Response.json({"error": "zoom must be an integer"}, status=400)
+    zoom = max(0, zoom)
+
+    loop = asyncio.get_running_loop()
+    try:
+        if zoom > MAX_CLUSTER_ZOOM:
+            result = await loop.run_in_executor(
+                None, points_in_bbox, boxes, MAP_MAX_LIMIT
+            )
+            result["type"] = "points"
+        else:
+            result = await loop.run_in_executor(None, clusters_in_bbox, boxes, zoom)
+            result["type"] = "clusters"
+    except sqlite3.Error as e:
+        logger.error("Error querying photo clusters: %s", e)
+        return Response.json({"error": "Internal server error"}, status=500)
+    return Response.json(result)
+
+
+async def points_json_handler(request, datasette):
+    """
+    Photos inside a viewport.
+
+    Query params: bbox=west,south,east,north (required) and limit. When more
+    photos fall in the box than ``limit``, the first ``limit`` are returned
+    with ``truncated`` set and ``count`` giving the full number.
+    """
+    boxes = parse_bbox(request.args.get("bbox", ""))
+    if boxes is None:
+        return Response.json(
+            {"error": "bbox must be west,south,east,north"}, status=400
+        )
+    try:
+        limit = int(request.args.get("limit", MAP_DEFAULT_LIMIT))
+    except ValueError:
+        return Response.json({"error": "Invalid limit"}, status=400)
+    limit = max(1, min(limit, MAP_MAX_LIMIT))
+
+    loop = asyncio.get_running_loop()
+    try:
+        result = await loop.run_in_executor(None, points_in_bbox, boxes, limit)
+    except sqlite3.Error as e:
+        logger.error("Error querying photo locations: %s", e)
+        return Response.json({"error": "Internal server error"}, status=500)
+    return Response.json(result)
+
+
+async def extent_json_handler(request, datasette):
+    loop = asyncio.get_running_loop()
+    try:
+        extent = await loop.run_in_executor(None, location_extent)
+    except sqlite3.Error as e:
+        logger.error("Error querying photo location extent: %s", e)
+        return Response.json({"error": "Internal server error"}, status=500)
+    return Response.json({"bounds": extent})
+
+
+@hookimpl
+def register_routes():
+    return [
+        (r"^/-/map/points\.json$", points_json_handler),
+        (r"^/-/map/clusters\.json$", clusters_json_handler),
+        (r"^/-/map/extent\.json$", extent_json_handler),
+    ]
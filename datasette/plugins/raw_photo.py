@@ -1,8 +1,14 @@
 import asyncio
+import hashlib
 import io
 import logging
+import mimetypes
 import sqlite3
 import os
+import re
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
 
 from datasette import hookimpl
 from datasette.utils.asgi import Response
@@ -17,8 +23,426 @@ MEDIAMETA_DB_PATH = os.getenv(
     os.path.join(_default_database_dir, "mediameta.db"),
 )
 
+# Local read-through cache for originals on the external drive. Keep it on
+# fast local storage; MEDIA_CACHE_BYTES=0 turns it off.
+MEDIA_CACHE_DIR = os.getenv(
+    "MEDIA_CACHE_DIR", os.path.join(_default_database_dir, "media-cache")
+)
+MEDIA_CACHE_BYTES = int(os.getenv("MEDIA_CACHE_BYTES", str(10 * 1024**3)))
+
 RAW_EXTENSIONS = {"nef", "cr2", "cr3", "arw", "dng", "raf", "orf", "rw2", "pef", "srw"}
 
+# Originals are streamed in chunks of this size
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Read-ahead: when a photo is served, this many photos on either side of it
+# in gallery order are copied into the media cache (and RAW files converted)
+# by READ_AHEAD_WORKERS background threads. READ_AHEAD_COUNT=0 turns it off.
+READ_AHEAD_COUNT = int(os.getenv("READ_AHEAD_COUNT", "3"))
+READ_AHEAD_WORKERS = int(os.getenv("READ_AHEAD_WORKERS", "2"))
+
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+class _Cancelled(Exception):
+    """Raised inside a read-ahead copy once it is no longer wanted."""
+
+
+class _MediaCache:
+    """
+    Size-bounded directory of copies of original files (kind "original")
+    and files derived from them (kind "jpeg", RAW conversions).
+
+    index.db records each entry's source size and mtime; an entry whose
+    source has changed is dropped on lookup. When the source cannot be
+    stat'ed (drive not connected) the cached copy is served as is.
+
+    Eviction is a two-segment LRU: entries used only once go first, oldest
+    first, so a single pass through the library cannot push out originals
+    that are viewed again and again.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._filling = {}
+        self._conn = None
+        self._total = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(self.directory, exist_ok=True)
+            conn = sqlite3.connect(
+                os.path.join(self.directory, "index.db"), check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS media_cache (
+                    kind TEXT NOT NULL,
+                    source_path TEXT NOT NULL,
+                    file TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    source_size INTEGER NOT NULL,
+                    source_mtime_ns INTEGER NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 1,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (kind, source_path)
+                )
+            """)
+            conn.execute(
+                """CREATE INDEX IF NOT EXISTS idx_media_cache_eviction
+                ON media_cache(hits > 1, last_access)"""
+            )
+            conn.commit()
+            self._total = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM media_cache"
+            ).fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def _local_path(self, kind: str, source_path: str) -> str:
+        digest = hashlib.sha1(f"{kind}:{source_path}".encode()).hexdigest()
+        ext = ".jpg" if kind == "jpeg" else os.path.splitext(source_path)[1].lower()
+        return os.path.join(self.directory, digest[:2], digest + ext)
+
+    def _drop(self, conn, kind: str, source_path: str, file: str, size: int):
+        conn.execute(
+            "DELETE FROM media_cache WHERE kind = ? AND source_path = ?",
+            (kind, source_path),
+        )
+        self._total -= size
+        try:
+            os.unlink(file)
+        except FileNotFoundError:
+            pass
+
+    def lookup(self, kind: str, source_path: str, count: bool = True):
+        """
+        Return the cached file for (kind, source_path), or None. With
+        count=False the lookup is not recorded as an access: no hit/miss
+        statistics and no change to the entry's eviction order.
+        """
+        try:
+            st = os.stat(source_path)
+        except OSError:
+            st = None
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                """SELECT file, size, source_size, source_mtime_ns FROM media_cache
+                   WHERE kind = ? AND source_path = ?""",
+                (kind, source_path),
+            ).fetchone()
+            if row is None:
+                self.misses += count
+                return None
+            file, size, source_size, source_mtime_ns = row
+            stale = st is not None and (st.st_size, st.st_mtime_ns) != (
+                source_size,
+                source_mtime_ns,
+            )
+            if stale or not os.path.exists(file):
+                self._drop(conn, kind, source_path, file, size)
+                conn.commit()
+                self.misses += count
+                return None
+            if not count:
+                return file
+            conn.execute(
+                """UPDATE media_cache SET hits = hits + 1, last_access = ?
+                   WHERE kind = ? AND source_path = ?""",
+                (time.time(), kind, source_path),
+            )
+            conn.commit()
+            self.hits += 1
+            return file
+
+    def _store(self, kind: str, source_path: str, st, write, hits: int = 1) -> str:
+        """
+        Write a new entry with ``write(fileobj)`` and evict to fit. Entries
+        filled by read-ahead start at hits=0, so the first real view leaves
+        them in the once-used segment.
+        """
+        file = self._local_path(kind, source_path)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        tmp = f"{file}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                write(f)
+            os.replace(tmp, file)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+        size = os.path.getsize(file)
+        with self._lock:
+            conn = self._connection()
+            old = conn.execute(
+                "SELECT size FROM media_cache WHERE kind = ? AND source_path = ?",
+                (kind, source_path),
+            ).fetchone()
+            if old:
+                self._total -= old[0]
+            conn.execute(
+                """INSERT OR REPLACE INTO media_cache
+                   (kind, source_path, file, size, source_size, source_mtime_ns,
+                    hits, last_access)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    kind,
+                    source_path,
+                    file,
+                    size,
+                    st.st_size,
+                    st.st_mtime_ns,
+                    hits,
+                    time.time(),
+                ),
+            )
+            self._total += size
+            self._evict(conn, keep=(kind, source_path))
+            conn.commit()
+        return file
+
+    def _evict(self, conn: sqlite3.Connection, keep: tuple):
+        while self._total > self.max_bytes:
+            victims = conn.execute(
+                """SELECT kind, source_path, file, size FROM media_cache
+                   WHERE NOT (kind = ? AND source_path = ?)
+                   ORDER BY hits > 1, last_access LIMIT 64""",
+                keep,
+            ).fetchall()
+            if not victims:
+                break
+            for kind, source_path, file, size in victims:
+                self._drop(conn, kind, source_path, file, size)
+                if self._total <= self.max_bytes:
+                    break
+
+    def _fill(self, key: tuple, fill):
+        """
+        Run ``fill()`` holding the per-entry lock, so concurrent requests for
+        one file copy or render it once; the others wait and then hit.
+        """
+        with self._lock:
+            lock = self._filling.setdefault(key, threading.Lock())
+        try:
+            with lock:
+                return fill()
+        finally:
+            with self._lock:
+                self._filling.pop(key, None)
+
+    def _read_cached(self, kind: str, source_path: str, count: bool = True):
+        cached = self.lookup(kind, source_path, count)
+        if cached is None:
+            return None
+        with open(cached, "rb") as f:
+            return f.read()
+
+    def _open(self, path: str, source_path: str, status: str):
+        """
+        Open a file returned by original() for reading. Eviction unlinks
+        files under self._lock, so the file is opened under it; once open it
+        stays readable even if it is evicted. A copy that was evicted before
+        it could be opened is streamed from the source instead.
+        """
+        if path != source_path:
+            with self._lock:
+                try:
+                    return open(path, "rb"), status
+                except FileNotFoundError:
+                    pass
+            status = "bypass"
+        try:
+            return open(source_path, "rb"), status
+        except FileNotFoundError:
+            return None, "miss"
+
+    def original(
+        self,
+        source_path: str,
+        prefetch: bool = False,
+        cancelled=None,
+        open_file: bool = False,
+    ):
+        """
+        Return (path to read, cache status) for an original: the local copy,
+        filled on first access, or the source itself when the cache is off
+        or the file is too large to cache. The path is None when the file
+        is neither cached nor on disk.
+
+        open_file=True returns an open binary file instead of a path, so a
+        response can stream it while other fills evict entries.
+
+        prefetch=True fills the cache without counting an access; the copy
+        raises _Cancelled as soon as ``cancelled()`` returns true.
+        """
+
+        def result(path, status):
+            if not open_file or path is None:
+                return path, status
+            return self._open(path, source_path, status)
+
+        if not self.enabled:
+            return result(
+                source_path if os.path.exists(source_path) else None, "off"
+            )
+        cached = self.lookup("original", source_path, count=not prefetch)
+        if cached:
+            return result(cached, "hit")
+
+        def fill():
+            # Another request may have filled it while we waited
+            cached = self.lookup("original", source_path, count=False)
+            if cached:
+                return result(cached, "hit")
+            try:
+                st = os.stat(source_path)
+            except OSError:
+                return None, "miss"
+            if st.st_size > self.max_bytes // 4:
+                return result(source_path, "bypass")
+
+            def copy(f):
+                with open(source_path, "rb") as src:
+                    while True:
+                        if cancelled is not None and cancelled():
+                            raise _Cancelled(source_path)
+                        chunk = src.read(STREAM_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+
+            try:
+                file = self._store(
+                    "original", source_path, st, copy, hits=0 if prefetch else 1
+                )
+            except OSError as e:
+                logger.warning("Could not cache %s: %s", source_path, e)
+                return result(source_path, "bypass")
+            return result(file, "miss")
+
+        return self._fill(("original", source_path), fill)
+
+    def rendition(self, kind: str, source_path: str, render, prefetch: bool = False):
+        """
+        Return (bytes, cache status) for a file derived from source_path,
+        calling ``render(path)`` on a miss. The render reads the cached
+        original when there is one. Returns (None, status) when neither the
+        rendition nor the source is available.
+
+        prefetch=True only makes sure the rendition is cached, without
+        counting an access; a rendition that is already cached is not read
+        and (None, "hit") is returned.
+        """
+        if not self.enabled:
+            if not os.path.exists(source_path):
+                return None, "off"
+            return render(source_path), "off"
+        if prefetch:
+            if self.lookup(kind, source_path, count=False):
+                return None, "hit"
+        else:
+            data = self._read_cached(kind, source_path)
+            if data is not None:
+                return data, "hit"
+
+        def fill():
+            data = self._read_cached(kind, source_path, count=False)
+            if data is not None:
+                return data, "hit"
+            read_path = self.lookup("original", source_path, False) or source_path
+            try:
+                st = os.stat(source_path)
+            except OSError:
+                # Drive not connected: render from the cached original, but
+                # there is nothing to verify a stored rendition against
+                if read_path == source_path:
+                    return None, "miss"
+                return render(read_path), "miss"
+            data = render(read_path)
+            try:
+                self._store(
+                    kind,
+                    source_path,
+                    st,
+                    lambda f: f.write(data),
+                    hits=0 if prefetch else 1,
+                )
+            except OSError as e:
+                logger.warning("Could not cache %s of %s: %s", kind, source_path, e)
+            return data, "miss"
+
+        return self._fill((kind, source_path), fill)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            entries = 0
+            if self.enabled:
+                entries = self._connection().execute(
+                    "SELECT COUNT(*) FROM media_cache"
+                ).fetchone()[0]
+            return {
+                "directory": self.directory,
+                "entries": entries,
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+_media_cache = _MediaCache(MEDIA_CACHE_DIR, MEDIA_CACHE_BYTES)
+
+
+class _FileResponse:
+    """
+    Stream an open file in large chunks read off the event loop, closing it
+    afterwards. The file is opened before the response is returned, so a
+    cache entry evicted in the meantime is still readable.
+    """
+
+    def __init__(self, file, content_type: str, headers: dict):
+        self.file = file
+        self.content_type = content_type
+        self.headers = headers
+
+    async def asgi_send(self, send):
+        loop = asyncio.get_running_loop()
+        with self.file as f:
+            size = os.fstat(f.fileno()).st_size
+            headers = dict(self.headers)
+            headers["content-type"] = self.content_type
+            headers["content-length"] = str(size)
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 200,
+                    "headers": [(k.encode(), v.encode()) for k, v in headers.items()],
+                }
+            )
+            while True:
+                chunk = await loop.run_in_executor(None, f.read, STREAM_CHUNK_SIZE)
+                more_body = len(chunk) == STREAM_CHUNK_SIZE
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": more_body,
+                    }
+                )
+                if not more_body:
+                    break
+
 
 def _convert_raw_to_jpeg(filepath: str) -> bytes:
     import rawpy
@@ -32,6 +456,179 @@ def _convert_raw_to_jpeg(filepath: str) -> bytes:
     return buf.getvalue()
 
 
+def _lookup_full_path(filename: str):
+    with sqlite3.connect(MEDIAMETA_DB_PATH) as conn:
+        row = conn.execute(
+            "SELECT full_path FROM exif_with_fullpath WHERE FileName = ?",
+            (filename,),
+        ).fetchone()
+    return row[0] if row else None
+
+
+def _gallery_filters(referer: str) -> tuple:
+    """
+    Return the (start_date, end_date, place) the photo was opened under, from
+    the photo page URL that requested it; they decide which photos are its
+    neighbours and in which order the user is stepping.
+    """
+    args = parse_qs(urlparse(referer or "").query)
+    start_date = (args.get("start_date") or [""])[0].strip()
+    end_date = (args.get("end_date") or [""])[0].strip()
+    if not _DATE_RE.match(start_date):
+        start_date = ""
+    if not _DATE_RE.match(end_date):
+        end_date = ""
+    return start_date, end_date, (args.get("place") or [""])[0].strip()
+
+
+def _neighbour_paths(filename: str, filters: tuple, count: int) -> list:
+    """
+    Return the full paths of up to ``count`` photos on either side of
+    ``filename`` in gallery order, nearest first, alternating between the
+    next and the previous photo. Empty when gallery_items is not built.
+    """
+    start_date, end_date, place = filters
+    params = {"filename": filename, "count": count}
+    where = []
+    if start_date:
+        where.append("n.taken_at >= :start")
+        params["start"] = start_date
+    if end_date:
+        where.append("n.taken_at <= :end || ' 23:59:59'")
+        params["end"] = end_date
+    if place:
+        where.append(
+            "n.path IN (SELECT path FROM photo_places"
+            " WHERE city = :place OR region = :place OR country = :place)"
+        )
+        params["place"] = place
+
+    def side(op: str, direction: str) -> str:
+        conditions = " AND ".join(
+            [f"(n.taken_at, n.path) {op} (g.taken_at, g.path)"] + where
+        )
+        return f"""SELECT * FROM (
+            SELECT e.full_path FROM gallery_items g
+            JOIN gallery_items n ON {conditions}
+            JOIN exif_with_fullpath e ON e.SourceFile = n.path
+            WHERE g.path = (SELECT SourceFile FROM exif WHERE FileName = :filename)
+            ORDER BY n.taken_at {direction}, n.path {direction}
+            LIMIT :count)"""
+
+    try:
+        with sqlite3.connect(f"file:{MEDIAMETA_DB_PATH}?mode=ro", uri=True) as conn:
+            newer = [row[0] for row in conn.execute(side(">", "ASC"), params)]
+            older = [row[0] for row in conn.execute(side("<", "DESC"), params)]
+    except sqlite3.OperationalError:
+        return []
+    # Gallery order is ascending when a start date is set, newest first
+    # otherwise; the photo after this one is read first
+    ahead, behind = (newer, older) if start_date else (older, newer)
+    paths = []
+    for i in range(count):
+        paths.extend(found[i] for found in (ahead, behind) if i < len(found))
+    return [path for path in paths if path]
+
+
+class _ReadAhead:
+    """
+    Background copying of the photos around the one being viewed into the
+    media cache, so stepping through them does not wait on the external
+    drive.
+
+    Each schedule() replaces the whole queue: work for photos that are no
+    longer neighbours is dropped, and copies already running for them are
+    stopped at the next chunk. A RAW conversion that has started runs to
+    completion. At most ``workers`` files are read at once.
+    """
+
+    def __init__(self, cache: _MediaCache, workers: int):
+        self.cache = cache
+        self.workers = workers
+        self.scheduled = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.failed = 0
+        self._pending = []
+        self._running = {}
+        self._threads = []
+        self._condition = threading.Condition()
+
+    def schedule(self, paths: list):
+        with self._condition:
+            wanted = set(paths)
+            for path, cancel in self._running.items():
+                if path not in wanted:
+                    cancel.set()
+            self.cancelled += sum(1 for path in self._pending if path not in wanted)
+            self._pending = [path for path in paths if path not in self._running]
+            self.scheduled += len(self._pending)
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._work, name="media-read-ahead", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+            self._condition.notify_all()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                path = self._pending.pop(0)
+                cancel = threading.Event()
+                self._running[path] = cancel
+            try:
+                self._fetch(path, cancel)
+                outcome = "cancelled" if cancel.is_set() else "completed"
+            except _Cancelled:
+                outcome = "cancelled"
+            except Exception as e:
+                logger.warning("Read-ahead of %s failed: %s", path, e)
+                outcome = "failed"
+            with self._condition:
+                self._running.pop(path, None)
+                setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def _fetch(self, path: str, cancel: threading.Event):
+        self.cache.original(path, prefetch=True, cancelled=cancel.is_set)
+        ext = path.rsplit(".", 1)[-1].lower()
+        if ext in RAW_EXTENSIONS and not cancel.is_set():
+            self.cache.rendition("jpeg", path, _convert_raw_to_jpeg, prefetch=True)
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "count": READ_AHEAD_COUNT,
+                "workers": self.workers,
+                "pending": len(self._pending),
+                "running": len(self._running),
+                "scheduled": self.scheduled,
+                "completed": self.completed,
+                "cancelled": self.cancelled,
+                "failed": self.failed,
+            }
+
+
+_read_ahead = _ReadAhead(_media_cache, READ_AHEAD_WORKERS)
+
+
+async def _schedule_read_ahead(request, filename: str):
+    if READ_AHEAD_COUNT <= 0 or not _media_cache.enabled:
+        return
+    filters = _gallery_filters(request.headers.get("referer"))
+    loop = asyncio.get_running_loop()
+    try:
+        paths = await loop.run_in_executor(
+            None, _neighbour_paths, filename, filters, READ_AHEAD_COUNT
+        )
+    except sqlite3.Error as e:
+        logger.warning("Could not find neighbours of %s: %s", filename, e)
+        return
+    _read_ahead.schedule(paths)
+
+
 async def raw_photo_handler(request, datasette):
     filename = request.url_vars.get("filename", "")
     if not filename:
@@ -42,39 +639,90 @@ async def raw_photo_handler(request, datasette):
         return Response("Not a RAW file", status=400, content_type="text/plain")
 
     try:
-        with sqlite3.connect(MEDIAMETA_DB_PATH) as conn:
-            row = conn.execute(
-                "SELECT full_path FROM exif_with_fullpath WHERE FileName = ?",
-                (filename,),
-            ).fetchone()
+        full_path = _lookup_full_path(filename)
     except sqlite3.Error as e:
         logger.error("Database error looking up %s: %s", filename, e)
         return Response("Internal server error", status=500, content_type="text/plain")
 
-    if not row:
+    if not full_path:
         return Response("Photo not found", status=404, content_type="text/plain")
 
-    full_path = row[0]
-    if not os.path.exists(full_path):
-        return Response("File not on disk", status=404, content_type="text/plain")
-
     try:
         loop = asyncio.get_running_loop()
-        jpeg_bytes = await loop.run_in_executor(None, _convert_raw_to_jpeg, full_path)
+        jpeg_bytes, status = await loop.run_in_executor(
+            None, _media_cache.rendition, "jpeg", full_path, _convert_raw_to_jpeg
+        )
     except Exception as e:
         logger.error("RAW conversion failed for %s: %s", full_path, e)
         return Response("Conversion failed", status=500, content_type="text/plain")
 
+    if jpeg_bytes is None:
+        return Response("File not on disk", status=404, content_type="text/plain")
+
+    # Started once this photo is ready, so it does not compete for the drive
+    await _schedule_read_ahead(request, filename)
+
     return Response(
         jpeg_bytes,
         status=200,
-        headers={"Cache-Control": "max-age=3600"},
+        headers={"Cache-Control": "max-age=3600", "X-Media-Cache": status},
         content_type="image/jpeg",
     )
 
 
+async def original_handler(request, datasette):
+    """Serve an original file, through the local media cache."""
+    filename = request.url_vars.get("filename", "")
+    if not filename:
+        return Response("Missing filename", status=400, content_type="text/plain")
+
+    try:
+        full_path = _lookup_full_path(filename)
+    except sqlite3.Error as e:
+        logger.error("Database error looking up %s: %s", filename, e)
+        return Response("Internal server error", status=500, content_type="text/plain")
+
+    if not full_path:
+        return Response("Photo not found", status=404, content_type="text/plain")
+
+    loop = asyncio.get_running_loop()
+    try:
+        file, status = await loop.run_in_executor(
+            None, lambda: _media_cache.original(full_path, open_file=True)
+        )
+    except OSError as e:
+        logger.error("Error reading %s: %s", full_path, e)
+        return Response("Internal server error", status=500, content_type="text/plain")
+
+    if file is None:
+        return Response("File not on disk", status=404, content_type="text/plain")
+
+    # Read-ahead fills may evict this file's cache entry; it is already open
+    await _schedule_read_ahead(request, filename)
+
+    content_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+    return _FileResponse(
+        file,
+        content_type,
+        {"cache-control": "max-age=3600", "x-media-cache": status},
+    )
+
+
+async def media_cache_stats_handler(request, datasette):
+    loop = asyncio.get_running_loop()
+    try:
+        stats = await loop.run_in_executor(None, _media_cache.stats)
+        stats["read_ahead"] = _read_ahead.stats()
+    except sqlite3.Error as e:
+        logger.error("Error reading media cache index: %s", e)
+        return Response.json({"error": "Internal server error"}, status=500)
+    return Response.json(stats)
+
+
 @hookimpl
 def register_routes():
     return [
         (r"^/raw-photo/(?P<filename>.+)$", raw_photo_handler),
+        (r"^/original/(?P<filename>.+)$", original_handler),
+        (r"^/-/media-cache$", media_cache_stats_handler),
     ]
@@ -65,6 +65,23 @@ def _load_embeddings():
     return _embeddings_cache
 
 
+def _load_placeholders(source_files):
+    """Map SourceFile -> (blurhash, color) from thumb_placeholders."""
+    if not source_files:
+        return {}
+    try:
+        with sqlite3.connect(MEDIAMETA_DB_PATH) as conn:
+            placeholders = ",".join("?" for _ in source_files)
+            rows = conn.execute(
+                f"SELECT path, blurhash, color FROM thumb_placeholders WHERE path IN ({placeholders})",
+                source_files,
+            ).fetchall()
+    except sqlite3.Error:
+        # Placeholders are optional (scripts/compute_thumb_placeholders.py)
+        return {}
+    return {row[0]: (row[1], row[2]) for row in rows}
+
+
 def _cosine_similarity(vec_a, norm_a, vec_b, norm_b):
     if norm_a == 0 or norm_b == 0:
         return 0.0
@@ -97,21 +114,31 @@ async def search_handler(request, datasette):
     if end_date and not _DATE_RE.match(end_date):
         end_date = ""
 
-    # If date filters are provided, build a map of SourceFile -> CreateDate
-    # so we can restrict search results to the date range
+    place = request.args.get("place", "").strip()
+
+    # If date or place filters are provided, build a map of SourceFile ->
+    # CreateDate so we can restrict search results to them. gallery_items has
+    # a normalized taken_at, so the range is an index scan; photo_places is
+    # indexed on each place column.
     date_map = {}
     date_filter_ids = None
-    if start_date or end_date:
+    if start_date or end_date or place:
         try:
             with sqlite3.connect(MEDIAMETA_DB_PATH) as conn:
-                sql = "SELECT SourceFile, CreateDate FROM exif WHERE CreateDate IS NOT NULL"
+                sql = "SELECT path, taken_at FROM gallery_items WHERE 1 = 1"
                 params = []
                 if start_date:
-                    sql += " AND CreateDate >= ?"
+                    sql += " AND taken_at >= ?"
                     params.append(start_date)
                 if end_date:
-                    sql += " AND (CreateDate <= ? || ' 23:59:59' OR CreateDate LIKE ? || '%')"
-                    params.extend([end_date, end_date])
+                    sql += " AND taken_at <= ? || ' 23:59:59'"
+                    params.append(end_date)
+                if place:
+                    sql += (
+                        " AND path IN (SELECT path FROM photo_places"
+                        " WHERE city = ? OR region = ? OR country = ?)"
+                    )
+                    params.extend([place] * 3)
                 rows = conn.execute(sql, params).fetchall()
         except sqlite3.Error:
             return Response.json(
@@ -159,14 +186,19 @@ async def search_handler(request, datasette):
             except sqlite3.Error:
                 pass
 
+    placeholder_map = _load_placeholders([row_id for _, row_id, _ in top_scores])
+
     results = []
     for score, row_id, content in top_scores:
+        blurhash, color = placeholder_map.get(row_id, (None, None))
         results.append(
             {
                 "id": row_id,
                 "score": round(score, 4),
                 "content": content or "",
                 "date": date_map.get(row_id) or "",
+                "blurhash": blurhash,
+                "color": color,
             }
         )
 
@@ -0,0 +1,682 @@
+import asyncio
+import hashlib
+import io
+import logging
+import mmap
+import os
+import re
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode
+
+from datasette import hookimpl
+from datasette.utils.asgi import Response
+
+_src_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "src"))
+if _src_dir not in sys.path:
+    sys.path.insert(0, _src_dir)
+from gallery_tables import create_thumb_placeholders_table
+
+logger = logging.getLogger(__name__)
+
+_default_database_dir = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "..", "database")
+)
+MEDIAMETA_DB_PATH = os.getenv(
+    "MEDIAMETA_DB_PATH",
+    os.path.join(_default_database_dir, "mediameta.db"),
+)
+
+# Optional packed thumbnail store built by scripts/thumb_pack.py. When set,
+# thumbnails are served from the pack first and thumbImages is the fallback.
+THUMB_PACK_PATH = os.getenv("THUMB_PACK_PATH", "")
+
+# Byte budget for the in-process thumbnail cache (default 64 MB, roughly
+# 1,000 of the 512x512 thumbnails).
+THUMB_CACHE_BYTES = int(os.getenv("THUMB_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+# Rendition sizes built by scripts/build_thumbnail_pyramid.py. The largest
+# matches the originals in thumbImages (512x512).
+THUMB_SIZES = (128, 256, 512)
+THUMB_MAX_SIZE = THUMB_SIZES[-1]
+
+# Byte budget for rendered contact sheets (default 32 MB).
+SHEET_CACHE_BYTES = int(os.getenv("SHEET_CACHE_BYTES", str(32 * 1024 * 1024)))
+SHEET_MAX_TILES = 200
+SHEET_DEFAULT_COLUMNS = 10
+# libwebp cannot encode an image wider or taller than 16383 px, and a sheet
+# is held in memory as RGB while it is packed (3 bytes per pixel), so large
+# tiles are stepped down to the next pyramid level until the sheet fits.
+SHEET_MAX_SIDE = 16383
+SHEET_MAX_PIXELS = 32 * 1024 * 1024
+GALLERY_PAGE_SIZE = 100
+
+# Pages link thumbnails as /thumb/<path>?v=<thumbImages.etag>, so a
+# reloaded thumbnail gets a new URL and a versioned response can be cached
+# for good. Without ?v= the URL is keyed by path only: browsers revalidate
+# it on every use, and the content-hash ETag makes that a 304.
+_THUMB_CACHE_CONTROL = "public, max-age=31536000, immutable"
+_THUMB_UNVERSIONED_CACHE_CONTROL = "public, no-cache"
+
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+_MAGIC_CONTENT_TYPES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+]
+
+
+def _sniff_content_type(data: bytes) -> str:
+    """Detect the image type from magic bytes (thumbnails keep the source extension)."""
+    for magic, content_type in _MAGIC_CONTENT_TYPES:
+        if data.startswith(magic):
+            return content_type
+    if data[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1", b"ftypmsf1"):
+        return "image/heic"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+class _BlobLRU:
+    """Thread-safe LRU of thumbnail entries bounded by total byte size."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        size = len(entry[0])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= len(old[0])
+            self._entries[key] = entry
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted[0])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+class _PackStore:
+    """
+    Read-only view of an append-only thumbnail pack.
+
+    The index is a small SQLite database (pack_meta + pack_entries) that maps
+    (path, size, format) to an offset/length in the data file named by
+    pack_meta.data_file. The data file is memory-mapped, so reads are a slice
+    of the page cache with no SQLite involvement. Each entry's source_etag
+    is the thumbImages.etag it was made from, so entries of a thumbnail
+    that has been reloaded since are skipped.
+    """
+
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._maps = {}
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                f"file:{self.index_path}?mode=ro", uri=True, check_same_thread=False
+            )
+            self._local.conn = conn
+            self._local.data_version = None
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._local.data_version:
+            if self._local.data_version is not None:
+                logger.info("Thumbnail pack changed, clearing thumbnail caches")
+                _cache.clear()
+                _sheet_cache.clear()
+            self._local.data_version = data_version
+            # Indexes written before source_etag existed
+            self._local.has_source_etag = "source_etag" in [
+                row[1] for row in conn.execute("PRAGMA table_info(pack_entries)")
+            ]
+        return conn
+
+    def _map(self, data_file: str, min_size: int) -> mmap.mmap:
+        """
+        Return a mapping of data_file covering at least min_size bytes.
+
+        The file is remapped when it has grown. Mappings of older generations
+        are dropped from the dict but stay valid for any thread still reading
+        them, so compaction never pulls bytes out from under a request.
+        """
+        with self._lock:
+            mapped = self._maps.get(data_file)
+            if mapped is None or len(mapped) < min_size:
+                with open(data_file, "rb") as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps = {data_file: mapped}
+            return mapped
+
+    def read(self, path: str, size: int, formats: tuple, source_etag=None):
+        """
+        Return (content, etag, content_type) for the best entry, or None.
+        With ``source_etag``, entries made from another version of the
+        thumbnail are skipped.
+        """
+        conn = self._connection()
+        placeholders = ",".join("?" for _ in formats)
+        source_filter = ""
+        params = [path, size, *formats]
+        if source_etag is not None and self._local.has_source_etag:
+            source_filter = "AND (source_etag IS NULL OR source_etag = ?)"
+            params.append(source_etag)
+        # The entry and the data file name come from one statement, so they
+        # belong to the same generation even while compact is switching over
+        sql = f"""SELECT offset, length, etag, content_type,
+                      (SELECT value FROM pack_meta WHERE key = 'data_file')
+                  FROM pack_entries
+                  WHERE path = ?
+                  AND ((size >= ? AND format IN ({placeholders})) OR format = 'original')
+                  {source_filter}
+                  ORDER BY format = 'original', size, format = 'jpeg'
+                  LIMIT 1"""
+        for attempt in range(2):
+            row = conn.execute(sql, params).fetchone()
+            if not row:
+                return None
+            offset, length, etag, content_type, data_file = row
+            data_file = os.path.join(os.path.dirname(self.index_path), data_file)
+            try:
+                mapped = self._map(data_file, offset + length)
+            except FileNotFoundError:
+                # compact committed and removed this generation before it was
+                # mapped here; the next query sees the new one
+                if attempt:
+                    raise
+                continue
+            return mapped[offset : offset + length], etag, content_type
+
+
+_cache = _BlobLRU(THUMB_CACHE_BYTES)
+_sheet_cache = _BlobLRU(SHEET_CACHE_BYTES)
+_local = threading.local()
+_pack = (
+    _PackStore(THUMB_PACK_PATH)
+    if THUMB_PACK_PATH and os.path.exists(THUMB_PACK_PATH)
+    else None
+)
+
+
+def _has_table(conn: sqlite3.Connection, name: str) -> bool:
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)
+    ).fetchone()
+    return row is not None
+
+
+def _get_connection() -> sqlite3.Connection:
+    """Return this thread's read-only connection to mediameta.db."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(
+            f"file:{MEDIAMETA_DB_PATH}?mode=ro", uri=True, check_same_thread=False
+        )
+        _local.conn = conn
+        _local.data_version = None
+    return conn
+
+
+def _check_data_version(conn: sqlite3.Connection):
+    """
+    Drop the caches when another connection has committed to mediameta.db.
+    A thread's first check only records the version, like
+    _PackStore._connection().
+    """
+    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    if data_version != _local.data_version:
+        if _local.data_version is not None:
+            logger.info("mediameta.db changed, clearing thumbnail caches")
+            _cache.clear()
+            _sheet_cache.clear()
+        _local.data_version = data_version
+        _local.has_renditions = _has_table(conn, "thumb_renditions")
+        _local.has_rendition_etags = "source_etag" in [
+            row[1] for row in conn.execute("PRAGMA table_info(thumb_renditions)")
+        ]
+        _local.has_etags = "etag" in [
+            row[1] for row in conn.execute("PRAGMA table_info(thumbImages)")
+        ]
+
+
+def _check_for_changes():
+    """Clear the caches if mediameta.db or the thumbnail pack has changed."""
+    _check_data_version(_get_connection())
+    if _pack is not None:
+        _pack._connection()
+
+
+def _read_blob(conn: sqlite3.Connection, table: str, rowid: int):
+    with conn.blobopen(table, "content", rowid, readonly=True) as blob:
+        content = blob.read()
+    etag = '"' + hashlib.blake2b(content, digest_size=16).hexdigest() + '"'
+    return content, etag, _sniff_content_type(content)
+
+
+def _read_thumbnail(path: str, size: int, formats: tuple):
+    """
+    Read the smallest rendition of a thumbnail that is at least ``size`` pixels,
+    in the first acceptable format, with incremental BLOB I/O.
+
+    Falls back to the original 512px thumbnail in ``thumbImages`` when no
+    rendition fits. Thumbnails found in the pack store (THUMB_PACK_PATH) are
+    served from there. Pack entries and renditions made from another version
+    of the thumbnail than thumbImages holds are skipped. Returns
+    (content, etag, content_type), or None if there is no thumbnail.
+    """
+    conn = _get_connection()
+    _check_data_version(conn)
+    source_etag = None
+    unhashed = False
+    if _local.has_etags:
+        row = conn.execute(
+            "SELECT etag, content IS NOT NULL FROM thumbImages WHERE path = ?",
+            (path,),
+        ).fetchone()
+        if row is not None:
+            source_etag = row[0]
+            # A reloaded thumbnail that has not been hashed yet
+            unhashed = source_etag is None and bool(row[1])
+    # Only thumbImages is known to hold an unhashed thumbnail's current content
+    if _pack is not None and not unhashed:
+        entry = _pack.read(path, size, formats, source_etag)
+        if entry is not None:
+            return entry
+    if _local.has_renditions and not unhashed:
+        placeholders = ",".join("?" for _ in formats)
+        params = [path, size, *formats]
+        source_filter = ""
+        if source_etag is not None and _local.has_rendition_etags:
+            source_filter = "AND (source_etag IS NULL OR source_etag = ?)"
+            params.append(source_etag)
+        row = conn.execute(
+            f"""SELECT rowid FROM thumb_renditions
+                WHERE path = ? AND size >= ? AND format IN ({placeholders})
+                {source_filter}
+                ORDER BY size, format = 'jpeg'
+                LIMIT 1""",
+            params,
+        ).fetchone()
+        if row:
+            return _read_blob(conn, "thumb_renditions", row[0])
+
+    row = conn.execute(
+        "SELECT rowid FROM thumbImages WHERE path = ? AND content IS NOT NULL",
+        (path,),
+    ).fetchone()
+    if not row:
+        return None
+    return _read_blob(conn, "thumbImages", row[0])
+
+
+def _cached_thumbnail(path: str, size: int, formats: tuple):
+    """_read_thumbnail() through the LRU, after checking for changes."""
+    _check_for_changes()
+    key = (path, size, formats)
+    entry = _cache.get(key)
+    if entry is None:
+        entry = _read_thumbnail(path, size, formats)
+        if entry is not None:
+            _cache.put(key, entry)
+    return entry
+
+
+async def _load_thumbnail(path: str, size: int = THUMB_MAX_SIZE, formats=("jpeg",)):
+    # The change check runs SQLite queries, so hits go through the executor too
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, _cached_thumbnail, path, size, formats)
+
+
+def _requested_size(request) -> int:
+    """Round ``?size=`` (display size in pixels) up to the next pyramid level."""
+    try:
+        size = int(request.args.get("size", THUMB_MAX_SIZE))
+    except ValueError:
+        return THUMB_MAX_SIZE
+    return next((level for level in THUMB_SIZES if level >= size), THUMB_MAX_SIZE)
+
+
+def _accepted_formats(request) -> tuple:
+    if "image/webp" in request.headers.get("accept", ""):
+        return ("webp", "jpeg")
+    return ("jpeg",)
+
+
+async def thumb_handler(request, datasette):
+    key = request.url_vars.get("key", "")
+    if not key:
+        return Response("Missing thumbnail key", status=400, content_type="text/plain")
+
+    try:
+        entry = await _load_thumbnail(
+            "./" + key, _requested_size(request), _accepted_formats(request)
+        )
+    except sqlite3.Error as e:
+        logger.error("Database error reading thumbnail %s: %s", key, e)
+        return Response("Internal server error", status=500, content_type="text/plain")
+
+    if entry is None:
+        return Response("Thumbnail not found", status=404, content_type="text/plain")
+
+    content, etag, content_type = entry
+    headers = {
+        "Cache-Control": _THUMB_CACHE_CONTROL
+        if request.args.get("v")
+        else _THUMB_UNVERSIONED_CACHE_CONTROL,
+        "ETag": etag,
+        "Vary": "Accept",
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response("", status=304, headers=headers)
+
+    return Response(content, status=200, headers=headers, content_type=content_type)
+
+
+def _gallery_ids(start_date: str, end_date: str, page: int, place: str = "") -> list:
+    """Return the thumbnail keys shown on one page of /gallery, in display order."""
+    conn = _get_connection()
+    params = {"limit": GALLERY_PAGE_SIZE, "offset": (page - 1) * GALLERY_PAGE_SIZE}
+    clauses = []
+    if place:
+        clauses.append(
+            "path IN (SELECT path FROM photo_places"
+            " WHERE city = :place OR region = :place OR country = :place)"
+        )
+        params["place"] = place
+    if start_date:
+        clauses.append("taken_at >= :start")
+        params["start"] = start_date
+    if end_date:
+        clauses.append("taken_at <= :end || ' 23:59:59'")
+        params["end"] = end_date
+    direction = "ASC" if start_date else "DESC"
+    sql = "SELECT path FROM gallery_items"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += f" ORDER BY taken_at {direction}, path {direction} LIMIT :limit OFFSET :offset"
+    return [row[0][2:] for row in conn.execute(sql, params)]
+
+
+def _sheet_ids(request) -> list:
+    """Resolve ``?ids=a,b,c`` or the gallery's filter/page parameters to an id list."""
+    _check_data_version(_get_connection())
+    ids = request.args.get("ids", "").strip()
+    if ids:
+        return [i for i in ids.split(",") if i][:SHEET_MAX_TILES]
+
+    start_date = request.args.get("start_date", "").strip()
+    end_date = request.args.get("end_date", "").strip()
+    place = request.args.get("place", "").strip()
+    if start_date and not _DATE_RE.match(start_date):
+        start_date = ""
+    if end_date and not _DATE_RE.match(end_date):
+        end_date = ""
+    try:
+        page = max(1, int(request.args.get("page", "1")))
+    except ValueError:
+        page = 1
+    return _gallery_ids(start_date, end_date, page, place)
+
+
+def _sheet_layout(request, ids: list) -> tuple:
+    """
+    Return (tile, columns) for a contact sheet request, keeping both sides
+    within SHEET_MAX_SIDE and the area within SHEET_MAX_PIXELS.
+    """
+    requested = _requested_size(request) if "size" in request.args else 256
+    try:
+        requested_columns = int(request.args.get("columns", SHEET_DEFAULT_COLUMNS))
+    except ValueError:
+        requested_columns = SHEET_DEFAULT_COLUMNS
+    for tile in sorted((s for s in THUMB_SIZES if s <= requested), reverse=True):
+        max_tiles_per_side = SHEET_MAX_SIDE // tile
+        columns = max(1, min(requested_columns, 50, max_tiles_per_side, len(ids)))
+        # Enough columns that the rows fit too
+        columns = max(columns, -(-len(ids) // max_tiles_per_side))
+        rows = -(-len(ids) // columns)
+        if columns * rows * tile * tile <= SHEET_MAX_PIXELS:
+            break
+    return tile, columns
+
+
+def _sheet_offsets(ids: list, tile: int, columns: int) -> list:
+    return [
+        {
+            "id": key,
+            "x": (i % columns) * tile,
+            "y": (i // columns) * tile,
+            "w": tile,
+            "h": tile,
+        }
+        for i, key in enumerate(ids)
+    ]
+
+
+def _decode_thumbnail(content: bytes):
+    from PIL import Image
+
+    try:
+        img = Image.open(io.BytesIO(content))
+        img.load()
+    except Exception:
+        import pyheif
+
+        heif = pyheif.read(content)
+        img = Image.frombytes(
+            heif.mode, heif.size, heif.data, "raw", heif.mode, heif.stride
+        )
+    return img.convert("RGB")
+
+
+def _render_sheet(ids: list, tile: int, columns: int, fmt: str):
+    """
+    Pack the thumbnails for ``ids`` into one image of square, centre-cropped
+    tiles. Returns (content, etag, content_type, missing_ids).
+    """
+    from PIL import Image, ImageOps
+
+    rows = (len(ids) + columns - 1) // columns
+    sheet = Image.new("RGB", (columns * tile, max(rows, 1) * tile), (26, 26, 26))
+    missing = []
+    formats = ("webp", "jpeg") if fmt == "webp" else ("jpeg",)
+    for i, key in enumerate(ids):
+        entry = _cache.get(("./" + key, tile, formats))
+        if entry is None:
+            entry = _read_thumbnail("./" + key, tile, formats)
+        if entry is None:
+            missing.append(key)
+            continue
+        try:
+            img = _decode_thumbnail(entry[0])
+        except Exception as e:
+            logger.warning("Could not decode thumbnail %s: %s", key, e)
+            missing.append(key)
+            continue
+        img = ImageOps.fit(img, (tile, tile), Image.Resampling.LANCZOS)
+        sheet.paste(img, ((i % columns) * tile, (i // columns) * tile))
+
+    buf = io.BytesIO()
+    if fmt == "webp":
+        sheet.save(buf, format="WEBP", quality=78, method=4)
+    else:
+        sheet.save(buf, format="JPEG", quality=82, optimize=True, progressive=True)
+    content = buf.getvalue()
+    etag = '"' + hashlib.blake2b(content, digest_size=16).hexdigest() + '"'
+    return content, etag, f"image/{fmt}", missing
+
+
+def _ids_digest(ids: list) -> str:
+    return hashlib.blake2b("\n".join(ids).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _sheet_version(ids: list):
+    """
+    Digest of the ids and their thumbnails' content hashes, used as the
+    ``v`` parameter of the sheet image URL. None when thumbImages has no
+    etag column yet.
+    """
+    conn = _get_connection()
+    _check_data_version(conn)
+    if not _local.has_etags or not ids:
+        return None
+    placeholders = ",".join("?" for _ in ids)
+    etags = dict(
+        conn.execute(
+            f"SELECT path, etag FROM thumbImages WHERE path IN ({placeholders})",
+            ["./" + key for key in ids],
+        )
+    )
+    digest = hashlib.blake2b(digest_size=16)
+    for key in ids:
+        digest.update(f"{key}\t{etags.get('./' + key) or ''}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+async def contact_sheet_json_handler(request, datasette):
+    """
+    Offset map for a contact sheet. The matching image is at
+    /-/contact-sheet.img with the same query string plus ``v``, a version
+    that changes whenever one of its thumbnails does.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        ids = await loop.run_in_executor(None, _sheet_ids, request)
+        version = await loop.run_in_executor(None, _sheet_version, ids)
+    except sqlite3.Error as e:
+        logger.error("Database error resolving contact sheet ids: %s", e)
+        return Response.json({"error": "Internal server error"}, status=500)
+
+    tile, columns = _sheet_layout(request, ids)
+    args = [(k, v) for k, v in parse_qsl(request.query_string) if k != "v"]
+    if version:
+        args.append(("v", version))
+    query = urlencode(args)
+    return Response.json(
+        {
+            "image": "/-/contact-sheet.img" + (f"?{query}" if query else ""),
+            "key": _ids_digest(ids),
+            "tile": tile,
+            "columns": columns,
+            "width": columns * tile,
+            "height": ((len(ids) + columns - 1) // columns) * tile,
+            "tiles": _sheet_offsets(ids, tile, columns),
+        }
+    )
+
+
+async def contact_sheet_image_handler(request, datasette):
+    loop = asyncio.get_running_loop()
+    try:
+        ids = await loop.run_in_executor(None, _sheet_ids, request)
+    except sqlite3.Error as e:
+        logger.error("Database error resolving contact sheet ids: %s", e)
+        return Response("Internal server error", status=500, content_type="text/plain")
+    if not ids:
+        return Response("No thumbnails", status=404, content_type="text/plain")
+
+    tile, columns = _sheet_layout(request, ids)
+    fmt = "webp" if "webp" in _accepted_formats(request) else "jpeg"
+    key = f"{_ids_digest(ids)}-{tile}-{columns}-{fmt}"
+    entry = _sheet_cache.get(key)
+    if entry is None:
+        try:
+            entry = await loop.run_in_executor(
+                None, _render_sheet, ids, tile, columns, fmt
+            )
+        except sqlite3.Error as e:
+            logger.error("Database error rendering contact sheet: %s", e)
+            return Response(
+                "Internal server error", status=500, content_type="text/plain"
+            )
+        except (OSError, ValueError, MemoryError) as e:
+            logger.error("Could not encode contact sheet %s: %s", key, e)
+            return Response(
+                "Could not render contact sheet", status=500, content_type="text/plain"
+            )
+        _sheet_cache.put(key, entry)
+
+    content, etag, content_type, missing = entry
+    headers = {
+        "Cache-Control": _THUMB_CACHE_CONTROL
+        if request.args.get("v")
+        else "public, max-age=3600",
+        "ETag": etag,
+        "Vary": "Accept",
+    }
+    if missing:
+        headers["X-Missing-Tiles"] = str(len(missing))
+    if request.headers.get("if-none-match") == etag:
+        return Response("", status=304, headers=headers)
+    return Response(content, status=200, headers=headers, content_type=content_type)
+
+
+async def thumb_stats_handler(request, datasette):
+    return Response.json({"thumbnails": _cache.stats(), "sheets": _sheet_cache.stats()})
+
+
+@hookimpl
+def startup(datasette):
+    # The gallery template LEFT JOINs thumb_placeholders, so make sure it
+    # exists even before scripts/compute_thumb_placeholders.py has been run.
+    async def inner():
+        try:
+            db = datasette.get_database("mediameta")
+        except KeyError:
+            return
+        if not db.is_mutable:
+            return
+        await db.execute_write_fn(create_thumb_placeholders_table)
+
+    return inner
+
+
+@hookimpl
+def register_routes():
+    return [
+        (r"^/thumb/(?P<key>.+)$", thumb_handler),
+        (r"^/-/thumb-cache$", thumb_stats_handler),
+        (r"^/-/contact-sheet\.json$", contact_sheet_json_handler),
+        (r"^/-/contact-sheet\.img$", contact_sheet_image_handler),
+    ]
@@ -13,17 +13,14 @@ Usage:
 """
 
 import argparse
-import json
 import math
 import sys
 from collections import defaultdict
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
 
-def load_json(json_path: Path) -> list:
-    """Load JSON data."""
-    with open(json_path, "r") as f:
-        return json.load(f)
+from result_log import find_results, latest_per_file, read_results  # noqa: E402
 
 
 def median(lst: list) -> float:
@@ -44,21 +41,23 @@ def std_dev(lst: list) -> float:
     return math.sqrt(variance)
 
 
-def analyze_times(data: list, extensions: list | None = None) -> dict:
+def analyze_times(data, extensions: list | None = None) -> tuple[dict, int]:
     """
     Analyze processing times by extension and model.
 
     Args:
-        data: List of records from JSON
+        data: Iterable of result records, e.g. latest_per_file(read_results())
         extensions: List of extensions to filter (None = all)
 
     Returns:
-        Dict with analysis results
+        Tuple of (dict with analysis results, number of records read)
     """
     # Group times by extension and model
     by_ext = defaultdict(lambda: defaultdict(list))
+    count = 0
 
     for r in data:
+        count += 1
         if r.get("generation_time_seconds") and not r.get("error"):
             ext = (
                 Path(r["file"]).suffix.upper().lstrip(".")
@@ -71,7 +70,7 @@ def analyze_times(data: list, extensions: list | None = None) -> dict:
                 by_ext[ext][model].append(t)
                 by_ext[ext]["_all"].append(t)
 
-    return by_ext
+    return by_ext, count
 
 
 def print_stats(times: list, label: str, indent: int = 0):
@@ -126,8 +125,8 @@ def main():
     )
     parser.add_argument(
         "--json-file",
-        default="outputs/image_analysis.json",
-        help="Path to JSON file (default: outputs/image_analysis.json)",
+        default=find_results("outputs"),
+        help="Result log or JSON file (default: outputs/image_analysis.jsonl)",
     )
     parser.add_argument(
         "--ext",
@@ -144,13 +143,9 @@ def main():
 
     json_path = Path(args.json_file)
     if not json_path.exists():
-        print(f"Error: JSON file not found: {json_path}")
+        print(f"Error: Results file not found: {json_path}")
         sys.exit(1)
 
-    # Load data
-    data = load_json(json_path)
-    print(f"Loaded {len(data):,} records from {json_path}")
-
     # Normalize extensions
     extensions = None
     if args.extensions:
@@ -162,8 +157,12 @@ def main():
             "(Defaulting to NEF files. Use --all for all extensions or --ext to specify)"
         )
 
-    # Analyze
-    by_ext = analyze_times(data, extensions)
+    # Analyze each file's latest record; retried and re-run images are in
+    # the log more than once
+    by_ext, count = analyze_times(
+        latest_per_file(read_results(str(json_path))), extensions
+    )
+    print(f"Read {count:,} records from {json_path}")
 
     if not by_ext:
         print("No matching records found")
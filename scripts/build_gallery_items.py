@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Build or refresh gallery_items and gallery_day_counts (see src/gallery_tables.py).
+
+Usage:
+    python scripts/build_gallery_items.py
+    python scripts/build_gallery_items.py --rebuild
+"""
+
+import argparse
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+from gallery_tables import create_gallery_tables, refresh
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build or refresh the gallery_items table"
+    )
+    parser.add_argument(
+        "--database",
+        default="database/mediameta.db",
+        help="Path to SQLite database (default: database/mediameta.db)",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Drop and rebuild the tables instead of refreshing them",
+    )
+    args = parser.parse_args()
+
+    db_path = Path(args.database)
+    if not db_path.exists():
+        print(f"Error: Database not found: {db_path}")
+        sys.exit(1)
+
+    conn = sqlite3.connect(db_path)
+    if args.rebuild:
+        print("Dropping gallery_items and gallery_day_counts...")
+        conn.execute("DROP TABLE IF EXISTS gallery_items")
+        conn.execute("DROP TABLE IF EXISTS gallery_day_counts")
+        conn.commit()
+    create_gallery_tables(conn)
+    conn.commit()
+
+    print(f"Refreshing gallery_items in {db_path}...")
+    start = time.time()
+    result = refresh(conn)
+    if result["skipped"]:
+        print(f"  Skipped {result['skipped']:,} photos without a usable CreateDate")
+    print(f"  Recomputed counts for {result['days']:,} days")
+    total = conn.execute("SELECT COUNT(*) FROM gallery_items").fetchone()[0]
+    days = conn.execute("SELECT COUNT(*) FROM gallery_day_counts").fetchone()[0]
+    conn.execute("ANALYZE gallery_items")
+    conn.commit()
+    conn.close()
+
+    print("\n=== Summary ===")
+    print(f"Rows inserted: {result['inserted']:,}")
+    print(f"Rows deleted: {result['deleted']:,}")
+    print(f"Rows with a new thumbnail: {result['updated']:,}")
+    print(f"Gallery items: {total:,} over {days:,} days")
+    print(f"Elapsed: {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
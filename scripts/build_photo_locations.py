@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Build or refresh the photo_locations table and its R*Tree spatial index.
+
+exif stores GPSLatitude/GPSLongitude as text (decimal degrees, or exiftool's
+"37 deg 46' 29.64\" N" form). This script parses them once into REAL lat/lng
+columns for every geotagged photo that has a thumbnail, and indexes them in
+photo_locations_rtree, which triggers keep in sync with photo_locations.
+datasette/plugins/photo_map.py answers bounding-box queries from the index,
+so the map only loads the points in view.
+
+photo_clusters is a precomputed grid pyramid over the same points: for
+every map zoom level up to MAX_CLUSTER_ZOOM, each occupied Web Mercator
+cell of CELL_PX screen pixels stores its photo count, centroid and a
+representative photo. The finest level is built from the points and each
+coarser level from the one below, so the map can ask for the clusters in
+view at its zoom level instead of receiving every marker.
+
+A refresh compares photo_locations against exif/thumbImages and only
+applies the difference, then rebuilds the clusters if anything changed;
+re-run it after loading new EXIF data.
+
+Usage:
+    python scripts/build_photo_locations.py
+    python scripts/build_photo_locations.py --rebuild
+"""
+
+import argparse
+import math
+import re
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+# Cluster cells are CELL_PX screen pixels square; a TILE_PX map tile holds
+# (TILE_PX / CELL_PX)^2 cells, so zoom z uses a grid of 2^(z + CELL_SHIFT)
+# cells a side (both sizes are powers of two)
+TILE_PX = 256
+CELL_PX = 64
+CELL_SHIFT = (TILE_PX // CELL_PX).bit_length() - 1
+MAX_CLUSTER_ZOOM = 16
+MAX_MERCATOR_LAT = 85.05112878
+
+_DMS_RE = re.compile(
+    r"^\s*(-?\d+(?:\.\d+)?)\s*(?:deg|°)?\s*(?:(\d+(?:\.\d+)?)\s*'?)?\s*"
+    r"(?:(\d+(?:\.\d+)?)\s*\"?)?\s*([NSEW])?\s*$",
+    re.IGNORECASE,
+)
+
+
+def create_tables(conn: sqlite3.Connection):
+    """Create photo_locations, its R*Tree index and the sync triggers."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS photo_locations (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL UNIQUE,
+            file_name TEXT NOT NULL,
+            create_date TEXT,
+            lat REAL NOT NULL,
+            lng REAL NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS photo_locations_rtree
+        USING rtree(id, min_lat, max_lat, min_lng, max_lng)
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS photo_locations_ai
+        AFTER INSERT ON photo_locations BEGIN
+            INSERT INTO photo_locations_rtree (id, min_lat, max_lat, min_lng, max_lng)
+            VALUES (new.id, new.lat, new.lat, new.lng, new.lng);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS photo_locations_ad
+        AFTER DELETE ON photo_locations BEGIN
+            DELETE FROM photo_locations_rtree WHERE id = old.id;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS photo_locations_au
+        AFTER UPDATE OF lat, lng ON photo_locations BEGIN
+            UPDATE photo_locations_rtree
+            SET min_lat = new.lat, max_lat = new.lat,
+                min_lng = new.lng, max_lng = new.lng
+            WHERE id = new.id;
+        END
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS photo_clusters (
+            zoom INTEGER NOT NULL,
+            x INTEGER NOT NULL,
+            y INTEGER NOT NULL,
+            n INTEGER NOT NULL,
+            lat REAL NOT NULL,
+            lng REAL NOT NULL,
+            path TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            PRIMARY KEY (zoom, x, y)
+        ) WITHOUT ROWID
+    """)
+    conn.commit()
+
+
+def parse_coordinate(value, limit: float):
+    """
+    Parse a GPS coordinate to signed decimal degrees.
+
+    Accepts plain decimals and degrees/minutes/seconds with an optional
+    N/S/E/W suffix. Returns None for empty, unparseable or out-of-range
+    values (abs > limit).
+    """
+    if value is None or value == "":
+        return None
+    try:
+        degrees = float(value)
+    except (TypeError, ValueError):
+        match = _DMS_RE.match(str(value))
+        if not match:
+            return None
+        deg, minutes, seconds, hemisphere = match.groups()
+        degrees = abs(float(deg)) + float(minutes or 0) / 60 + float(seconds or 0) / 3600
+        if deg.startswith("-") or (hemisphere and hemisphere.upper() in "SW"):
+            degrees = -degrees
+    if degrees != degrees or abs(degrees) > limit:
+        return None
+    return degrees
+
+
+def load_source_locations(conn: sqlite3.Connection) -> dict:
+    """Return {path: (file_name, create_date, lat, lng)} for geotagged photos."""
+    locations = {}
+    skipped = 0
+    for path, file_name, create_date, gps_lat, gps_lng in conn.execute("""
+        SELECT e.SourceFile, e.FileName, e.CreateDate, e.GPSLatitude, e.GPSLongitude
+        FROM exif e
+        WHERE e.GPSLatitude IS NOT NULL AND e.GPSLatitude != ''
+        AND e.GPSLongitude IS NOT NULL AND e.GPSLongitude != ''
+        AND e.SourceFile IN (SELECT path FROM thumbImages)
+    """):
+        lat = parse_coordinate(gps_lat, 90)
+        lng = parse_coordinate(gps_lng, 180)
+        # 0,0 is what some cameras write when they have no fix
+        if lat is None or lng is None or (lat == 0 and lng == 0):
+            skipped += 1
+            continue
+        locations[path] = (file_name or path.rsplit("/", 1)[-1], create_date, lat, lng)
+    if skipped:
+        print(f"  Skipped {skipped:,} photos with unusable GPS values")
+    return locations
+
+
+def refresh(conn: sqlite3.Connection) -> tuple:
+    """
+    Bring photo_locations in line with exif in one transaction. The R*Tree
+    follows through the triggers. Returns (inserted, updated, deleted).
+    """
+    source = load_source_locations(conn)
+    current = {
+        row[0]: row[1:]
+        for row in conn.execute(
+            "SELECT path, file_name, create_date, lat, lng FROM photo_locations"
+        )
+    }
+
+    deleted = [(path,) for path in current if path not in source]
+    inserted = []
+    updated = []
+    for path, (file_name, create_date, lat, lng) in source.items():
+        if path not in current:
+            inserted.append((path, file_name, create_date, lat, lng))
+        elif current[path] != (file_name, create_date, lat, lng):
+            updated.append((file_name, create_date, lat, lng, path))
+
+    with conn:
+        conn.executemany("DELETE FROM photo_locations WHERE path = ?", deleted)
+        conn.executemany(
+            """UPDATE photo_locations
+               SET file_name = ?, create_date = ?, lat = ?, lng = ?
+               WHERE path = ?""",
+            updated,
+        )
+        conn.executemany(
+            """INSERT INTO photo_locations (path, file_name, create_date, lat, lng)
+               VALUES (?, ?, ?, ?, ?)""",
+            inserted,
+        )
+    return len(inserted), len(updated), len(deleted)
+
+
+def mercator_cell(lat: float, lng: float, level: int) -> tuple:
+    """Return the (x, y) cell containing a point on a 2^level Web Mercator grid."""
+    scale = 1 << level
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+    x = (lng + 180.0) / 360.0
+    sin_lat = math.sin(math.radians(lat))
+    y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return (
+        min(scale - 1, max(0, int(x * scale))),
+        min(scale - 1, max(0, int(y * scale))),
+    )
+
+
+def build_clusters(conn: sqlite3.Connection) -> int:
+    """
+    Rebuild photo_clusters for zoom levels 0..MAX_CLUSTER_ZOOM.
+
+    A cell is [n, sum_lat, sum_lng, rep_n, path, file_name], where path and
+    file_name are the representative photo and rep_n the size of the child
+    cell it came from. At the finest level the representative is the photo
+    nearest the cell centroid; each coarser cell takes the representative of
+    its most populated child. Returns the number of rows written.
+    """
+    finest = MAX_CLUSTER_ZOOM + CELL_SHIFT
+    points = {}
+    for path, file_name, lat, lng in conn.execute(
+        "SELECT path, file_name, lat, lng FROM photo_locations"
+    ):
+        points.setdefault(mercator_cell(lat, lng, finest), []).append(
+            (path, file_name, lat, lng)
+        )
+
+    cells = {}
+    for key, members in points.items():
+        n = len(members)
+        sum_lat = sum(m[2] for m in members)
+        sum_lng = sum(m[3] for m in members)
+        c_lat, c_lng = sum_lat / n, sum_lng / n
+        rep = min(members, key=lambda m: (m[2] - c_lat) ** 2 + (m[3] - c_lng) ** 2)
+        cells[key] = [n, sum_lat, sum_lng, n, rep[0], rep[1]]
+
+    rows = 0
+    with conn:
+        conn.execute("DELETE FROM photo_clusters")
+        for zoom in range(MAX_CLUSTER_ZOOM, -1, -1):
+            conn.executemany(
+                """INSERT INTO photo_clusters
+                   (zoom, x, y, n, lat, lng, path, file_name)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                [
+                    (zoom, x, y, c[0], c[1] / c[0], c[2] / c[0], c[4], c[5])
+                    for (x, y), c in cells.items()
+                ],
+            )
+            rows += len(cells)
+
+            parents = {}
+            for (x, y), c in cells.items():
+                parent = parents.get((x >> 1, y >> 1))
+                if parent is None:
+                    parents[(x >> 1, y >> 1)] = [c[0], c[1], c[2], c[0], c[4], c[5]]
+                    continue
+                parent[0] += c[0]
+                parent[1] += c[1]
+                parent[2] += c[2]
+                if c[0] > parent[3]:
+                    parent[3:6] = [c[0], c[4], c[5]]
+            cells = parents
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build or refresh photo_locations and its R*Tree index"
+    )
+    parser.add_argument(
+        "--database",
+        default="database/mediameta.db",
+        help="Path to SQLite database (default: database/mediameta.db)",
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Drop and rebuild the tables instead of refreshing them",
+    )
+    args = parser.parse_args()
+
+    db_path = Path(args.database)
+    if not db_path.exists():
+        print(f"Error: Database not found: {db_path}")
+        sys.exit(1)
+
+    conn = sqlite3.connect(db_path)
+    if args.rebuild:
+        print("Dropping photo_locations, its R*Tree and photo_clusters...")
+        conn.execute("DROP TABLE IF EXISTS photo_locations")
+        conn.execute("DROP TABLE IF EXISTS photo_locations_rtree")
+        conn.execute("DROP TABLE IF EXISTS photo_clusters")
+        conn.commit()
+    create_tables(conn)
+
+    print(f"Refreshing photo_locations in {db_path}...")
+    start = time.time()
+    inserted, updated, deleted = refresh(conn)
+    total = conn.execute("SELECT COUNT(*) FROM photo_locations").fetchone()[0]
+
+    has_clusters = conn.execute("SELECT 1 FROM photo_clusters LIMIT 1").fetchone()
+    clusters = None
+    if inserted or updated or deleted or (total and not has_clusters):
+        print("Building cluster pyramid...")
+        clusters = build_clusters(conn)
+    conn.close()
+
+    print("\n=== Summary ===")
+    print(f"Rows inserted: {inserted:,}")
+    print(f"Rows updated: {updated:,}")
+    print(f"Rows deleted: {deleted:,}")
+    print(f"Geotagged photos: {total:,}")
+    if clusters is not None:
+        print(f"Cluster rows (zoom 0-{MAX_CLUSTER_ZOOM}): {clusters:,}")
+    print(f"Elapsed: {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Assign offline place names (city, region, country) to geotagged photos.
+
+Reverse geocoding runs entirely against a local GeoNames gazetteer, with no
+API calls. Download once from https://download.geonames.org/export/dump/:
+
+    cities1000.zip          -> database/geonames/cities1000.txt
+    admin1CodesASCII.txt    -> database/geonames/admin1CodesASCII.txt
+    countryInfo.txt         -> database/geonames/countryInfo.txt
+
+(cities500/cities5000/cities15000 work too; the admin1 and country files
+are optional and only supply region and country names.)
+
+Gazetteer places are converted to 3D unit vectors and indexed in a KD-tree,
+so the nearest place for every photo in photo_locations (see
+build_photo_locations.py) is found in one vectorized query. Results are
+written to the photo_places table, indexed by city, region and country,
+which the gallery (?place=) and /search (place=) filter on. A photo
+further than --max-region-distance from every gazetteer place (at sea, or
+somewhere remote) gets no place names at all.
+
+Usage:
+    python scripts/build_photo_places.py
+    python scripts/build_photo_places.py --gazetteer database/geonames/cities15000.txt
+    python scripts/build_photo_places.py --max-distance 25 --max-region-distance 100
+"""
+
+import argparse
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+from gallery_tables import create_photo_places_table
+
+EARTH_RADIUS_KM = 6371.0088
+DEFAULT_GEONAMES_DIR = Path("database/geonames")
+
+
+def load_gazetteer(path: Path) -> tuple:
+    """
+    Read a GeoNames geoname-format file.
+
+    Returns (coordinates, places): a float64 array of shape (N, 2) with
+    lat/lng, and a list of (name, country_code, admin1_code) tuples.
+    """
+    coordinates = []
+    places = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 11:
+                continue
+            try:
+                coordinates.append((float(fields[4]), float(fields[5])))
+            except ValueError:
+                continue
+            places.append((fields[1], fields[8], fields[10]))
+    return np.array(coordinates, dtype=np.float64).reshape(-1, 2), places
+
+
+def load_admin1_names(path: Path) -> dict:
+    """Return {'US.CA': 'California', ...} from admin1CodesASCII.txt."""
+    names = {}
+    if not path.exists():
+        return names
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) >= 2:
+                names[fields[0]] = fields[1]
+    return names
+
+
+def load_country_names(path: Path) -> dict:
+    """Return {'US': 'United States', ...} from countryInfo.txt."""
+    names = {}
+    if not path.exists():
+        return names
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) >= 5:
+                names[fields[0]] = fields[4]
+    return names
+
+
+def to_unit_vectors(coordinates: np.ndarray) -> np.ndarray:
+    """Convert (N, 2) lat/lng degrees to (N, 3) points on the unit sphere."""
+    lat = np.radians(coordinates[:, 0])
+    lng = np.radians(coordinates[:, 1])
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lng), cos_lat * np.sin(lng), np.sin(lat)))
+
+
+def nearest_places(gazetteer: np.ndarray, photos: np.ndarray) -> tuple:
+    """
+    Return (indexes, distances_km) of the nearest gazetteer entry for each
+    photo. Euclidean distance between unit vectors is monotonic in
+    great-circle distance, so a KD-tree over 3D points gives exact results.
+    """
+    from scipy.spatial import cKDTree
+
+    tree = cKDTree(to_unit_vectors(gazetteer))
+    chord, indexes = tree.query(to_unit_vectors(photos), k=1, workers=-1)
+    distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2, 0, 1))
+    return indexes, distances
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Assign offline place names to geotagged photos"
+    )
+    parser.add_argument(
+        "--database",
+        default="database/mediameta.db",
+        help="Path to SQLite database (default: database/mediameta.db)",
+    )
+    parser.add_argument(
+        "--gazetteer",
+        default=str(DEFAULT_GEONAMES_DIR / "cities1000.txt"),
+        help="GeoNames cities file (default: database/geonames/cities1000.txt)",
+    )
+    parser.add_argument(
+        "--admin1",
+        default=str(DEFAULT_GEONAMES_DIR / "admin1CodesASCII.txt"),
+        help="GeoNames admin1 names file (optional)",
+    )
+    parser.add_argument(
+        "--countries",
+        default=str(DEFAULT_GEONAMES_DIR / "countryInfo.txt"),
+        help="GeoNames country info file (optional)",
+    )
+    parser.add_argument(
+        "--max-distance",
+        type=float,
+        default=50.0,
+        help="Only assign a city within this many km (default: 50)",
+    )
+    parser.add_argument(
+        "--max-region-distance",
+        type=float,
+        default=200.0,
+        help="Only assign a region and country when the nearest place is "
+        "within this many km (default: 200)",
+    )
+    args = parser.parse_args()
+
+    db_path = Path(args.database)
+    if not db_path.exists():
+        print(f"Error: Database not found: {db_path}")
+        sys.exit(1)
+    gazetteer_path = Path(args.gazetteer)
+    if not gazetteer_path.exists():
+        print(f"Error: Gazetteer not found: {gazetteer_path}")
+        print("Download cities1000.zip from https://download.geonames.org/export/dump/")
+        sys.exit(1)
+
+    start = time.time()
+    print(f"Loading gazetteer {gazetteer_path}...")
+    coordinates, places = load_gazetteer(gazetteer_path)
+    admin1_names = load_admin1_names(Path(args.admin1))
+    country_names = load_country_names(Path(args.countries))
+    print(f"  {len(places):,} places")
+    if not places:
+        print("Error: No places found in gazetteer")
+        sys.exit(1)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("SELECT path, lat, lng FROM photo_locations").fetchall()
+    except sqlite3.OperationalError:
+        print("Error: photo_locations not found; run scripts/build_photo_locations.py")
+        sys.exit(1)
+    create_photo_places_table(conn)
+    conn.commit()
+    print(f"Geocoding {len(rows):,} photos...")
+
+    paths = [row[0] for row in rows]
+    photo_coordinates = np.array([row[1:] for row in rows], dtype=np.float64).reshape(
+        -1, 2
+    )
+    indexes, distances = nearest_places(coordinates, photo_coordinates)
+
+    results = []
+    for path, index, distance in zip(paths, indexes.tolist(), distances.tolist()):
+        if distance > args.max_region_distance:
+            results.append((path, None, None, None, None, round(distance, 2)))
+            continue
+        name, country_code, admin1_code = places[index]
+        results.append(
+            (
+                path,
+                name if distance <= args.max_distance else None,
+                admin1_names.get(f"{country_code}.{admin1_code}"),
+                country_names.get(country_code, country_code or None),
+                country_code or None,
+                round(distance, 2),
+            )
+        )
+
+    with conn:
+        conn.execute("DELETE FROM photo_places")
+        conn.executemany(
+            """INSERT INTO photo_places
+               (path, city, region, country, country_code, distance_km)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            results,
+        )
+
+    print("\n=== Summary ===")
+    print(f"Photos geocoded: {len(results):,}")
+    print(f"With a city within {args.max_distance:g} km: {sum(1 for r in results if r[1]):,}")
+    print(
+        f"No place within {args.max_region_distance:g} km: "
+        f"{sum(1 for r in results if r[5] > args.max_region_distance):,}"
+    )
+    print(f"Elapsed: {time.time() - start:.1f}s")
+    print("\nTop countries:")
+    for country, n in conn.execute("""
+        SELECT country, COUNT(*) FROM photo_places
+        GROUP BY country ORDER BY COUNT(*) DESC LIMIT 10
+    """):
+        print(f"  {country or '(unknown)':<30} {n:>7,}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Build a multi-resolution thumbnail pyramid from the thumbImages table.
+
+Each 512x512 thumbnail is decoded once and re-encoded at smaller sizes as
+JPEG and WebP. Renditions are stored in the thumb_renditions table, indexed
+by (path, size, format), and served by datasette/plugins/thumbnails.py via
+/thumb/<key>?size=N with Accept negotiation.
+
+The original 512px JPEG stays in thumbImages, so at 512 only a WebP rendition
+is added (plus a JPEG one for HEIC/PNG/TIFF sources browsers can't display).
+
+Each rendition records source_etag, the thumbImages.etag it was encoded
+from. A run re-encodes thumbnails whose etag has changed since (including
+renditions from before source_etag existed) and deletes the renditions of
+paths that are no longer in thumbImages.
+
+Usage:
+    python scripts/build_thumbnail_pyramid.py
+    python scripts/build_thumbnail_pyramid.py --sizes 128 256 512 --workers 8
+    python scripts/build_thumbnail_pyramid.py --rebuild
+"""
+
+import argparse
+import io
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+from gallery_tables import create_thumb_renditions_table, fill_thumb_etags
+
+DEFAULT_SIZES = [128, 256, 512]
+ORIGINAL_SIZE = 512
+JPEG_QUALITY = 82
+WEBP_QUALITY = 78
+CHUNK_SIZE = 200
+
+
+def open_image(content: bytes):
+    """Decode a thumbnail BLOB, including HEIC thumbnails via pyheif."""
+    from PIL import Image
+
+    try:
+        img = Image.open(io.BytesIO(content))
+        img.load()
+    except Exception:
+        import pyheif
+
+        heif = pyheif.read(content)
+        img = Image.frombytes(
+            heif.mode, heif.size, heif.data, "raw", heif.mode, heif.stride
+        )
+    return img.convert("RGB"), img.format == "JPEG"
+
+
+def build_renditions(job: tuple) -> tuple:
+    """
+    Encode all renditions for one thumbnail.
+
+    Runs in a worker process. Returns (path, rows, error) where rows are
+    (size, format, width, height, content) tuples.
+    """
+    from PIL import Image
+
+    path, content, sizes = job
+    try:
+        img, is_jpeg = open_image(content)
+    except Exception as e:
+        return path, [], str(e)
+
+    rows = []
+    for size in sizes:
+        resized = img
+        if max(img.size) > size:
+            resized = img.copy()
+            resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+        formats = ["webp"]
+        if size < ORIGINAL_SIZE or not is_jpeg:
+            formats.append("jpeg")
+        for fmt in formats:
+            buf = io.BytesIO()
+            if fmt == "jpeg":
+                resized.save(
+                    buf,
+                    format="JPEG",
+                    quality=JPEG_QUALITY,
+                    optimize=True,
+                    progressive=True,
+                )
+            else:
+                resized.save(buf, format="WEBP", quality=WEBP_QUALITY, method=4)
+            rows.append((size, fmt, resized.width, resized.height, buf.getvalue()))
+    return path, rows, None
+
+
+def pending_paths(conn: sqlite3.Connection, rebuild: bool) -> list:
+    """
+    Return thumbnail paths with no renditions, or with renditions encoded
+    from other content than thumbImages holds now (all paths if rebuilding).
+    """
+    sql = "SELECT t.path FROM thumbImages t WHERE t.content IS NOT NULL"
+    if not rebuild:
+        sql += """ AND (
+            NOT EXISTS (SELECT 1 FROM thumb_renditions r WHERE r.path = t.path)
+            OR EXISTS (
+                SELECT 1 FROM thumb_renditions r
+                WHERE r.path = t.path AND r.source_etag IS NOT t.etag
+            )
+        )"""
+    sql += " ORDER BY t.path"
+    return [row[0] for row in conn.execute(sql)]
+
+
+def prune_renditions(conn: sqlite3.Connection) -> int:
+    """Delete renditions of paths that are no longer in thumbImages."""
+    cursor = conn.execute(
+        """DELETE FROM thumb_renditions WHERE path NOT IN (
+               SELECT path FROM thumbImages WHERE path IS NOT NULL
+           )"""
+    )
+    conn.commit()
+    return cursor.rowcount
+
+
+def load_chunk(conn: sqlite3.Connection, paths: list) -> list:
+    placeholders = ",".join("?" for _ in paths)
+    return conn.execute(
+        f"SELECT path, content, etag FROM thumbImages WHERE path IN ({placeholders})",
+        paths,
+    ).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build 128/256/512 JPEG + WebP thumbnail renditions"
+    )
+    parser.add_argument(
+        "--database",
+        default="database/mediameta.db",
+        help="Path to SQLite database (default: database/mediameta.db)",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SIZES,
+        help=f"Rendition sizes in pixels (default: {DEFAULT_SIZES})",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Encoder processes (default: CPUs)"
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Re-encode renditions that already exist",
+    )
+    args = parser.parse_args()
+
+    db_path = Path(args.database)
+    if not db_path.exists():
+        print(f"Error: Database not found: {db_path}")
+        sys.exit(1)
+
+    sizes = sorted(set(args.sizes))
+    conn = sqlite3.connect(db_path)
+    create_thumb_renditions_table(conn)
+    fill_thumb_etags(conn)
+    conn.commit()
+    pruned = prune_renditions(conn)
+    if pruned:
+        print(f"Deleted {pruned:,} renditions of removed thumbnails")
+
+    paths = pending_paths(conn, args.rebuild)
+    print(f"Building renditions {sizes} for {len(paths):,} thumbnails in {db_path}...")
+    start = time.time()
+    count = 0
+    errors = 0
+    total_bytes = 0
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        # Work in chunks so only CHUNK_SIZE BLOBs are held in memory at once
+        for i in range(0, len(paths), CHUNK_SIZE):
+            chunk = load_chunk(conn, paths[i : i + CHUNK_SIZE])
+            source_etags = {path: etag for path, _, etag in chunk}
+            jobs = [(path, content, sizes) for path, content, _ in chunk]
+            for path, rows, error in pool.map(build_renditions, jobs, chunksize=8):
+                source_etag = source_etags[path]
+                # Renditions of the thumbnail's previous content
+                conn.execute(
+                    """DELETE FROM thumb_renditions
+                       WHERE path = ? AND source_etag IS NOT ?""",
+                    (path, source_etag),
+                )
+                if error:
+                    errors += 1
+                    print(f"  Error processing {path}: {error}")
+                    continue
+
+                conn.executemany(
+                    """INSERT OR REPLACE INTO thumb_renditions
+                       (path, size, format, width, height, bytes, content, source_etag)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                    [
+                        (path, size, fmt, width, height, len(data), data, source_etag)
+                        for size, fmt, width, height, data in rows
+                    ],
+                )
+                total_bytes += sum(len(row[4]) for row in rows)
+                count += 1
+
+            conn.commit()
+            print(f"  Processed {count} thumbnails...")
+
+    print("\n=== Summary ===")
+    print(f"Thumbnails processed: {count}")
+    print(f"Errors: {errors}")
+    print(f"Rendition bytes written: {total_bytes / (1024**2):.1f} MB")
+    print(f"Elapsed: {time.time() - start:.1f}s")
+
+    print("\nAverage bytes per rendition:")
+    for size, fmt, avg_bytes, n in conn.execute("""
+        SELECT size, format, AVG(bytes), COUNT(*)
+        FROM thumb_renditions
+        GROUP BY size, format
+        ORDER BY size, format
+    """):
+        print(f"  {size:>4}px {fmt:<5} {avg_bytes / 1024:8.1f} KB  ({n:,} renditions)")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
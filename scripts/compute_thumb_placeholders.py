@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Compute BlurHash placeholders for every thumbnail in thumbImages.
+
+Thumbnails are decoded at reduced size (JPEG draft mode), resampled to a
+small fixed grid and encoded in batches: the BlurHash DCT factors and their
+quantisation are computed with NumPy over the whole batch at once.
+
+Results go into the thumb_placeholders table (primary key: path), which the
+gallery page and the /search JSON use to paint a blurred preview of each
+tile before its thumbnail arrives. Each row records source_etag, the
+thumbImages.etag it was computed from: a run recomputes placeholders of
+reloaded thumbnails and deletes those of paths no longer in thumbImages.
+
+Usage:
+    python scripts/compute_thumb_placeholders.py
+    python scripts/compute_thumb_placeholders.py --components 4 3 --rebuild
+"""
+
+import argparse
+import io
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+from gallery_tables import create_thumb_placeholders_table, fill_thumb_etags
+
+SAMPLE_SIZE = 32
+BATCH_SIZE = 500
+BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+
+def encode83(value: int, length: int) -> str:
+    chars = []
+    for i in range(1, length + 1):
+        digit = (value // 83 ** (length - i)) % 83
+        chars.append(BASE83[digit])
+    return "".join(chars)
+
+
+def srgb_to_linear(values: np.ndarray) -> np.ndarray:
+    v = values / 255.0
+    return np.where(v <= 0.04045, v / 12.92, ((v + 0.055) / 1.055) ** 2.4)
+
+
+def linear_to_srgb(values: np.ndarray) -> np.ndarray:
+    v = np.clip(values, 0.0, 1.0)
+    srgb = np.where(
+        v <= 0.0031308,
+        v * 12.92 * 255 + 0.5,
+        (1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5,
+    )
+    return np.floor(srgb).astype(np.int64)
+
+
+def blurhash_batch(pixels: np.ndarray, cx: int, cy: int) -> list:
+    """
+    Encode a batch of images as BlurHash strings.
+
+    Args:
+        pixels: uint8 array of shape (N, H, W, 3)
+        cx, cy: number of horizontal and vertical components (1-9)
+
+    Returns:
+        List of (blurhash, average_color_hex) tuples
+    """
+    n, height, width, _ = pixels.shape
+    linear = srgb_to_linear(pixels.astype(np.float64))
+
+    basis_x = np.cos(np.pi * np.outer(np.arange(cx), np.arange(width)) / width)
+    basis_y = np.cos(np.pi * np.outer(np.arange(cy), np.arange(height)) / height)
+    # factors[n, j, i, c] = sum_y sum_x basis_y[j, y] * basis_x[i, x] * linear[n, y, x, c]
+    factors = np.einsum("jy,ix,nyxc->njic", basis_y, basis_x, linear)
+    norm = np.full((cy, cx), 2.0)
+    norm[0, 0] = 1.0
+    factors *= norm[None, :, :, None] / (width * height)
+    factors = factors.reshape(n, cx * cy, 3)
+
+    dc = factors[:, 0, :]
+    ac = factors[:, 1:, :]
+
+    dc_srgb = linear_to_srgb(dc)
+    dc_values = (dc_srgb[:, 0] << 16) + (dc_srgb[:, 1] << 8) + dc_srgb[:, 2]
+
+    if ac.shape[1]:
+        actual_max = np.abs(ac).max(axis=(1, 2))
+        quantised_max = np.clip(np.floor(actual_max * 166 - 0.5), 0, 82).astype(
+            np.int64
+        )
+        maximum_value = (quantised_max + 1) / 166
+        scaled = ac / maximum_value[:, None, None]
+        signed_sqrt = np.sign(scaled) * np.abs(scaled) ** 0.5
+        quant = np.clip(np.floor(signed_sqrt * 9 + 9.5), 0, 18).astype(np.int64)
+        ac_values = quant[:, :, 0] * 19 * 19 + quant[:, :, 1] * 19 + quant[:, :, 2]
+    else:
+        quantised_max = np.zeros(n, dtype=np.int64)
+        ac_values = np.zeros((n, 0), dtype=np.int64)
+
+    size_flag = (cx - 1) + (cy - 1) * 9
+    results = []
+    for k in range(n):
+        parts = [
+            encode83(size_flag, 1),
+            encode83(int(quantised_max[k]), 1),
+            encode83(int(dc_values[k]), 4),
+        ]
+        parts.extend(encode83(int(v), 2) for v in ac_values[k])
+        results.append(("".join(parts), f"#{int(dc_values[k]):06x}"))
+    return results
+
+
+def decode_sample(content: bytes):
+    """Decode a thumbnail to a SAMPLE_SIZE x SAMPLE_SIZE RGB array plus its size."""
+    from PIL import Image
+
+    try:
+        img = Image.open(io.BytesIO(content))
+        width, height = img.size
+        # JPEG draft mode decodes at 1/2-1/8 scale straight from the DCT
+        img.draft("RGB", (SAMPLE_SIZE * 2, SAMPLE_SIZE * 2))
+        img = img.convert("RGB")
+    except Exception:
+        import pyheif
+
+        heif = pyheif.read(content)
+        img = Image.frombytes(
+            heif.mode, heif.size, heif.data, "raw", heif.mode, heif.stride
+        ).convert("RGB")
+        width, height = img.size
+    img = img.resize((SAMPLE_SIZE, SAMPLE_SIZE), Image.Resampling.BOX)
+    return np.asarray(img, dtype=np.uint8), width, height
+
+
+def pending_paths(conn: sqlite3.Connection, rebuild: bool) -> list:
+    """Paths with no placeholder, or one computed from other content."""
+    sql = """SELECT t.path FROM thumbImages t
+             LEFT JOIN thumb_placeholders p ON p.path = t.path
+             WHERE t.content IS NOT NULL"""
+    if not rebuild:
+        sql += " AND (p.path IS NULL OR p.source_etag IS NOT t.etag)"
+    sql += " ORDER BY t.path"
+    return [row[0] for row in conn.execute(sql)]
+
+
+def prune_placeholders(conn: sqlite3.Connection) -> int:
+    """Delete placeholders of paths that are no longer in thumbImages."""
+    cursor = conn.execute(
+        """DELETE FROM thumb_placeholders WHERE path NOT IN (
+               SELECT path FROM thumbImages WHERE path IS NOT NULL
+           )"""
+    )
+    conn.commit()
+    return cursor.rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compute BlurHash placeholders for thumbImages"
+    )
+    parser.add_argument(
+        "--database",
+        default="database/mediameta.db",
+        help="Path to SQLite database (default: database/mediameta.db)",
+    )
+    parser.add_argument(
+        "--components",
+        type=int,
+        nargs=2,
+        default=[4, 3],
+        metavar=("X", "Y"),
+        help="BlurHash components along x and y, 1-9 each (default: 4 3)",
+    )
+    parser.add_argument(
+        "--rebuild", action="store_true", help="Recompute existing placeholders"
+    )
+    args = parser.parse_args()
+
+    cx, cy = args.components
+    if not (1 <= cx <= 9 and 1 <= cy <= 9):
+        print("Error: components must be between 1 and 9")
+        sys.exit(1)
+
+    db_path = Path(args.database)
+    if not db_path.exists():
+        print(f"Error: Database not found: {db_path}")
+        sys.exit(1)
+
+    conn = sqlite3.connect(db_path)
+    create_thumb_placeholders_table(conn)
+    fill_thumb_etags(conn)
+    conn.commit()
+    pruned = prune_placeholders(conn)
+    if pruned:
+        print(f"Deleted {pruned:,} placeholders of removed thumbnails")
+
+    paths = pending_paths(conn, args.rebuild)
+    print(f"Computing {cx}x{cy} BlurHash placeholders for {len(paths):,} thumbnails...")
+    start = time.time()
+    count = 0
+    errors = 0
+
+    for i in range(0, len(paths), BATCH_SIZE):
+        chunk = paths[i : i + BATCH_SIZE]
+        placeholders = ",".join("?" for _ in chunk)
+        rows = conn.execute(
+            f"""SELECT path, content, etag FROM thumbImages
+                WHERE path IN ({placeholders})""",
+            chunk,
+        ).fetchall()
+
+        decoded_paths = []
+        samples = []
+        sizes = []
+        source_etags = []
+        for path, content, source_etag in rows:
+            try:
+                sample, width, height = decode_sample(content)
+            except Exception as e:
+                errors += 1
+                print(f"  Error decoding {path}: {e}")
+                continue
+            decoded_paths.append(path)
+            samples.append(sample)
+            sizes.append((width, height))
+            source_etags.append(source_etag)
+
+        if not samples:
+            continue
+
+        hashes = blurhash_batch(np.stack(samples), cx, cy)
+        conn.executemany(
+            """INSERT OR REPLACE INTO thumb_placeholders
+               (path, blurhash, color, width, height, source_etag)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            [
+                (path, blurhash, color, width, height, source_etag)
+                for path, (blurhash, color), (width, height), source_etag in zip(
+                    decoded_paths, hashes, sizes, source_etags
+                )
+            ],
+        )
+        conn.commit()
+        count += len(decoded_paths)
+        print(f"  Processed {count} thumbnails...")
+
+    total = conn.execute("SELECT COUNT(*) FROM thumb_placeholders").fetchone()[0]
+    conn.close()
+
+    print("\n=== Summary ===")
+    print(f"Placeholders computed: {count}")
+    print(f"Errors: {errors}")
+    print(f"Table rows: {total}")
+    print(f"Elapsed: {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,36 +2,32 @@
 """
 Find files that were processed but missing descriptions.
 
-Compares photo_descriptions_progress.txt (source of truth for processed files)
-against outputs/image_analysis.json to find gaps caused by interrupted batches.
+Compares the completed jobs in photo_descriptions_jobs.db against the result
+log (outputs/image_analysis.jsonl). Results are appended to the log before
+their job is marked completed, so gaps only come from runs tracked with the
+old progress file or from a lost or edited log.
 
 Usage:
     python scripts/find_missing_descriptions.py
-    python scripts/find_missing_descriptions.py --fix  # Remove missing from progress file
+    python scripts/find_missing_descriptions.py --fix  # Reset missing jobs to pending
 """
 
 import argparse
-import json
 import sys
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
 
-def load_progress_file(path: Path) -> set:
-    """Load processed files from progress file."""
-    if not path.exists():
-        return set()
-    with open(path, "r") as f:
-        return set(line.strip() for line in f if line.strip())
+from job_store import DEFAULT_JOBS_DB, open_jobs  # noqa: E402
+from result_log import find_results, read_results  # noqa: E402
 
 
 def load_json_files(path: Path) -> set:
-    """Load file paths from JSON output."""
+    """Load file paths from the result log or JSON output."""
     if not path.exists():
         return set()
-    with open(path, "r") as f:
-        data = json.load(f)
     # Strip leading './' to match progress file format
-    return set(r["file"].lstrip("./") for r in data)
+    return set(r["file"].lstrip("./") for r in read_results(str(path)))
 
 
 def main():
@@ -39,19 +35,19 @@ def main():
         description="Find files missing descriptions due to interrupted batches"
     )
     parser.add_argument(
-        "--progress-file",
-        default="photo_descriptions_progress.txt",
-        help="Path to progress file (default: photo_descriptions_progress.txt)",
+        "--jobs-db",
+        default=DEFAULT_JOBS_DB,
+        help=f"Job table (default: {DEFAULT_JOBS_DB})",
     )
     parser.add_argument(
         "--json-file",
-        default="outputs/image_analysis.json",
-        help="Path to JSON output (default: outputs/image_analysis.json)",
+        default=find_results("outputs"),
+        help="Result log or JSON output (default: outputs/image_analysis.jsonl)",
     )
     parser.add_argument(
         "--fix",
         action="store_true",
-        help="Remove missing files from progress file so they get reprocessed",
+        help="Reset missing files to pending so they get reprocessed",
     )
     parser.add_argument(
         "--output", help="Write missing files to this file (one per line)"
@@ -59,28 +55,29 @@ def main():
 
     args = parser.parse_args()
 
-    progress_path = Path(args.progress_file)
+    jobs_path = Path(args.jobs_db)
     json_path = Path(args.json_file)
 
     # Check files exist
-    if not progress_path.exists():
-        print(f"Error: Progress file not found: {progress_path}")
+    if not jobs_path.exists():
+        print(f"Error: Job table not found: {jobs_path}")
         sys.exit(1)
 
     if not json_path.exists():
-        print(f"Error: JSON file not found: {json_path}")
+        print(f"Error: Results file not found: {json_path}")
         sys.exit(1)
 
     # Load both sources
-    progress_files = load_progress_file(progress_path)
+    jobs = open_jobs(str(jobs_path))
+    progress_files = jobs.completed_files()
     json_files = load_json_files(json_path)
 
-    # Find missing (in progress but not in JSON)
+    # Find missing (completed in the job table but not in the results)
     missing = progress_files - json_files
 
     # Report
-    print(f"Progress file: {len(progress_files)} files")
-    print(f"JSON file:     {len(json_files)} files")
+    print(f"Job table:     {len(progress_files)} files completed")
+    print(f"Results:       {len(json_files)} files")
     print(f"Missing:       {len(missing)} files")
 
     if not missing:
@@ -101,14 +98,11 @@ def main():
                 f.write(f"{file}\n")
         print(f"\nMissing files written to: {output_path}")
 
-    # Fix by removing from progress file
+    # Fix by putting the jobs back to pending
     if args.fix:
-        print(f"\nRemoving {len(missing)} entries from progress file...")
-        remaining = progress_files - missing
-        with open(progress_path, "w") as f:
-            for file in sorted(remaining):
-                f.write(f"{file}\n")
-        print(f"Progress file updated: {len(remaining)} entries")
+        print(f"\nResetting {len(missing)} jobs to pending...")
+        jobs.reset(missing)
+        print(f"Job table updated: {jobs.completed_count()} files completed")
         print("These files will be reprocessed on next batch run.")
     else:
         print("\nTo fix, run: python scripts/find_missing_descriptions.py --fix")
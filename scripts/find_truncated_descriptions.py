@@ -9,14 +9,19 @@ Usage:
     python scripts/find_truncated_descriptions.py
     python scripts/find_truncated_descriptions.py --input outputs/v2/image_analysis.json --output outputs/v2/truncated_descriptions.yaml
     python scripts/find_truncated_descriptions.py --max-tokens 100
+    python scripts/find_truncated_descriptions.py --input outputs/image_analysis.jsonl --output outputs/truncated_descriptions.yaml
 """
 
 import argparse
-import json
+import sys
 from pathlib import Path
 
 import yaml
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from result_log import latest_per_file, read_results  # noqa: E402
+
 
 DEFAULT_INPUT = "outputs/v2/image_analysis.json"
 DEFAULT_OUTPUT = "outputs/v2/truncated_descriptions.yaml"
@@ -25,7 +30,7 @@ DEFAULT_MAX_TOKENS = 80
 
 def main():
     parser = argparse.ArgumentParser(description="Find truncated image descriptions")
-    parser.add_argument("--input", default=DEFAULT_INPUT, help=f"Input JSON file (default: {DEFAULT_INPUT})")
+    parser.add_argument("--input", default=DEFAULT_INPUT, help=f"Input result log or JSON file (default: {DEFAULT_INPUT})")
     parser.add_argument("--output", default=DEFAULT_OUTPUT, help=f"Output YAML file (default: {DEFAULT_OUTPUT})")
     parser.add_argument(
         "--max-tokens",
@@ -38,12 +43,15 @@ def main():
     input_path = Path(args.input)
     output_path = Path(args.output)
 
-    with open(input_path) as f:
-        data = json.load(f)
-
-    truncated = [entry for entry in data if entry.get("generation_tokens") == args.max_tokens]
+    total = 0
+    truncated = []
+    # Only each file's latest entry: a re-run image is in the log again
+    for entry in latest_per_file(read_results(str(input_path))):
+        total += 1
+        if entry.get("generation_tokens") == args.max_tokens:
+            truncated.append(entry)
 
-    print(f"Total entries:     {len(data):,}")
+    print(f"Total entries:     {total:,}")
     print(f"Truncated entries: {len(truncated):,} (generation_tokens == {args.max_tokens})")
 
     output_path.parent.mkdir(parents=True, exist_ok=True)
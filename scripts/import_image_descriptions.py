@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 """
-Import image descriptions from JSON to SQLite database.
+Import image descriptions from the result log to SQLite database.
 
 Filters to new records and uses sqlite-utils insert to add them.
-Can be run multiple times as new data arrives.
+Can be run multiple times as new data arrives, including while a batch
+is still appending to the log.
 
 Usage:
     python scripts/import_image_descriptions.py
@@ -17,24 +18,29 @@ import subprocess
 import sys
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
 
-def load_json(json_path: Path) -> tuple[list, str]:
+from result_log import find_results, read_results  # noqa: E402
+
+
+def load_new_records(json_path: Path, existing_files: set) -> tuple[list, int, str]:
     """
-    Load and validate JSON file.
-    Returns (data, error_message)
+    Stream the results, keeping the latest entry for each file that is not
+    in the database yet.
+    Returns (new_records, records_read, error_message)
     """
+    new_records = {}
+    records_read = 0
     try:
-        with open(json_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        if not isinstance(data, list):
-            return [], "JSON root is not an array"
-
-        return data, ""
-    except json.JSONDecodeError as e:
-        return [], f"Invalid JSON: {e}"
+        for record in read_results(str(json_path)):
+            records_read += 1
+            if record.get("file") not in existing_files:
+                new_records[record.get("file")] = record
+    except (json.JSONDecodeError, ValueError) as e:
+        return [], records_read, f"Invalid results file: {e}"
     except Exception as e:
-        return [], f"Error reading file: {e}"
+        return [], records_read, f"Error reading file: {e}"
+    return list(new_records.values()), records_read, ""
 
 
 def get_existing_files(db_path: Path, table_name: str) -> set:
@@ -82,12 +88,12 @@ def insert_records(db_path: Path, table_name: str, records: list) -> tuple[bool,
 
 def main():
     parser = argparse.ArgumentParser(
-        description="Import image descriptions from JSON to SQLite"
+        description="Import image descriptions from the result log to SQLite"
     )
     parser.add_argument(
         "--json-file",
-        default="outputs/image_analysis.json",
-        help="Path to JSON file (default: outputs/image_analysis.json)",
+        default=find_results("outputs"),
+        help="Result log or JSON file (default: outputs/image_analysis.jsonl)",
     )
     parser.add_argument(
         "--database",
@@ -100,7 +106,7 @@ def main():
         help="Table name (default: image_description)",
     )
     parser.add_argument(
-        "--dry-run", action="store_true", help="Validate JSON without importing"
+        "--dry-run", action="store_true", help="Validate results without importing"
     )
 
     args = parser.parse_args()
@@ -111,31 +117,27 @@ def main():
 
     # Check paths exist
     if not json_path.exists():
-        print(f"Error: JSON file not found: {json_path}")
+        print(f"Error: Results file not found: {json_path}")
         sys.exit(1)
 
     if not db_path.exists():
         print(f"Error: Database not found: {db_path}")
         sys.exit(1)
 
-    # Load JSON
-    print(f"Loading JSON file: {json_path}")
-    all_records, error = load_json(json_path)
-
-    if error:
-        print(f"Error: {error}")
-        print("The JSON file may be mid-write. Try again in a moment.")
-        sys.exit(1)
-
-    print(f"JSON valid: {len(all_records)} records found")
-
     # Get existing files from database
     print("Checking existing records in database...")
     existing_files = get_existing_files(db_path, table_name)
     print(f"Table '{table_name}' current rows: {len(existing_files)}")
 
-    # Filter to only new records
-    new_records = [r for r in all_records if r.get("file") not in existing_files]
+    # Stream the results, keeping only new records
+    print(f"Reading results: {json_path}")
+    new_records, records_read, error = load_new_records(json_path, existing_files)
+
+    if error:
+        print(f"Error: {error}")
+        sys.exit(1)
+
+    print(f"Results valid: {records_read} records found")
     print(f"New records to insert: {len(new_records)}")
 
     if args.dry_run:
@@ -146,7 +148,7 @@ def main():
         print()
         print("WARNING: No new records to insert!")
         print("  If the batch process is running, this may indicate:")
-        print("  - Batch is still processing (not yet written to JSON)")
+        print("  - Batch is still processing (not yet written to the log)")
         print("  - Batch process has stalled")
         print("  Check logs: tail -20 logs/batch_orchestrator_*.log")
         sys.exit(0)
@@ -160,7 +162,7 @@ def main():
         sys.exit(1)
 
     print("Done!")
-    print(f"  Records in JSON: {len(all_records)}")
+    print(f"  Records in results: {records_read}")
     print(f"  Previously imported: {len(existing_files)}")
     print(f"  New rows added: {len(new_records)}")
 
@@ -2,12 +2,18 @@
 """
 Load 512x512 thumbnails into the thumbImages table.
 Transforms paths from database/512x512/0/file.jpg to ./0/file.jpg
+
+Afterwards gallery_items is refreshed (see src/gallery_tables.py), so the
+gallery shows the new thumbnails right away.
 """
 
 import sqlite3
 from pathlib import Path
 import sys
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+from gallery_tables import refresh
+
 
 def load_thumbnails():
     db_path = "database/mediameta.db"
@@ -74,6 +80,14 @@ def load_thumbnails():
     print(f"Errors: {errors}")
     print(f"Database count: {db_count}")
 
+    print("\nRefreshing gallery_items...")
+    result = refresh(conn)
+    print(
+        f"Gallery items: {result['inserted']} inserted, {result['deleted']} deleted, "
+        f"{result['updated']} with a new thumbnail, "
+        f"{result['skipped']} without a usable CreateDate"
+    )
+
     conn.close()
     print("\nDone!")
 
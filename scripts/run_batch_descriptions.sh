@@ -10,31 +10,39 @@
 #
 # Options:
 #   --directory PATH      Path to images (default: database/512x512)
-#   --batch-size NUM      Images per batch (default: 100)
+#   --mode MODE           persistent (one long-lived worker) or batch (default: persistent)
+#   --backend NAME        Describer backend: mlx, transformers or stub (default: mlx)
+#   --batch-size NUM      Images per batch / progress report interval (default: 100)
 #   --cooldown SECS       Seconds between batches (default: 30)
+#   --worker-max-images NUM   Recycle the persistent worker after NUM images (default: 2000)
+#   --worker-max-rss-growth MB  Recycle the persistent worker after MB of RSS growth (default: 2048)
 #   --max-tokens NUM      Maximum tokens for output (default: 100)
 #   --temp VALUE          Temperature 0.0-1.0 (default: 0.0)
 #   --prompt TEXT         Prompt for image description
-#   --progress-file FILE  Progress tracking file (default: photo_descriptions_progress.txt)
+#   --jobs-db FILE        Job table tracking progress (default: photo_descriptions_jobs.db)
 #   --output-dir PATH     Output directory (default: outputs)
 #   -h, --help            Show this help message
 #
 # Examples:
 #   ./scripts/run_batch_descriptions.sh
-#   ./scripts/run_batch_descriptions.sh --batch-size 50 --cooldown 60
+#   ./scripts/run_batch_descriptions.sh --mode batch --batch-size 50 --cooldown 60
 #   ./scripts/run_batch_descriptions.sh --max-tokens 300 --temp 0.7
 #   ./scripts/run_batch_descriptions.sh --directory /path/to/images --batch-size 200
-#   ./scripts/run_batch_descriptions.sh --prompt "Describe in detail." --progress-file v2.txt --output-dir outputs/v2
+#   ./scripts/run_batch_descriptions.sh --prompt "Describe in detail." --jobs-db v2_jobs.db --output-dir outputs/v2
 #
 
 # Default values
 DIRECTORY="database/512x512"
+MODE="persistent"
+BACKEND="mlx"
 BATCH_SIZE="100"
 COOLDOWN="30"
+WORKER_MAX_IMAGES="2000"
+WORKER_MAX_RSS_GROWTH="2048"
 MAX_TOKENS="100"
 TEMP="0.0"
 PROMPT=""
-PROGRESS_FILE="photo_descriptions_progress.txt"
+JOBS_DB="photo_descriptions_jobs.db"
 OUTPUT_DIR="outputs"
 
 # Parse command line arguments
@@ -44,6 +52,14 @@ while [[ $# -gt 0 ]]; do
             DIRECTORY="$2"
             shift 2
             ;;
+        --mode)
+            MODE="$2"
+            shift 2
+            ;;
+        --backend)
+            BACKEND="$2"
+            shift 2
+            ;;
         --batch-size)
             BATCH_SIZE="$2"
             shift 2
@@ -52,6 +68,14 @@ while [[ $# -gt 0 ]]; do
             COOLDOWN="$2"
             shift 2
             ;;
+        --worker-max-images)
+            WORKER_MAX_IMAGES="$2"
+            shift 2
+            ;;
+        --worker-max-rss-growth)
+            WORKER_MAX_RSS_GROWTH="$2"
+            shift 2
+            ;;
         --max-tokens)
             MAX_TOKENS="$2"
             shift 2
@@ -64,8 +88,8 @@ while [[ $# -gt 0 ]]; do
             PROMPT="$2"
             shift 2
             ;;
-        --progress-file)
-            PROGRESS_FILE="$2"
+        --jobs-db)
+            JOBS_DB="$2"
             shift 2
             ;;
         --output-dir)
@@ -79,21 +103,25 @@ while [[ $# -gt 0 ]]; do
             echo ""
             echo "Options:"
             echo "  --directory PATH      Path to images (default: database/512x512)"
-            echo "  --batch-size NUM      Images per batch (default: 100)"
+            echo "  --mode MODE           persistent (one long-lived worker) or batch (default: persistent)"
+            echo "  --backend NAME        Describer backend: mlx, transformers or stub (default: mlx)"
+            echo "  --batch-size NUM      Images per batch / progress report interval (default: 100)"
             echo "  --cooldown SECS       Seconds between batches (default: 30)"
+            echo "  --worker-max-images NUM   Recycle the persistent worker after NUM images (default: 2000)"
+            echo "  --worker-max-rss-growth MB  Recycle the persistent worker after MB of RSS growth (default: 2048)"
             echo "  --max-tokens NUM      Maximum tokens for output (default: 100)"
             echo "  --temp VALUE          Temperature 0.0-1.0 (default: 0.0)"
             echo "  --prompt TEXT         Prompt for image description"
-            echo "  --progress-file FILE  Progress tracking file (default: photo_descriptions_progress.txt)"
+            echo "  --jobs-db FILE        Job table tracking progress (default: photo_descriptions_jobs.db)"
             echo "  --output-dir PATH     Output directory (default: outputs)"
             echo "  -h, --help            Show this help message"
             echo ""
             echo "Examples:"
             echo "  ./scripts/run_batch_descriptions.sh"
-            echo "  ./scripts/run_batch_descriptions.sh --batch-size 50 --cooldown 60"
+            echo "  ./scripts/run_batch_descriptions.sh --mode batch --batch-size 50 --cooldown 60"
             echo "  ./scripts/run_batch_descriptions.sh --max-tokens 300 --temp 0.7"
             echo "  ./scripts/run_batch_descriptions.sh --directory /path/to/images --batch-size 200"
-            echo "  ./scripts/run_batch_descriptions.sh --prompt \"Describe in detail.\" --progress-file v2.txt --output-dir outputs/v2"
+            echo "  ./scripts/run_batch_descriptions.sh --prompt \"Describe in detail.\" --jobs-db v2_jobs.db --output-dir outputs/v2"
             exit 0
             ;;
         *)
@@ -134,11 +162,17 @@ echo "="
 echo "Starting Batch Image Description Processing"
 echo "="
 echo "Directory:      $DIRECTORY"
-echo "Batch size:     $BATCH_SIZE images per batch"
-echo "Cooldown:       ${COOLDOWN}s between batches"
+echo "Mode:           $MODE"
+echo "Backend:        $BACKEND"
+if [ "$MODE" = "persistent" ]; then
+    echo "Worker recycle: every $WORKER_MAX_IMAGES images or ${WORKER_MAX_RSS_GROWTH} MB RSS growth"
+else
+    echo "Batch size:     $BATCH_SIZE images per batch"
+    echo "Cooldown:       ${COOLDOWN}s between batches"
+fi
 echo "Max tokens:     $MAX_TOKENS"
 echo "Temperature:    $TEMP"
-echo "Progress file:  $PROGRESS_FILE"
+echo "Job table:      $JOBS_DB"
 echo "Output dir:     $OUTPUT_DIR"
 if [ -n "$PROMPT" ]; then
     echo "Prompt:         $PROMPT"
@@ -157,11 +191,15 @@ echo ""
 echo "Starting orchestrator..."
 ORCHESTRATOR_ARGS=(
     "$DIRECTORY"
+    --mode "$MODE"
+    --backend "$BACKEND"
     --batch-size "$BATCH_SIZE"
     --cooldown "$COOLDOWN"
+    --worker-max-images "$WORKER_MAX_IMAGES"
+    --worker-max-rss-growth "$WORKER_MAX_RSS_GROWTH"
     --max-tokens "$MAX_TOKENS"
     --temp "$TEMP"
-    --progress-file "$PROGRESS_FILE"
+    --jobs-db "$JOBS_DB"
     --output-dir "$OUTPUT_DIR"
 )
 if [ -n "$PROMPT" ]; then
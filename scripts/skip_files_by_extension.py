@@ -2,7 +2,7 @@
 """
 Skip files by extension - add placeholder entries to defer processing.
 
-Adds placeholder records to image_analysis.json and progress file so
+Adds placeholder records to the result log and job table so
 batch processing skips these files. Can be undone later.
 
 Usage:
@@ -12,33 +12,32 @@ Usage:
 """
 
 import argparse
-import json
 import sys
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
 
-PROGRESS_FILE = "photo_descriptions_progress.txt"
-JSON_FILE = "outputs/image_analysis.json"
+from job_store import DEFAULT_JOBS_DB, open_jobs  # noqa: E402
+from result_log import (  # noqa: E402
+    ResultLog,
+    migrate_legacy_json,
+    read_results,
+    result_log_path,
+    write_lines,
+)
+
+OUTPUT_DIR = "outputs"
+RESULT_LOG = result_log_path(OUTPUT_DIR)
 SKIP_DESCRIPTION = "Skipped for now"
 SKIP_MODEL = "skipped"
 
 
-def load_progress_file() -> set:
-    """Load processed files from progress file."""
-    path = Path(PROGRESS_FILE)
-    if not path.exists():
-        return set()
-    with open(path, "r") as f:
-        return set(line.strip() for line in f if line.strip())
-
-
-def load_json_file() -> list:
-    """Load existing JSON data."""
-    path = Path(JSON_FILE)
-    if not path.exists():
+def load_result_log() -> list:
+    """Load existing result log entries."""
+    migrate_legacy_json(OUTPUT_DIR)
+    if not Path(RESULT_LOG).exists():
         return []
-    with open(path, "r") as f:
-        return json.load(f)
+    return list(read_results(RESULT_LOG))
 
 
 def find_files_by_extension(directory: Path, extension: str) -> list:
@@ -69,8 +68,9 @@ def skip_files(directory: str, extension: str, dry_run: bool = False) -> int:
     print(f"Found {len(all_files):,} {extension.upper()} files in {directory}")
 
     # Load current progress
-    progress = load_progress_file()
-    print(f"Already in progress file: {len(progress):,} files")
+    with open_jobs(DEFAULT_JOBS_DB) as jobs:
+        progress = jobs.completed_files()
+    print(f"Already completed in job table: {len(progress):,} files")
 
     # Find unprocessed files
     unprocessed = []
@@ -94,9 +94,9 @@ def skip_files(directory: str, extension: str, dry_run: bool = False) -> int:
             print(f"  ... and {len(unprocessed) - 5} more")
         return len(unprocessed)
 
-    # Load existing JSON
-    json_data = load_json_file()
-    print(f"Existing JSON records: {len(json_data):,}")
+    # Load existing results
+    json_data = load_result_log()
+    print(f"Existing result records: {len(json_data):,}")
 
     # Create placeholder records
     new_records = []
@@ -111,17 +111,16 @@ def skip_files(directory: str, extension: str, dry_run: bool = False) -> int:
             }
         )
 
-    # Append to JSON
-    json_data.extend(new_records)
-    with open(JSON_FILE, "w", encoding="utf-8") as f:
-        json.dump(json_data, f, indent=2, ensure_ascii=False)
-    print(f"Added {len(new_records):,} placeholder records to JSON")
+    # Append to the result log
+    with ResultLog(RESULT_LOG, sync_every=len(new_records)) as log:
+        for record in new_records:
+            log.append(record)
+    print(f"Added {len(new_records):,} placeholder records to {RESULT_LOG}")
 
-    # Append to progress file
-    with open(PROGRESS_FILE, "a") as f:
-        for rel_path in unprocessed:
-            f.write(f"{rel_path}\n")
-    print(f"Added {len(unprocessed):,} entries to progress file")
+    # Mark them completed in the job table
+    with open_jobs(DEFAULT_JOBS_DB) as jobs:
+        jobs.finish_many(zip(unprocessed, new_records))
+    print(f"Marked {len(unprocessed):,} files completed in {DEFAULT_JOBS_DB}")
 
     print(f"\nSkipped {len(unprocessed):,} {extension.upper()} files")
     return len(unprocessed)
@@ -135,8 +134,8 @@ def undo_skip(extension: str, dry_run: bool = False) -> int:
     """
     ext_upper = extension.upper().lstrip(".")
 
-    # Load JSON and find skipped entries
-    json_data = load_json_file()
+    # Load results and find skipped entries
+    json_data = load_result_log()
     skipped = []
     kept = []
 
@@ -152,7 +151,7 @@ def undo_skip(extension: str, dry_run: bool = False) -> int:
         else:
             kept.append(record)
 
-    print(f"Found {len(skipped):,} skipped {ext_upper} entries in JSON")
+    print(f"Found {len(skipped):,} skipped {ext_upper} entries in {RESULT_LOG}")
 
     if not skipped:
         print("Nothing to undo!")
@@ -162,21 +161,15 @@ def undo_skip(extension: str, dry_run: bool = False) -> int:
         print(f"\nDry run - would remove {len(skipped):,} entries")
         return len(skipped)
 
-    # Update JSON
-    with open(JSON_FILE, "w", encoding="utf-8") as f:
-        json.dump(kept, f, indent=2, ensure_ascii=False)
-    print(f"Removed {len(skipped):,} placeholder records from JSON")
+    # Rewrite the result log without them
+    write_lines(RESULT_LOG, kept)
+    print(f"Removed {len(skipped):,} placeholder records from {RESULT_LOG}")
 
-    # Update progress file
-    progress = load_progress_file()
-    # Remove the skipped files from progress
+    # Put the skipped files back to pending in the job table
     skipped_rel_paths = set(p.lstrip("./") for p in skipped)
-    remaining = progress - skipped_rel_paths
-
-    with open(PROGRESS_FILE, "w") as f:
-        for rel_path in sorted(remaining):
-            f.write(f"{rel_path}\n")
-    print(f"Removed {len(skipped_rel_paths):,} entries from progress file")
+    with open_jobs(DEFAULT_JOBS_DB) as jobs:
+        jobs.reset(skipped_rel_paths)
+    print(f"Reset {len(skipped_rel_paths):,} files to pending in {DEFAULT_JOBS_DB}")
 
     print(f"\nUndid skip for {len(skipped):,} {ext_upper} files")
     return len(skipped)
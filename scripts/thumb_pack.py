@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+Manage a packed thumbnail store outside mediameta.db.
+
+A pack is an append-only data file of concatenated thumbnail bytes plus a
+small SQLite index (pack_entries) mapping (path, size, format) to an
+offset/length in that file. datasette/plugins/thumbnails.py serves from it
+with mmap when THUMB_PACK_PATH points at the index database.
+
+Original thumbnails from thumbImages are stored with format 'original' and
+size 512; renditions from thumb_renditions keep their size and format.
+Each entry records source_etag, the thumbImages.etag of the thumbnail it
+was made from, so the server skips entries of a thumbnail that has been
+reloaded since. import re-appends entries whose content changed and drops
+entries of paths that left thumbImages.
+
+Commands:
+    import   Append thumbImages (and thumb_renditions) BLOBs to the pack.
+             --strip clears the BLOBs from mediameta.db afterwards; it is
+             refused unless THUMB_PACK_PATH points at the pack, since
+             /thumb/ is then the only route that can serve them.
+    export   Write pack entries back into thumbImages / thumb_renditions.
+    compact  Rewrite the data file without superseded entries.
+    stats    Show live vs. dead bytes.
+
+Usage:
+    python scripts/thumb_pack.py import
+    python scripts/thumb_pack.py import --renditions --strip
+    python scripts/thumb_pack.py export
+    python scripts/thumb_pack.py compact
+    python scripts/thumb_pack.py stats
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+from gallery_tables import create_thumb_renditions_table, fill_thumb_etags, thumb_etag
+
+DEFAULT_DATABASE = "database/mediameta.db"
+DEFAULT_PACK = "database/thumbpack.db"
+ORIGINAL_SIZE = 512
+COMMIT_INTERVAL = 1000
+
+_MAGIC_CONTENT_TYPES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+]
+
+
+def sniff_content_type(data: bytes) -> str:
+    for magic, content_type in _MAGIC_CONTENT_TYPES:
+        if data.startswith(magic):
+            return content_type
+    if data[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1", b"ftypmsf1"):
+        return "image/heic"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+def content_etag(data: bytes) -> str:
+    return '"' + thumb_etag(data) + '"'
+
+
+def open_index(index_path: Path, create: bool = False) -> sqlite3.Connection:
+    """Open the pack index, creating it (and an empty data file) if requested."""
+    if not index_path.exists() and not create:
+        print(f"Error: Pack index not found: {index_path}")
+        sys.exit(1)
+
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(index_path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pack_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS pack_entries (
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            format TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            etag TEXT NOT NULL,
+            content_type TEXT,
+            source_etag TEXT,
+            PRIMARY KEY (path, size, format)
+        ) WITHOUT ROWID
+    """)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(pack_entries)")]
+    if "source_etag" not in columns:
+        # Older index; import fills the column in as entries are re-appended
+        conn.execute("ALTER TABLE pack_entries ADD COLUMN source_etag TEXT")
+        conn.commit()
+    row = conn.execute("SELECT value FROM pack_meta WHERE key = 'data_file'").fetchone()
+    if row is None:
+        data_file = f"{index_path.stem}-0001.pack"
+        (index_path.parent / data_file).touch()
+        conn.execute(
+            "INSERT INTO pack_meta (key, value) VALUES ('data_file', ?)", (data_file,)
+        )
+        conn.commit()
+    return conn
+
+
+def data_path(conn: sqlite3.Connection, index_path: Path) -> Path:
+    row = conn.execute("SELECT value FROM pack_meta WHERE key = 'data_file'").fetchone()
+    return index_path.parent / row[0]
+
+
+def append_entries(conn, pack_file, rows) -> tuple[int, int]:
+    """
+    Append (path, size, format, content, source_etag) rows to the pack.
+
+    Data is fsynced before the index commit, so the index never points at
+    bytes that are not on disk. Returns (entries written, bytes written).
+    """
+    count = 0
+    total = 0
+    for path, size, fmt, content, source_etag in rows:
+        offset = pack_file.tell()
+        pack_file.write(content)
+        conn.execute(
+            """INSERT OR REPLACE INTO pack_entries
+               (path, size, format, offset, length, etag, content_type, source_etag)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+            (
+                path,
+                size,
+                fmt,
+                offset,
+                len(content),
+                content_etag(content),
+                sniff_content_type(content),
+                source_etag,
+            ),
+        )
+        count += 1
+        total += len(content)
+        if count % COMMIT_INTERVAL == 0:
+            pack_file.flush()
+            os.fsync(pack_file.fileno())
+            conn.commit()
+            print(f"  Packed {count} entries...")
+    pack_file.flush()
+    os.fsync(pack_file.fileno())
+    conn.commit()
+    return count, total
+
+
+def has_table(conn: sqlite3.Connection, name: str) -> bool:
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)
+    ).fetchone()
+    return row is not None
+
+
+def pack_is_served(index_path: Path) -> bool:
+    """Whether datasette's THUMB_PACK_PATH points at this pack index."""
+    served = os.environ.get("THUMB_PACK_PATH", "")
+    return bool(served) and os.path.realpath(served) == os.path.realpath(index_path)
+
+
+def cmd_import(args):
+    db_path = Path(args.database)
+    index_path = Path(args.pack)
+    if not db_path.exists():
+        print(f"Error: Database not found: {db_path}")
+        sys.exit(1)
+    if args.strip and not pack_is_served(index_path):
+        print(f"Error: --strip needs THUMB_PACK_PATH set to {index_path},")
+        print("  since /thumb/ is the only route that serves packed thumbnails.")
+        sys.exit(1)
+
+    db = sqlite3.connect(db_path)
+    fill_thumb_etags(db)
+    index = open_index(index_path, create=True)
+
+    # Entries of paths that are no longer in thumbImages
+    index.execute("ATTACH DATABASE ? AS media", (str(db_path),))
+    with index:
+        cursor = index.execute(
+            """DELETE FROM pack_entries WHERE path NOT IN (
+                   SELECT path FROM media.thumbImages WHERE path IS NOT NULL
+               )"""
+        )
+    index.execute("DETACH DATABASE media")
+    if cursor.rowcount:
+        print(f"Dropped {cursor.rowcount} entries of removed thumbnails")
+
+    # (etag, length, source_etag) of each packed entry
+    packed = {
+        (path, size, fmt): (etag, length, source_etag)
+        for path, size, fmt, etag, length, source_etag in index.execute(
+            "SELECT path, size, format, etag, length, source_etag FROM pack_entries"
+        )
+    }
+    relabelled = []
+    reloaded = []
+
+    def needs_append(key: tuple, content: bytes, source_etag) -> bool:
+        """Whether the packed entry for key is missing or has other content."""
+        entry = packed.get(key)
+        if args.rebuild or entry is None:
+            return True
+        if entry[:2] != (content_etag(content), len(content)):
+            return True
+        if entry[2] != source_etag:
+            relabelled.append((source_etag, *key))
+        return False
+
+    def originals():
+        for path, content, source_etag in db.execute(
+            "SELECT path, content, etag FROM thumbImages WHERE content IS NOT NULL"
+        ):
+            key = (path, ORIGINAL_SIZE, "original")
+            if needs_append(key, content, source_etag):
+                if key in packed:
+                    reloaded.append(path)
+                yield path, ORIGINAL_SIZE, "original", content, source_etag
+
+    def renditions():
+        # Skip renditions encoded from an earlier version of the thumbnail;
+        # build_thumbnail_pyramid.py replaces them
+        for path, size, fmt, content, source_etag in db.execute(
+            """SELECT r.path, r.size, r.format, r.content, r.source_etag
+               FROM thumb_renditions r JOIN thumbImages t ON t.path = r.path
+               WHERE r.source_etag IS NULL OR r.source_etag = t.etag"""
+        ):
+            if needs_append((path, size, fmt), content, source_etag):
+                yield path, size, fmt, content, source_etag
+
+    with open(data_path(index, index_path), "ab") as pack_file:
+        print(f"Packing thumbImages into {index_path}...")
+        count, total = append_entries(index, pack_file, originals())
+        print(f"  {count} originals, {total / (1024**2):.1f} MB")
+
+        # Renditions packed from a thumbnail that has since been reloaded
+        with index:
+            index.executemany(
+                "DELETE FROM pack_entries WHERE path = ? AND format != 'original'",
+                [(path,) for path in reloaded],
+            )
+        if reloaded:
+            print(f"  Dropped renditions of {len(reloaded)} reloaded thumbnails")
+            reloaded_paths = set(reloaded)
+            for key in [k for k in packed if k[0] in reloaded_paths]:
+                del packed[key]
+
+        if args.renditions and has_table(db, "thumb_renditions"):
+            print("Packing thumb_renditions...")
+            count, total = append_entries(index, pack_file, renditions())
+            print(f"  {count} renditions, {total / (1024**2):.1f} MB")
+
+    # Unchanged entries from an index that predates source_etag
+    with index:
+        index.executemany(
+            """UPDATE pack_entries SET source_etag = ?
+               WHERE path = ? AND size = ? AND format = ?""",
+            relabelled,
+        )
+
+    if args.strip:
+        print("\nClearing packed BLOBs from the database...")
+        db.execute("ATTACH DATABASE ? AS pack", (str(index_path),))
+        cursor = db.execute(
+            """UPDATE thumbImages SET content = NULL
+               WHERE content IS NOT NULL AND path IN (
+                   SELECT path FROM pack.pack_entries WHERE format = 'original'
+               )"""
+        )
+        print(f"  Cleared {cursor.rowcount} thumbImages rows")
+        if args.renditions and has_table(db, "thumb_renditions"):
+            cursor = db.execute(
+                """DELETE FROM thumb_renditions WHERE EXISTS (
+                       SELECT 1 FROM pack.pack_entries p
+                       WHERE p.path = thumb_renditions.path
+                       AND p.size = thumb_renditions.size
+                       AND p.format = thumb_renditions.format
+                   )"""
+            )
+            print(f"  Removed {cursor.rowcount} thumb_renditions rows")
+        db.commit()
+        print(f"  Run 'sqlite3 {db_path} VACUUM' to reclaim the space.")
+        print(
+            "  /-/media/thumb/, the thumbImages table view and canned queries, and\n"
+            "  build_thumbnail_pyramid.py / compute_thumb_placeholders.py read\n"
+            "  thumbImages.content; run 'export' before using them again."
+        )
+
+    db.close()
+    index.close()
+    print("\nDone!")
+
+
+def cmd_export(args):
+    db_path = Path(args.database)
+    index_path = Path(args.pack)
+    if not db_path.exists():
+        print(f"Error: Database not found: {db_path}")
+        sys.exit(1)
+
+    index = open_index(index_path)
+    db = sqlite3.connect(db_path)
+    fill_thumb_etags(db)
+    create_thumb_renditions_table(db)
+    count = 0
+
+    with open(data_path(index, index_path), "rb") as pack_file:
+        for path, size, fmt, offset, length, source_etag in index.execute(
+            """SELECT path, size, format, offset, length, source_etag
+               FROM pack_entries ORDER BY offset"""
+        ):
+            pack_file.seek(offset)
+            content = pack_file.read(length)
+            if fmt == "original":
+                cursor = db.execute(
+                    "UPDATE thumbImages SET content = ?, size = ?, etag = ? WHERE path = ?",
+                    (content, length, thumb_etag(content), path),
+                )
+                if cursor.rowcount == 0:
+                    db.execute(
+                        """INSERT INTO thumbImages
+                           (path, content, size, should_be_deleted, etag)
+                           VALUES (?, ?, ?, 0, ?)""",
+                        (path, content, length, thumb_etag(content)),
+                    )
+            else:
+                db.execute(
+                    """INSERT OR REPLACE INTO thumb_renditions
+                       (path, size, format, bytes, content, source_etag)
+                       VALUES (?, ?, ?, ?, ?, ?)""",
+                    (path, size, fmt, length, content, source_etag),
+                )
+            count += 1
+            if count % COMMIT_INTERVAL == 0:
+                db.commit()
+                print(f"  Exported {count} entries...")
+
+    db.commit()
+    db.close()
+    index.close()
+    print(f"Exported {count} entries to {db_path}")
+
+
+def cmd_compact(args):
+    index_path = Path(args.pack)
+    index = open_index(index_path)
+    old_data = data_path(index, index_path)
+
+    # Each compaction writes a new generation of the data file
+    generation = int(old_data.stem.rsplit("-", 1)[-1]) + 1
+    new_name = f"{index_path.stem}-{generation:04d}.pack"
+    new_data = index_path.parent / new_name
+
+    moves = []
+    live = 0
+    with open(old_data, "rb") as src, open(new_data, "wb") as dst:
+        for path, size, fmt, offset, length in index.execute(
+            """SELECT path, size, format, offset, length
+               FROM pack_entries ORDER BY path, size, format"""
+        ):
+            src.seek(offset)
+            moves.append((dst.tell(), path, size, fmt))
+            dst.write(src.read(length))
+            live += length
+        dst.flush()
+        os.fsync(dst.fileno())
+
+    # Rewrite offsets and switch data files in one transaction, so the
+    # index is updated in place. Serving processes see the new
+    # PRAGMA data_version and remap; requests already holding the old
+    # mapping finish against it.
+    with index:
+        index.executemany(
+            "UPDATE pack_entries SET offset = ? WHERE path = ? AND size = ? AND format = ?",
+            moves,
+        )
+        index.execute(
+            "UPDATE pack_meta SET value = ? WHERE key = 'data_file'", (new_name,)
+        )
+    index.close()
+
+    old_size = old_data.stat().st_size
+    old_data.unlink()
+
+    print(f"Compacted {old_data.name} -> {new_name}")
+    print(f"  Before: {old_size / (1024**2):.1f} MB")
+    print(f"  After:  {live / (1024**2):.1f} MB")
+
+
+def cmd_stats(args):
+    index_path = Path(args.pack)
+    index = open_index(index_path)
+    data = data_path(index, index_path)
+    file_size = data.stat().st_size if data.exists() else 0
+
+    print(f"Index:     {index_path}")
+    print(f"Data file: {data} ({file_size / (1024**2):.1f} MB)")
+    live_total = 0
+    for fmt, size, n, live in index.execute("""
+        SELECT format, size, COUNT(*), SUM(length)
+        FROM pack_entries GROUP BY format, size ORDER BY format, size
+    """):
+        live_total += live
+        print(f"  {fmt:<8} {size:>4}px  {n:>7,} entries  {live / (1024**2):8.1f} MB")
+    dead = file_size - live_total
+    print(f"Live bytes: {live_total / (1024**2):.1f} MB")
+    print(f"Dead bytes: {dead / (1024**2):.1f} MB (reclaim with 'compact')")
+    index.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Packed thumbnail store tools")
+    parser.add_argument(
+        "--database",
+        default=DEFAULT_DATABASE,
+        help=f"Path to SQLite database (default: {DEFAULT_DATABASE})",
+    )
+    parser.add_argument(
+        "--pack",
+        default=DEFAULT_PACK,
+        help=f"Path to the pack index database (default: {DEFAULT_PACK})",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="Pack thumbnails from the DB")
+    import_parser.add_argument(
+        "--renditions", action="store_true", help="Also pack thumb_renditions"
+    )
+    import_parser.add_argument(
+        "--rebuild", action="store_true", help="Re-append entries already packed"
+    )
+    import_parser.add_argument(
+        "--strip",
+        action="store_true",
+        help="Clear packed BLOBs from mediameta.db after importing (needs "
+        "THUMB_PACK_PATH set to the pack index)",
+    )
+    import_parser.set_defaults(func=cmd_import)
+
+    export_parser = subparsers.add_parser("export", help="Restore BLOBs into the DB")
+    export_parser.set_defaults(func=cmd_export)
+
+    compact_parser = subparsers.add_parser("compact", help="Drop superseded entries")
+    compact_parser.set_defaults(func=cmd_compact)
+
+    stats_parser = subparsers.add_parser("stats", help="Show pack statistics")
+    stats_parser.set_defaults(func=cmd_stats)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -18,6 +18,10 @@ import sys
 from collections import Counter
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from result_log import find_results, latest_per_file, read_results  # noqa: E402
+
 
 SKIP_DESCRIPTION = "Skipped for now"
 SKIP_MODEL = "skipped"
@@ -35,13 +39,11 @@ def count_json_by_extension(json_path: Path) -> tuple[Counter, int]:
     Excludes skipped records.
     Returns (counter, skipped_count)
     """
-    with open(json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
     counter = Counter()
     skipped = 0
 
-    for record in data:
+    # One record per file, as imported
+    for record in latest_per_file(read_results(str(json_path))):
         # Skip placeholder records
         if (
             record.get("description") == SKIP_DESCRIPTION
@@ -85,8 +87,8 @@ def main():
     )
     parser.add_argument(
         "--json-file",
-        default="outputs/image_analysis.json",
-        help="Path to JSON file (default: outputs/image_analysis.json)",
+        default=find_results("outputs"),
+        help="Result log or JSON file (default: outputs/image_analysis.jsonl)",
     )
     parser.add_argument(
         "--database",
@@ -0,0 +1,317 @@
+"""
+Adaptive batch size and cooldown for batch_orchestrator.py --mode batch.
+
+After every batch the orchestrator hands the controller what it measured:
+how many images the batch described and how long it took, the per-image
+generation times and tokens/s it printed, peak memory and swap use while
+it ran (see run_monitored), and the CPU speed limit macOS reports when it
+is throttling. The controller returns the batch size and cooldown for the
+next batch, and why.
+
+The aim is the highest sustained images/hour, counting the cooldown:
+
+- Memory near the hard limit halves the batch size; the orchestrator never
+  starts a batch above the limit (see memory_wait), and stops a batch that
+  goes over it
+- Per-image latency rising within a batch (a leak, or heat) shrinks it
+- Otherwise the batch size climbs, since each batch pays for a model
+  load, and turns around when the batch's own images/hour drops
+- Throttling (a CPU speed limit below 100%, or median tokens/s well below
+  the best batch's) doubles the cooldown; without it the cooldown halves
+
+Usage:
+    from batch_controller import AdaptiveBatchController, measure_batch
+
+    controller = AdaptiveBatchController(batch_size=100, cooldown=30)
+    run = run_monitored(cmd, max_memory_percent=85)
+    decision = controller.update(measure_batch(images, seconds, run))
+    print(decision.batch_size, decision.cooldown, decision.reasons)
+"""
+
+import re
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import psutil
+
+# Adjust when memory is within this many percentage points of the limit
+MEMORY_MARGIN = 10.0
+
+# Latest third of a batch this much slower than the first third
+LATENCY_TREND_LIMIT = 1.25
+
+# Tokens/s below this fraction of the best batch counts as throttling
+TPS_DROP_LIMIT = 0.85
+
+# A change that costs more than this fraction of images/hour is reversed
+RATE_DROP_LIMIT = 0.05
+
+# Batch size steps, as a fraction of the current size
+GROWTH_STEP = 0.25
+SHRINK_FACTOR = 0.75
+
+# How often a running batch's memory use is sampled
+MEMORY_SAMPLE_SECONDS = 2.0
+
+# How long a batch stopped for memory gets to exit before it is killed
+STOP_GRACE_SECONDS = 30.0
+
+
+@dataclass
+class BatchStats:
+    """What one batch measured."""
+
+    images: int
+    seconds: float
+    generation_seconds: List[float] = field(default_factory=list)
+    tps: List[float] = field(default_factory=list)
+    memory_percent: float = 0.0
+    swap_percent: float = 0.0
+    rss_mb: float = 0.0
+    speed_limit: Optional[int] = None
+
+
+@dataclass
+class BatchRun:
+    """A finished batch process, with its peak memory use while it ran."""
+
+    returncode: int
+    stdout: str
+    stderr: str
+    memory_percent: float = 0.0
+    swap_percent: float = 0.0
+    rss_mb: float = 0.0
+    stopped_for_memory: bool = False
+
+
+@dataclass
+class Decision:
+    """Settings for the next batch and the reasons for them."""
+
+    batch_size: int
+    cooldown: float
+    reasons: List[str]
+
+
+def cpu_speed_limit() -> Optional[int]:
+    """
+    The CPU speed limit macOS applies under thermal pressure, in percent
+    (100 = not throttled), or None where it is not reported.
+    """
+    if sys.platform != "darwin":
+        return None
+    try:
+        output = subprocess.run(
+            ["pmset", "-g", "therm"], capture_output=True, text=True, timeout=5
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    match = re.search(r"CPU_Speed_Limit\s*=\s*(\d+)", output)
+    return int(match.group(1)) if match else None
+
+
+def process_rss_mb(process: psutil.Process) -> float:
+    """RSS of a process and its children in MB, 0 once it has exited."""
+    total = 0
+    try:
+        for proc in [process] + process.children(recursive=True):
+            total += proc.memory_info().rss
+    except psutil.Error:
+        pass
+    return total / (1024**2)
+
+
+def run_monitored(
+    cmd: list,
+    max_memory_percent: Optional[float] = None,
+    interval: float = MEMORY_SAMPLE_SECONDS,
+) -> BatchRun:
+    """
+    Run a batch process, sampling system memory, swap and the batch's own
+    RSS every ``interval`` seconds while it runs. If system memory goes over
+    ``max_memory_percent`` the batch is stopped: each image is committed on
+    its own, so the next batch carries on where it left off.
+    """
+    process = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    monitored = psutil.Process(process.pid)
+    run = BatchRun(returncode=0, stdout="", stderr="")
+    stopped_at = None
+    while True:
+        memory_percent = psutil.virtual_memory().percent
+        run.memory_percent = max(run.memory_percent, memory_percent)
+        run.swap_percent = max(run.swap_percent, psutil.swap_memory().percent)
+        run.rss_mb = max(run.rss_mb, process_rss_mb(monitored))
+        if (
+            max_memory_percent is not None
+            and memory_percent >= max_memory_percent
+            and stopped_at is None
+        ):
+            run.stopped_for_memory = True
+            stopped_at = time.monotonic()
+            process.terminate()
+        elif stopped_at is not None and time.monotonic() - stopped_at > STOP_GRACE_SECONDS:
+            process.kill()
+        try:
+            # Output is kept across timeouts, so the pipes never fill up
+            run.stdout, run.stderr = process.communicate(timeout=interval)
+            break
+        except subprocess.TimeoutExpired:
+            continue
+    run.returncode = process.returncode
+    return run
+
+
+def measure_batch(
+    images: int, seconds: float, output: str, run: Optional[BatchRun] = None
+) -> BatchStats:
+    """
+    BatchStats for a generate_descriptions.py batch, from its output and
+    the peak memory use run_monitored() sampled while it ran (without
+    ``run``, the system state now).
+    """
+    if run is None:
+        run = BatchRun(
+            returncode=0,
+            stdout=output,
+            stderr="",
+            memory_percent=psutil.virtual_memory().percent,
+            swap_percent=psutil.swap_memory().percent,
+        )
+    return BatchStats(
+        images=images,
+        seconds=seconds,
+        generation_seconds=[
+            float(v) for v in re.findall(r"Completed in ([\d.]+)s", output)
+        ],
+        tps=[float(v) for v in re.findall(r"([\d.]+) tokens/s", output)],
+        memory_percent=run.memory_percent,
+        swap_percent=run.swap_percent,
+        rss_mb=run.rss_mb,
+        speed_limit=cpu_speed_limit(),
+    )
+
+
+def latency_trend(generation_seconds: List[float]) -> Optional[float]:
+    """Median latency of the last third of a batch over the first third."""
+    third = len(generation_seconds) // 3
+    if third < 3:
+        return None
+    first = statistics.median(generation_seconds[:third])
+    last = statistics.median(generation_seconds[-third:])
+    return last / first if first else None
+
+
+class AdaptiveBatchController:
+    """Feedback control of batch size and cooldown between batches."""
+
+    def __init__(
+        self,
+        batch_size: int = 100,
+        cooldown: float = 30,
+        min_batch_size: int = 10,
+        max_batch_size: int = 500,
+        min_cooldown: float = 0,
+        max_cooldown: float = 300,
+        max_memory_percent: float = 85.0,
+    ):
+        self.batch_size = batch_size
+        self.cooldown = cooldown
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.min_cooldown = min_cooldown
+        self.max_cooldown = max_cooldown
+        self.max_memory_percent = max_memory_percent
+        self.best_tps = 0.0
+        self.last_rate = None
+        self.last_swap_percent = None
+        # +1 while growing the batch size, -1 while shrinking it
+        self.direction = 1
+
+    def clamp_batch_size(self, size: float) -> int:
+        return int(max(self.min_batch_size, min(self.max_batch_size, size)))
+
+    def clamp_cooldown(self, seconds: float) -> float:
+        return round(max(self.min_cooldown, min(self.max_cooldown, seconds)), 1)
+
+    def update(self, stats: BatchStats) -> Decision:
+        """Choose the next batch size and cooldown from the last batch."""
+        reasons = []
+        # The batch size is judged on the batch alone (model load plus
+        # images); the cooldown has its own signal
+        rate = stats.images / stats.seconds * 3600 if stats.seconds else 0.0
+        cycle = stats.seconds + self.cooldown
+        sustained = stats.images / cycle * 3600 if cycle else 0.0
+        median_tps = statistics.median(stats.tps) if stats.tps else None
+        if median_tps:
+            self.best_tps = max(self.best_tps, median_tps)
+        trend = latency_trend(stats.generation_seconds)
+        swap_grew = (
+            self.last_swap_percent is not None
+            and stats.swap_percent > self.last_swap_percent + 1
+        )
+        self.last_swap_percent = stats.swap_percent
+
+        # Batch size
+        size = self.batch_size
+        if stats.memory_percent >= self.max_memory_percent - MEMORY_MARGIN or swap_grew:
+            size = size / 2
+            self.direction = -1
+            reasons.append(
+                f"peak memory {stats.memory_percent:.0f}% (limit "
+                f"{self.max_memory_percent:.0f}%, batch RSS {stats.rss_mb:,.0f} MB), "
+                f"swap {stats.swap_percent:.0f}%"
+            )
+        elif trend is not None and trend > LATENCY_TREND_LIMIT:
+            size = size * SHRINK_FACTOR
+            self.direction = -1
+            reasons.append(f"latency rose {(trend - 1) * 100:.0f}% within the batch")
+        elif stats.images:
+            if self.last_rate and rate < self.last_rate * (1 - RATE_DROP_LIMIT):
+                self.direction = -self.direction
+                reasons.append(
+                    f"images/hour fell {self.last_rate:,.0f} -> {rate:,.0f}, turning"
+                )
+            else:
+                reasons.append(
+                    f"{rate:,.0f} images/hour in the batch, {sustained:,.0f} "
+                    "with the cooldown"
+                )
+            size = size + self.direction * max(1, size * GROWTH_STEP)
+        self.last_rate = rate if stats.images else self.last_rate
+
+        # Cooldown
+        cooldown = self.cooldown
+        throttled = []
+        if stats.speed_limit is not None and stats.speed_limit < 100:
+            throttled.append(f"CPU speed limit {stats.speed_limit}%")
+        if median_tps and median_tps < self.best_tps * TPS_DROP_LIMIT:
+            throttled.append(f"{median_tps:.1f} tokens/s (best {self.best_tps:.1f})")
+        if throttled:
+            cooldown = max(cooldown * 2, 15)
+            reasons.append("throttled: " + ", ".join(throttled))
+        else:
+            cooldown = cooldown / 2
+
+        self.batch_size = self.clamp_batch_size(size)
+        self.cooldown = self.clamp_cooldown(cooldown)
+        return Decision(self.batch_size, self.cooldown, reasons)
+
+    def memory_wait(self, memory_percent: float) -> Decision:
+        """
+        Memory is over the hard limit before a batch: halve the batch size
+        and wait at least the cooldown before checking again.
+        """
+        self.batch_size = self.clamp_batch_size(self.batch_size / 2)
+        self.direction = -1
+        wait = self.clamp_cooldown(max(self.cooldown * 2, 30))
+        reasons = [
+            f"memory {memory_percent:.0f}% over the {self.max_memory_percent:.0f}% "
+            "limit"
+        ]
+        return Decision(self.batch_size, wait, reasons)
@@ -2,34 +2,183 @@
 """
 Batch Orchestrator for Image Description Generation
 
-This script orchestrates the processing of large numbers of images by:
+This script orchestrates the processing of large numbers of images. It has
+two modes:
+
+persistent (default)
+1. Starts one long-lived description_worker.py that keeps the model loaded
+2. Feeds it images over stdin and records results as they arrive
+3. Restarts the worker when it recycles itself (image count or RSS growth
+   threshold) or when it crashes or hangs
+4. Describes images that ran past --image-timeout last, with a fresh
+   worker using --retry-max-tokens and --retry-max-edge
+
+batch
 1. Running generate_descriptions.py in batches
 2. Spawning a fresh Python process for each batch (prevents memory leaks)
-3. Adding cooldown periods between batches
-4. Monitoring system resources
-5. Providing comprehensive logging
+3. Adding cooldown periods between batches (with --adaptive, batch size
+   and cooldown follow measured throughput, latency, memory and
+   throttling; see batch_controller.py)
+4. Retrying images that ran past --image-timeout once nothing else is
+   pending, with --retry-max-tokens and --retry-max-edge
+
+Both modes monitor system resources and provide comprehensive logging.
+With --near-duplicates, both describe one image per group of burst shots
+or duplicates (see near_duplicates.py) and copy its description to the
+rest of the group.
+Images already described with the same prompt, model and settings are
+answered from the description cache (see description_cache.py), and the
+cache hit rate is logged with progress.
 
 Usage:
     python src/batch_orchestrator.py <directory> [options]
 
 Example:
-    python src/batch_orchestrator.py database/512x512 --batch-size 100 --cooldown 30
+    python src/batch_orchestrator.py database/512x512 --batch-size 100
+    python src/batch_orchestrator.py database/512x512 --mode batch --cooldown 30
 """
 
 import argparse
+import json
 import logging
 import os
 import psutil
+import queue
 import re
 import subprocess
 import sys
+import threading
 import time
+from collections import deque
 from datetime import datetime
 from pathlib import Path
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from batch_controller import (  # noqa: E402
+    AdaptiveBatchController,
+    measure_batch,
+    run_monitored,
+)
+from describers import BACKENDS, DEFAULT_BACKEND, get_describer  # noqa: E402
+from description_cache import DEFAULT_CACHE_DB  # noqa: E402
+from image_prefetch import DEFAULT_PREFETCH_DEPTH  # noqa: E402
+from generate_descriptions import (  # noqa: E402
+    DEFAULT_IMAGE_TIMEOUT,
+    TIMEOUT_EXIT_CODE,
+    error_result,
+    find_all_files,
+    group_near_duplicates,
+    inherited_result,
+)
+from job_store import (  # noqa: E402
+    DEFAULT_JOBS_DB,
+    PENDING,
+    RUNNING,
+    TIMED_OUT,
+    open_jobs,
+)
+from near_duplicates import (  # noqa: E402
+    DEFAULT_DUPLICATE_DISTANCE,
+    DEFAULT_DUPLICATE_WINDOW,
+    DEFAULT_EXIF_DB,
+)
+from result_log import ResultLog, migrate_legacy_json, result_log_path  # noqa: E402
+
 # Stop flag file - checked between batches for graceful shutdown
 STOP_FLAG_FILE = ".stop_requested"
 
+# Persistent mode: the result log is synced to disk this often
+SYNC_INTERVAL = 10
+
+# Persistent mode: an image that crashes this many workers is recorded as
+# failed instead of being retried
+MAX_IMAGE_CRASHES = 2
+
+# Persistent mode: give up after this many workers in a row fail before
+# describing a single image
+MAX_CONSECUTIVE_WORKER_FAILURES = 3
+
+# Cheaper settings for images retried after running past the image timeout:
+# fewer tokens to generate, and fewer image tiles to encode
+DEFAULT_RETRY_MAX_TOKENS = 50
+DEFAULT_RETRY_MAX_EDGE = 768
+
+
+class DescriptionWorker:
+    """A running description_worker.py and the messages it sends back."""
+
+    def __init__(self, cmd: list):
+        self.process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+        self.messages = queue.Queue()
+        self.exited = False
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    def _read(self):
+        for line in self.process.stdout:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                self.messages.put(json.loads(line))
+            except json.JSONDecodeError:
+                # Not protocol; keep it visible in the console log
+                print(line, file=sys.stderr)
+        # End of output: the worker has exited
+        self.exited = True
+        self.messages.put(None)
+
+    def send(self, message: dict) -> bool:
+        """Send one message; False if the worker is no longer reading."""
+        try:
+            self.process.stdin.write(json.dumps(message, ensure_ascii=False) + "\n")
+            self.process.stdin.flush()
+            return True
+        except (BrokenPipeError, OSError):
+            return False
+
+    def next_message(self, timeout: float):
+        """
+        Return the next message, or None when the worker has exited or sent
+        nothing for ``timeout`` seconds.
+        """
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def stop(self, timeout: float):
+        """
+        Close stdin (the worker finishes the image it is on and exits) and
+        yield the messages it still sends. Kills it after ``timeout``.
+        """
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        deadline = time.time() + timeout
+        while not (self.exited and self.messages.empty()):
+            message = self.next_message(max(0.0, deadline - time.time()))
+            if message is None:
+                break
+            yield message
+        try:
+            self.process.wait(timeout=max(1.0, deadline - time.time()))
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
 
 class BatchOrchestrator:
     """Orchestrates batch processing of images with memory management."""
@@ -43,8 +192,28 @@ class BatchOrchestrator:
         max_tokens: int = 100,
         temp: float = 0.0,
         prompt: str = "<image>Briefly describe this image in one or two sentences.",
-        progress_file: str = "photo_descriptions_progress.txt",
+        jobs_db: str = DEFAULT_JOBS_DB,
         output_dir: str = "outputs",
+        mode: str = "persistent",
+        worker_max_images: int = 2000,
+        worker_max_rss_growth: float = 2048.0,
+        worker_timeout: int = 600,
+        backend: str = DEFAULT_BACKEND,
+        model: str = None,
+        stub_latency: str = None,
+        prefetch: int = DEFAULT_PREFETCH_DEPTH,
+        image_timeout: float = DEFAULT_IMAGE_TIMEOUT,
+        retry_max_tokens: int = DEFAULT_RETRY_MAX_TOKENS,
+        retry_max_edge: int = DEFAULT_RETRY_MAX_EDGE,
+        adaptive: bool = False,
+        min_batch_size: int = 10,
+        max_batch_size: int = 500,
+        max_cooldown: int = 300,
+        cache_db: str = DEFAULT_CACHE_DB,
+        near_duplicates: bool = False,
+        duplicate_distance: int = DEFAULT_DUPLICATE_DISTANCE,
+        duplicate_window: float = DEFAULT_DUPLICATE_WINDOW,
+        exif_db: str = DEFAULT_EXIF_DB,
     ):
         self.directory = Path(directory)
         self.batch_size = batch_size
@@ -53,12 +222,61 @@ class BatchOrchestrator:
         self.max_tokens = max_tokens
         self.temp = temp
         self.prompt = prompt
-        self.progress_file = progress_file
+        self.jobs_db = jobs_db
         self.output_dir = output_dir
+        self.mode = mode
+        self.worker_max_images = worker_max_images
+        self.worker_max_rss_growth = worker_max_rss_growth
+        self.worker_timeout = worker_timeout
+        self.backend = backend
+        self.model = model
+        self.stub_latency = stub_latency
+        self.prefetch = prefetch
+        self.image_timeout = image_timeout
+        self.retry_max_tokens = retry_max_tokens
+        self.retry_max_edge = retry_max_edge
+        # None turns the description cache off
+        self.cache_db = cache_db
+        self.near_duplicates = near_duplicates
+        self.duplicate_distance = duplicate_distance
+        self.duplicate_window = duplicate_window
+        self.exif_db = exif_db
+        # Batch mode: batch size and cooldown chosen from each batch's
+        # measurements instead of staying fixed
+        self.controller = None
+        if adaptive:
+            self.controller = AdaptiveBatchController(
+                batch_size=batch_size,
+                cooldown=cooldown,
+                min_batch_size=min_batch_size,
+                max_batch_size=max_batch_size,
+                max_cooldown=max_cooldown,
+                max_memory_percent=max_memory_percent,
+            )
+        # Output and peak memory use of the last generate_descriptions.py batch
+        self.last_batch_output = ""
+        self.last_batch_run = None
+        # Recorded as "model" for images no worker could describe
+        self.model_name = get_describer(backend, model=model).name
+
+        # Run counters, reported in the summary
+        self.batch_num = 0
+        self.successful_batches = 0
+        self.failed_batches = 0
+        self.workers_started = 0
+        self.workers_recycled = 0
+        self.workers_failed = 0
+        self.images_timed_out = 0
+        self.images_described = 0
+        self.images_inherited = 0
+        self.cache_hits = 0
 
         # Set up logging
         self.setup_logging()
 
+        # Per-image progress, shared with generate_descriptions.py
+        self.jobs = open_jobs(jobs_db)
+
         # Get total file count
         self.total_files = self._count_files()
         self.logger.info(f"Total files in directory: {self.total_files}")
@@ -110,11 +328,7 @@ class BatchOrchestrator:
 
     def get_completed_count(self) -> int:
         """Get count of already completed files."""
-        if not os.path.exists(self.progress_file):
-            return 0
-
-        with open(self.progress_file, "r") as f:
-            return sum(1 for line in f if line.strip())
+        return self.jobs.completed_count()
 
     def check_stop_requested(self) -> bool:
         """Check if a graceful stop has been requested via flag file."""
@@ -144,12 +358,13 @@ class BatchOrchestrator:
             f"CPU: {cpu_percent:.1f}%"
         )
 
-    def run_batch(self, batch_num: int) -> bool:
+    def run_batch(self, batch_num: int, retry: bool = False) -> bool:
         """
         Run a single batch of image descriptions.
 
         Args:
             batch_num: The batch number (for logging)
+            retry: Describe timed-out images with the retry settings
 
         Returns:
             True if batch completed successfully, False otherwise
@@ -158,19 +373,9 @@ class BatchOrchestrator:
         self.log_system_stats()
 
         # Check memory before starting
-        memory_ok, memory_percent = self.check_memory()
-        if not memory_ok:
-            self.logger.warning(
-                f"Memory usage high ({memory_percent:.1f}%), "
-                f"waiting for memory to free up..."
-            )
-            time.sleep(60)
-            memory_ok, memory_percent = self.check_memory()
-            if not memory_ok:
-                self.logger.error(
-                    f"Memory still high ({memory_percent:.1f}%), skipping batch"
-                )
-                return False
+        if not self.wait_for_memory():
+            self.logger.error("Skipping batch")
+            return False
 
         # Build command
         cmd = [
@@ -178,29 +383,61 @@ class BatchOrchestrator:
             "src/generate_descriptions.py",
             str(self.directory),
             str(self.batch_size),
-            "--max-tokens",
-            str(self.max_tokens),
             "--temp",
             str(self.temp),
             "--prompt",
             self.prompt,
-            "--progress-file",
-            self.progress_file,
+            "--jobs-db",
+            self.jobs_db,
             "--output-dir",
             self.output_dir,
-        ]
+        ] + self.backend_args() + self.deadline_args(retry)
+        if retry:
+            cmd.append("--retry-timed-out")
+        elif self.near_duplicates:
+            cmd += [
+                "--near-duplicates",
+                "--duplicate-distance",
+                str(self.duplicate_distance),
+                "--duplicate-window",
+                str(self.duplicate_window),
+                "--exif-db",
+                self.exif_db,
+            ]
 
         self.logger.info(f"Running: {' '.join(cmd)}")
 
+        self.last_batch_output = ""
+        self.last_batch_run = None
         try:
             # Run as subprocess - this is KEY for memory management
-            # When the process exits, ALL memory is freed
-            result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+            # When the process exits, ALL memory is freed. Memory is sampled
+            # while it runs, and it is stopped if it goes over the limit.
+            run = run_monitored(cmd, self.max_memory_percent)
+            self.last_batch_run = run
+            self.last_batch_output = run.stdout
+            self.count_cache_hits(run.stdout)
+            self.logger.info(
+                f"Batch {batch_num} peak memory: {run.memory_percent:.1f}% "
+                f"(batch RSS {run.rss_mb:,.0f} MB), swap {run.swap_percent:.1f}%"
+            )
+
+            if run.stopped_for_memory:
+                # Images finished so far are recorded; the rest stay pending
+                self.logger.warning(
+                    f"Batch {batch_num} stopped: memory reached "
+                    f"{run.memory_percent:.1f}% (limit {self.max_memory_percent:.0f}%)"
+                )
+                return True
+            if run.returncode != 0:
+                raise subprocess.CalledProcessError(
+                    run.returncode, cmd, run.stdout, run.stderr
+                )
 
             self.logger.info(f"Batch {batch_num} completed successfully")
 
             # Parse GPU throughput from subprocess output
-            tps_values = re.findall(r"([\d.]+) tokens/s", result.stdout)
+            tps_values = re.findall(r"([\d.]+) tokens/s", run.stdout)
             if tps_values:
                 tps_floats = [float(v) for v in tps_values]
                 avg_tps = sum(tps_floats) / len(tps_floats)
@@ -210,11 +447,20 @@ class BatchOrchestrator:
                     f"n={len(tps_floats)})"
                 )
 
-            self.logger.debug(f"Output: {result.stdout}")
+            self.logger.debug(f"Output: {run.stdout}")
 
             return True
 
         except subprocess.CalledProcessError as e:
+            if e.returncode == TIMEOUT_EXIT_CODE:
+                # The image it was stuck on is marked in the job table; the
+                # next batch carries on after it
+                self.images_timed_out += 1
+                last_line = (e.stderr.strip().splitlines() or [""])[-1]
+                self.logger.warning(
+                    f"Batch {batch_num} stopped on an image timeout: {last_line}"
+                )
+                return True
             self.logger.error(
                 f"Batch {batch_num} failed with error code {e.returncode}"
             )
@@ -225,68 +471,519 @@ class BatchOrchestrator:
             self.logger.error(f"Unexpected error in batch {batch_num}: {e}")
             return False
 
-    def run(self):
-        """Main orchestration loop."""
-        self.logger.info("=" * 70)
-        self.logger.info("BATCH ORCHESTRATOR STARTED")
-        self.logger.info(f"Directory: {self.directory}")
-        self.logger.info(f"Total files: {self.total_files}")
-        self.logger.info(f"Batch size: {self.batch_size}")
-        self.logger.info(f"Cooldown: {self.cooldown}s")
-        self.logger.info("Model: smolvlm2")
-        self.logger.info(f"Max tokens: {self.max_tokens}")
-        self.logger.info(f"Temperature: {self.temp}")
-        self.logger.info(f"Prompt: {self.prompt}")
-        self.logger.info("=" * 70)
+    def count_cache_hits(self, output: str):
+        """Batch mode: add a batch's images and cache hits to the run totals."""
+        self.images_described += len(
+            re.findall(r"^\[\d+/\d+\] Processing:", output, re.MULTILINE)
+        )
+        self.cache_hits += output.count("  Cached description")
 
-        batch_num = 0
-        successful_batches = 0
-        failed_batches = 0
-        start_time = time.time()
+    def log_cache_hits(self):
+        """Log how many images this run took from the description cache."""
+        if self.cache_db and self.images_described:
+            self.logger.info(
+                f"Description cache: {self.cache_hits:,} of "
+                f"{self.images_described:,} images "
+                f"({self.cache_hits / self.images_described * 100:.1f}% hit rate)"
+            )
+
+    def wait_for_memory(self) -> bool:
+        """Wait for memory to free up if usage is high; False if it stays high."""
+        memory_ok, memory_percent = self.check_memory()
+        if memory_ok:
+            return True
+        if self.controller:
+            return self.wait_for_memory_adaptive(memory_percent)
+        self.logger.warning(
+            f"Memory usage high ({memory_percent:.1f}%), "
+            f"waiting for memory to free up..."
+        )
+        time.sleep(60)
+        memory_ok, memory_percent = self.check_memory()
+        if not memory_ok:
+            self.logger.error(f"Memory still high ({memory_percent:.1f}%)")
+        return memory_ok
+
+    def wait_for_memory_adaptive(self, memory_percent: float) -> bool:
+        """
+        Adaptive mode: instead of skipping the batch, shrink it and wait in
+        growing steps, up to --max-cooldown in all, for memory to drop
+        below the limit.
+        """
+        waited = 0.0
+        while waited < self.controller.max_cooldown:
+            decision = self.controller.memory_wait(memory_percent)
+            self.batch_size = decision.batch_size
+            self.logger.warning(
+                f"Controller: {'; '.join(decision.reasons)} - batch size "
+                f"{decision.batch_size}, waiting {decision.cooldown:g}s"
+            )
+            time.sleep(decision.cooldown)
+            waited += decision.cooldown
+            memory_ok, memory_percent = self.check_memory()
+            if memory_ok:
+                return True
+        self.logger.error(f"Memory still high ({memory_percent:.1f}%)")
+        return False
+
+    def adapt(self, images: int, seconds: float):
+        """Adaptive mode: pick the next batch size and cooldown, and log why."""
+        stats = measure_batch(
+            images, seconds, self.last_batch_output, self.last_batch_run
+        )
+        old_size, old_cooldown = self.batch_size, self.cooldown
+        decision = self.controller.update(stats)
+        self.batch_size, self.cooldown = decision.batch_size, decision.cooldown
+        self.logger.info(
+            f"Controller: batch {old_size} -> {self.batch_size}, cooldown "
+            f"{old_cooldown:g}s -> {self.cooldown:g}s ({'; '.join(decision.reasons)})"
+        )
+
+    def backend_args(self) -> list:
+        """Describer options for generate_descriptions.py and the worker."""
+        args = ["--backend", self.backend, "--prefetch", str(self.prefetch)]
+        if self.model:
+            args += ["--model", self.model]
+        if self.stub_latency:
+            args += ["--stub-latency", self.stub_latency]
+        if self.cache_db:
+            args += ["--cache-db", self.cache_db]
+        else:
+            args.append("--no-cache")
+        return args
+
+    def deadline_args(self, retry: bool) -> list:
+        """
+        Image timeout and generation limits for generate_descriptions.py and
+        the worker; ``retry`` selects the cheaper timed-out image settings.
+        """
+        max_tokens = self.retry_max_tokens if retry else self.max_tokens
+        args = [
+            "--max-tokens",
+            str(max_tokens),
+            "--image-timeout",
+            str(self.image_timeout),
+        ]
+        if retry and self.retry_max_edge:
+            args += ["--max-image-edge", str(self.retry_max_edge)]
+        return args
+
+    def start_worker(self, retry: bool = False):
+        """
+        Start description_worker.py and wait until its model is loaded.
+        Returns the DescriptionWorker, or None if it did not come up.
+        """
+        cmd = [
+            sys.executable,
+            "src/description_worker.py",
+            "--temp",
+            str(self.temp),
+            "--prompt",
+            self.prompt,
+            "--max-images",
+            str(self.worker_max_images),
+            "--max-rss-growth",
+            str(self.worker_max_rss_growth),
+        ] + self.backend_args() + self.deadline_args(retry)
+        self.logger.info(f"Starting worker: {' '.join(cmd)}")
+        worker = DescriptionWorker(cmd)
+        self.workers_started += 1
+
+        message = worker.next_message(self.worker_timeout)
+        if message is None or message.get("type") != "ready":
+            self.logger.error(
+                f"Worker {worker.pid} did not become ready "
+                f"(exit code {worker.process.poll()})"
+            )
+            list(worker.stop(timeout=10))
+            return None
+        self.logger.info(
+            f"Worker {worker.pid} ready - model loaded in "
+            f"{message.get('load_seconds')}s, RSS {message.get('rss_mb')} MB"
+        )
+        return worker
+
+    def pending_files(self) -> list:
+        """
+        Return [(absolute path, relative path)] of the images still to
+        describe, in the order generate_descriptions.py processes them.
+        """
+        output_file = result_log_path(self.output_dir)
+        if self.jobs.completed_count() and not os.path.exists(output_file):
+            self.logger.warning(
+                "Job table has progress but output file is missing - starting fresh"
+            )
+            self.jobs.reset()
+
+        all_files, base_path = find_all_files(str(self.directory))
+        self.jobs.add_files(str(path.relative_to(base_path)) for path in all_files)
+        todo = set(self.jobs.pending_files())
+        pending = []
+        for path in all_files:
+            rel_path = str(path.relative_to(base_path))
+            if rel_path in todo:
+                pending.append((str(path), rel_path))
+        return pending
+
+    def group_pending(self, pending: list) -> tuple[list, dict]:
+        """
+        Take near-duplicates out of ``pending`` [(absolute path, relative
+        path)]. Returns (the images to describe, {relative path of a
+        representative: [relative paths of the near-duplicates that inherit
+        its description]}).
+        """
+        base_path = self.directory.resolve()
+        members_of = group_near_duplicates(
+            self.jobs,
+            [Path(path) for path, _ in pending],
+            base_path,
+            self.exif_db,
+            self.duplicate_distance,
+            self.duplicate_window,
+        )
+        members_of = {
+            str(rep.relative_to(base_path)): [
+                str(m.relative_to(base_path)) for m in members
+            ]
+            for rep, members in members_of.items()
+        }
+        inheriting = {m for members in members_of.values() for m in members}
+        self.logger.info(
+            f"Near-duplicates: {len(inheriting):,} images will inherit "
+            f"descriptions from {len(members_of):,} representatives"
+        )
+        return [item for item in pending if item[1] not in inheriting], members_of
+
+    def timed_out_files(self) -> list:
+        """[(absolute path, relative path)] of the images waiting for a retry."""
+        base_path = self.directory.resolve()
+        return [(str(base_path / rel), rel) for rel in self.jobs.timed_out_files()]
+
+    def run_persistent(self):
+        """Describe every pending image with a supervised persistent worker."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        migrated = migrate_legacy_json(self.output_dir)
+        if migrated:
+            self.logger.info(
+                f"Copied {migrated:,} results from image_analysis.json to the log"
+            )
+
+        pending = self.pending_files()
+        # Near-duplicates get their representative's description when it is
+        # recorded; if it fails they stay pending, to be grouped next run
+        members_of = {}
+        if self.near_duplicates:
+            pending, members_of = self.group_pending(pending)
+        todo = deque(pending)
+        self.logger.info(f"Images to describe: {len(todo):,}")
+
+        worker = None
+        in_flight = deque()
+        crashes = {}
+        results = ResultLog(result_log_path(self.output_dir), SYNC_INTERVAL)
+        recorded = 0
+        tps_values = []
+        wait_seconds = []
+        consecutive_failures = 0
+        # Second pass over images that ran past the image timeout
+        retrying = False
+
+        def record(result: dict, rel_path: str):
+            nonlocal recorded
+            results.append(result)
+            self.jobs.finish(rel_path, result, self.prompt)
+            members = [] if result.get("error") else members_of.get(rel_path, [])
+            if members:
+                inherited = [
+                    (member, inherited_result(result, member)) for member in members
+                ]
+                for _, entry in inherited:
+                    results.append(entry)
+                self.jobs.finish_many(inherited, self.prompt)
+                self.images_inherited += len(inherited)
+            recorded += 1
+            self.images_described += 1
+            if result.get("cached"):
+                self.cache_hits += 1
+            if result.get("generation_tps"):
+                tps_values.append(result["generation_tps"])
+            if recorded % self.batch_size == 0:
+                self.log_persistent_progress(tps_values, wait_seconds)
+                tps_values.clear()
+                wait_seconds.clear()
+
+        def handle(message: dict) -> bool:
+            """Record a result message; False for anything else."""
+            if message.get("type") != "result" or not in_flight:
+                return False
+            _, rel_path = in_flight.popleft()
+            wait_seconds.append(message.get("wait_seconds") or 0.0)
+            record(message["result"], rel_path)
+            return True
 
         try:
             while True:
-                # Check for stop request before starting new batch
+                if not todo and not in_flight:
+                    retry = [] if retrying else self.timed_out_files()
+                    if not retry:
+                        break
+                    retrying = True
+                    todo.extend(retry)
+                    self.logger.info(
+                        f"Retrying {len(retry):,} timed-out images with max tokens "
+                        f"{self.retry_max_tokens}, max image edge "
+                        f"{self.retry_max_edge or 'unchanged'}"
+                    )
+                    if worker is not None:
+                        # Nothing is in flight; restart with the retry settings
+                        list(worker.stop(timeout=self.worker_timeout))
+                        worker = None
+
                 if self.check_stop_requested():
                     self.logger.info("Stop requested - shutting down gracefully")
                     break
 
-                batch_num += 1
+                if worker is None:
+                    if consecutive_failures >= MAX_CONSECUTIVE_WORKER_FAILURES:
+                        self.logger.error(
+                            f"{consecutive_failures} workers in a row failed "
+                            f"without describing an image - giving up"
+                        )
+                        break
+                    if not self.wait_for_memory():
+                        continue
+                    self.log_system_stats()
+                    worker = self.start_worker(retry=retrying)
+                    if worker is None:
+                        self.workers_failed += 1
+                        consecutive_failures += 1
+                        time.sleep(self.cooldown)
+                        continue
+
+                # The image being described plus --prefetch decoding ahead
+                while todo and len(in_flight) < self.prefetch + 1:
+                    path, rel_path = todo.popleft()
+                    in_flight.append((path, rel_path))
+                    self.jobs.start(rel_path)
+                    worker.send({"path": path, "file": rel_path})
+
+                message = worker.next_message(self.worker_timeout)
+                if message is not None and handle(message):
+                    consecutive_failures = 0
+                    continue
+
+                if message is not None and message.get("type") == "recycle":
+                    self.logger.info(
+                        f"Worker {worker.pid} recycling: {message.get('reason')} "
+                        f"(RSS {message.get('rss_mb')} MB)"
+                    )
+                    self.workers_recycled += 1
+                    for message in worker.stop(timeout=60):
+                        handle(message)
+                elif message is not None and message.get("type") == "timeout":
+                    # The worker gave up on the image it was describing and
+                    # exited; the rest of in_flight goes to the next worker
+                    _, rel_path = in_flight.popleft()
+                    seconds = message.get("seconds")
+                    self.images_timed_out += 1
+                    self.jobs.time_out(rel_path, seconds)
+                    if retrying:
+                        self.logger.error(
+                            f"{rel_path} timed out again after {seconds}s on "
+                            f"retry - recording it as failed"
+                        )
+                        record(
+                            error_result(
+                                rel_path,
+                                f"timed out after {seconds}s again on retry",
+                                self.model_name,
+                            ),
+                            rel_path,
+                        )
+                    else:
+                        self.logger.warning(
+                            f"{rel_path} timed out after {seconds}s - moved to "
+                            f"the retry queue"
+                        )
+                    consecutive_failures = 0
+                    list(worker.stop(timeout=10))
+                else:
+                    # Exited without saying why, or hung on an image
+                    reason = (
+                        f"exited with code {worker.process.wait()}"
+                        if worker.exited
+                        else f"sent nothing for {self.worker_timeout}s"
+                    )
+                    self.logger.error(f"Worker {worker.pid} {reason}")
+                    self.workers_failed += 1
+                    consecutive_failures += 1
+                    for message in worker.stop(timeout=10):
+                        handle(message)
+                    if in_flight:
+                        # The image it was working on may be what killed it
+                        path, rel_path = in_flight[0]
+                        crashes[rel_path] = crashes.get(rel_path, 0) + 1
+                        if crashes[rel_path] >= MAX_IMAGE_CRASHES:
+                            self.logger.error(
+                                f"Giving up on {rel_path} after "
+                                f"{crashes[rel_path]} worker failures"
+                            )
+                            in_flight.popleft()
+                            record(
+                                error_result(
+                                    rel_path, f"worker {reason}", self.model_name
+                                ),
+                                rel_path,
+                            )
+                            consecutive_failures = 0
+                worker = None
+                # Images sent but not described go to the next worker first
+                todo.extendleft(reversed(in_flight))
+                in_flight.clear()
+        finally:
+            if worker is not None:
+                # Let the worker finish and report the image it is on
+                for message in worker.stop(timeout=self.worker_timeout):
+                    handle(message)
+            results.close()
+
+    def log_persistent_progress(self, tps_values: list, wait_seconds: list):
+        """Log overall progress and throughput since the last report."""
+        completed = self.get_completed_count()
+        percent_complete = (completed / self.total_files) * 100
+        self.logger.info(
+            f"Progress: {completed:,} / {self.total_files:,} "
+            f"({percent_complete:.1f}%)"
+        )
+        if tps_values:
+            avg_tps = sum(tps_values) / len(tps_values)
+            self.logger.info(
+                f"GPU Throughput - avg: {avg_tps:.1f} tokens/sec "
+                f"(range: {min(tps_values):.1f} - {max(tps_values):.1f}, "
+                f"n={len(tps_values)})"
+            )
+        if wait_seconds:
+            # Time the model sat idle waiting for the next image to load
+            self.logger.info(
+                f"Input wait: {sum(wait_seconds):.2f}s over "
+                f"{len(wait_seconds)} images"
+            )
+        self.log_cache_hits()
+        self.log_system_stats()
 
-                # Check how many files are left
-                completed = self.get_completed_count()
-                remaining = self.total_files - completed
+    def run_batches(self):
+        """Run generate_descriptions.py batches until every file is done."""
+        while True:
+            # Check for stop request before starting new batch
+            if self.check_stop_requested():
+                self.logger.info("Stop requested - shutting down gracefully")
+                break
 
-                if remaining <= 0:
-                    self.logger.info("All files processed! 🎉")
-                    break
+            self.batch_num += 1
+
+            # Check how many files are left
+            completed = self.get_completed_count()
+            remaining = self.total_files - completed
 
-                percent_complete = (completed / self.total_files) * 100
+            if remaining <= 0:
+                self.logger.info("All files processed! 🎉")
+                break
+
+            percent_complete = (completed / self.total_files) * 100
+            self.logger.info(
+                f"Progress: {completed:,} / {self.total_files:,} "
+                f"({percent_complete:.1f}%) - {remaining:,} remaining"
+            )
+            self.log_cache_hits()
+
+            # Timed-out images are retried once nothing else is pending
+            counts = self.jobs.counts()
+            retry = bool(
+                counts.get(TIMED_OUT)
+                and not counts.get(PENDING)
+                and not counts.get(RUNNING)
+            )
+            if retry:
                 self.logger.info(
-                    f"Progress: {completed:,} / {self.total_files:,} "
-                    f"({percent_complete:.1f}%) - {remaining:,} remaining"
+                    f"Retrying {counts[TIMED_OUT]:,} timed-out images with max "
+                    f"tokens {self.retry_max_tokens}"
                 )
 
-                # Run the batch
-                success = self.run_batch(batch_num)
+            # Run the batch
+            batch_start = time.time()
+            success = self.run_batch(self.batch_num, retry=retry)
+            batch_seconds = time.time() - batch_start
 
-                if success:
-                    successful_batches += 1
-                else:
-                    failed_batches += 1
-                    self.logger.warning(f"Failed batches so far: {failed_batches}")
+            if success:
+                self.successful_batches += 1
+            else:
+                self.failed_batches += 1
+                self.logger.warning(f"Failed batches so far: {self.failed_batches}")
 
-                # Check if we're done
-                completed_after = self.get_completed_count()
-                if completed_after >= self.total_files:
-                    self.logger.info("All files processed! 🎉")
-                    break
+            # Check if we're done
+            completed_after = self.get_completed_count()
+            if completed_after >= self.total_files:
+                self.logger.info("All files processed! 🎉")
+                break
 
-                # Cooldown period
+            if self.controller:
+                self.adapt(completed_after - completed, batch_seconds)
+
+            # Cooldown period
+            self.logger.info(
+                f"Cooldown: waiting {self.cooldown}s before next batch..."
+            )
+            time.sleep(self.cooldown)
+
+    def run(self):
+        """Main orchestration loop."""
+        self.logger.info("=" * 70)
+        self.logger.info("BATCH ORCHESTRATOR STARTED")
+        self.logger.info(f"Directory: {self.directory}")
+        self.logger.info(f"Total files: {self.total_files}")
+        self.logger.info(f"Mode: {self.mode}")
+        if self.mode == "persistent":
+            self.logger.info(
+                f"Worker recycling: every {self.worker_max_images} images or "
+                f"{self.worker_max_rss_growth:.0f} MB RSS growth"
+            )
+        else:
+            self.logger.info(f"Batch size: {self.batch_size}")
+            self.logger.info(f"Cooldown: {self.cooldown}s")
+            if self.controller:
                 self.logger.info(
-                    f"Cooldown: waiting {self.cooldown}s before next batch..."
+                    f"Adaptive: batch size {self.controller.min_batch_size}-"
+                    f"{self.controller.max_batch_size}, cooldown up to "
+                    f"{self.controller.max_cooldown}s, memory limit "
+                    f"{self.max_memory_percent:.0f}%"
                 )
-                time.sleep(self.cooldown)
+        self.logger.info(f"Backend: {self.backend} ({self.model_name})")
+        self.logger.info(f"Max tokens: {self.max_tokens}")
+        if self.image_timeout:
+            self.logger.info(
+                f"Image timeout: {self.image_timeout:g}s (retry: max tokens "
+                f"{self.retry_max_tokens}, max image edge "
+                f"{self.retry_max_edge or 'unchanged'})"
+            )
+        self.logger.info(f"Temperature: {self.temp}")
+        self.logger.info(f"Prompt: {self.prompt}")
+        self.logger.info(f"Description cache: {self.cache_db or 'off'}")
+        if self.near_duplicates:
+            self.logger.info(
+                f"Near-duplicates: within {self.duplicate_distance} bits and "
+                f"{self.duplicate_window:g}s share a description"
+            )
+        self.logger.info("=" * 70)
+
+        start_time = time.time()
+
+        try:
+            if self.mode == "persistent":
+                self.run_persistent()
+                if self.get_completed_count() >= self.total_files:
+                    self.logger.info("All files processed! 🎉")
+            else:
+                self.run_batches()
 
         except KeyboardInterrupt:
             self.logger.info("\nReceived interrupt signal - stopping gracefully")
@@ -304,12 +1001,30 @@ class BatchOrchestrator:
 
             self.logger.info("=" * 70)
             self.logger.info("BATCH ORCHESTRATOR SUMMARY")
-            self.logger.info(f"Total batches run: {batch_num}")
-            self.logger.info(f"Successful: {successful_batches}")
-            self.logger.info(f"Failed: {failed_batches}")
+            if self.mode == "persistent":
+                self.logger.info(f"Workers started: {self.workers_started}")
+                self.logger.info(f"Recycled: {self.workers_recycled}")
+                self.logger.info(f"Failed: {self.workers_failed}")
+            else:
+                self.logger.info(f"Total batches run: {self.batch_num}")
+                self.logger.info(f"Successful: {self.successful_batches}")
+                self.logger.info(f"Failed: {self.failed_batches}")
             self.logger.info(
                 f"Files processed: {final_completed:,} / {self.total_files:,} ({final_percent:.1f}%)"
             )
+            if self.image_timeout:
+                stats = self.jobs.timeout_stats()
+                self.logger.info(
+                    f"Image timeouts this run: {self.images_timed_out} - "
+                    f"{stats['images']:,} images timed out in total, "
+                    f"{stats['recovered']:,} recovered on retry, "
+                    f"{stats['failed']:,} failed, {stats['waiting']:,} waiting"
+                )
+            self.log_cache_hits()
+            if self.near_duplicates and self.mode == "persistent":
+                self.logger.info(
+                    f"Inherited by near-duplicates this run: {self.images_inherited:,}"
+                )
             self.logger.info(f"Elapsed time: {elapsed_hours:.2f} hours")
             if final_completed > 0:
                 rate = final_completed / elapsed_hours
@@ -322,17 +1037,94 @@ def main():
         description="Batch orchestrator for image description generation"
     )
     parser.add_argument("directory", help="Directory containing images to process")
+    parser.add_argument(
+        "--mode",
+        choices=["persistent", "batch"],
+        default="persistent",
+        help="persistent: one long-lived worker keeps the model loaded; "
+        "batch: a fresh generate_descriptions.py per batch (default: persistent)",
+    )
     parser.add_argument(
         "--batch-size",
         type=int,
         default=100,
-        help="Number of images to process per batch (default: 100)",
+        help="Number of images to process per batch; in persistent mode, how "
+        "often progress is logged (default: 100)",
     )
     parser.add_argument(
         "--cooldown",
         type=int,
         default=30,
-        help="Seconds to wait between batches (default: 30)",
+        help="Seconds to wait between batches, or before restarting a failed "
+        "worker (default: 30)",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help="Batch mode: adjust batch size and cooldown after every batch from "
+        "tokens/s, latency trend, memory and throttling; --batch-size and "
+        "--cooldown are the starting values",
+    )
+    parser.add_argument(
+        "--min-batch-size",
+        type=int,
+        default=10,
+        help="Adaptive mode: smallest batch size (default: 10)",
+    )
+    parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        default=500,
+        help="Adaptive mode: largest batch size (default: 500)",
+    )
+    parser.add_argument(
+        "--max-cooldown",
+        type=int,
+        default=300,
+        help="Adaptive mode: longest cooldown, and longest wait for memory to "
+        "drop below --max-memory (default: 300)",
+    )
+    parser.add_argument(
+        "--worker-max-images",
+        type=int,
+        default=2000,
+        help="Persistent mode: recycle the worker after this many images, "
+        "0 = never (default: 2000)",
+    )
+    parser.add_argument(
+        "--worker-max-rss-growth",
+        type=float,
+        default=2048.0,
+        help="Persistent mode: recycle the worker once its RSS has grown by "
+        "this many MB after loading the model, 0 = never (default: 2048)",
+    )
+    parser.add_argument(
+        "--worker-timeout",
+        type=int,
+        default=600,
+        help="Persistent mode: restart a worker that sends nothing for this "
+        "many seconds (default: 600)",
+    )
+    parser.add_argument(
+        "--image-timeout",
+        type=float,
+        default=DEFAULT_IMAGE_TIMEOUT,
+        help="Seconds one image may take before it is moved to a retry queue "
+        f"described last, 0 = no limit (default: {DEFAULT_IMAGE_TIMEOUT})",
+    )
+    parser.add_argument(
+        "--retry-max-tokens",
+        type=int,
+        default=DEFAULT_RETRY_MAX_TOKENS,
+        help="Maximum tokens when retrying timed-out images "
+        f"(default: {DEFAULT_RETRY_MAX_TOKENS})",
+    )
+    parser.add_argument(
+        "--retry-max-edge",
+        type=int,
+        default=DEFAULT_RETRY_MAX_EDGE,
+        help="Largest image side when retrying timed-out images, 0 = the "
+        f"model's own (default: {DEFAULT_RETRY_MAX_EDGE})",
     )
     parser.add_argument(
         "--max-memory",
@@ -340,6 +1132,25 @@ def main():
         default=85.0,
         help="Maximum memory usage percent before pausing (default: 85.0)",
     )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default=DEFAULT_BACKEND,
+        help=f"Describer backend (default: {DEFAULT_BACKEND}); stub needs no model",
+    )
+    parser.add_argument("--model", help="Model to load (default: per backend)")
+    parser.add_argument(
+        "--stub-latency",
+        help="Stub backend latency, e.g. fixed:0.5, uniform:0.2,0.8, "
+        "normal:1.5,0.3 or lognormal:1.2,0.4",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=DEFAULT_PREFETCH_DEPTH,
+        help="Images decoded and resized ahead of the model, on background "
+        f"threads (default: {DEFAULT_PREFETCH_DEPTH})",
+    )
     parser.add_argument(
         "--max-tokens",
         type=int,
@@ -358,15 +1169,53 @@ def main():
         help="Prompt for image description (default: brief one-sentence description)",
     )
     parser.add_argument(
-        "--progress-file",
-        default="photo_descriptions_progress.txt",
-        help="Progress tracking file (default: photo_descriptions_progress.txt)",
+        "--jobs-db",
+        default=DEFAULT_JOBS_DB,
+        help=f"Job table tracking progress (default: {DEFAULT_JOBS_DB})",
     )
     parser.add_argument(
         "--output-dir",
         default="outputs",
         help="Directory for output files (default: outputs)",
     )
+    parser.add_argument(
+        "--cache-db",
+        default=DEFAULT_CACHE_DB,
+        help="Description cache, keyed by image contents, prompt, model and "
+        f"settings (default: {DEFAULT_CACHE_DB})",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Describe every image with the model",
+    )
+    parser.add_argument(
+        "--near-duplicates",
+        action="store_true",
+        help="Describe one image per group of near-duplicates "
+        "(similar perceptual hash, close capture time) and copy its "
+        "description to the rest",
+    )
+    parser.add_argument(
+        "--duplicate-distance",
+        type=int,
+        default=DEFAULT_DUPLICATE_DISTANCE,
+        help="Most bits, of 64, in which near-duplicates' hashes may differ "
+        f"(default: {DEFAULT_DUPLICATE_DISTANCE})",
+    )
+    parser.add_argument(
+        "--duplicate-window",
+        type=float,
+        default=DEFAULT_DUPLICATE_WINDOW,
+        help="Most seconds between near-duplicates' capture times "
+        f"(default: {DEFAULT_DUPLICATE_WINDOW:g})",
+    )
+    parser.add_argument(
+        "--exif-db",
+        default=DEFAULT_EXIF_DB,
+        help="Database with the exif table, for capture times "
+        f"(default: {DEFAULT_EXIF_DB})",
+    )
 
     args = parser.parse_args()
 
@@ -384,8 +1233,28 @@ def main():
         max_tokens=args.max_tokens,
         temp=args.temp,
         prompt=args.prompt,
-        progress_file=args.progress_file,
+        jobs_db=args.jobs_db,
         output_dir=args.output_dir,
+        mode=args.mode,
+        worker_max_images=args.worker_max_images,
+        worker_max_rss_growth=args.worker_max_rss_growth,
+        worker_timeout=args.worker_timeout,
+        backend=args.backend,
+        model=args.model,
+        stub_latency=args.stub_latency,
+        prefetch=args.prefetch,
+        image_timeout=args.image_timeout,
+        retry_max_tokens=args.retry_max_tokens,
+        retry_max_edge=args.retry_max_edge,
+        adaptive=args.adaptive,
+        min_batch_size=args.min_batch_size,
+        max_batch_size=args.max_batch_size,
+        max_cooldown=args.max_cooldown,
+        cache_db=None if args.no_cache else args.cache_db,
+        near_duplicates=args.near_duplicates,
+        duplicate_distance=args.duplicate_distance,
+        duplicate_window=args.duplicate_window,
+        exif_db=args.exif_db,
     )
 
     orchestrator.run()
@@ -12,14 +12,15 @@ Example:
 """
 
 import argparse
-import json
 import os
 import sys
 from datetime import datetime, timedelta
 from pathlib import Path
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-DEFAULT_PROGRESS_FILE = "photo_descriptions_progress.txt"
+from job_store import DEFAULT_JOBS_DB, open_jobs  # noqa: E402
+from result_log import find_results, read_results  # noqa: E402
 
 
 def count_files_in_directory(directory: str) -> int:
@@ -35,35 +36,26 @@ def count_files_in_directory(directory: str) -> int:
     return count
 
 
-def get_progress_info(progress_file: str):
-    """Get information from progress file."""
-    if not os.path.exists(progress_file):
+def get_progress_info(jobs_db: str):
+    """Get information from the job table."""
+    if not os.path.exists(jobs_db):
         return {
             "completed_count": 0,
             "last_file": None,
             "last_modified": None,
-            "files": [],
+            "counts": {},
         }
 
-    with open(progress_file, "r") as f:
-        files = [line.strip() for line in f if line.strip()]
-
-    if not files:
-        return {
-            "completed_count": 0,
-            "last_file": None,
-            "last_modified": None,
-            "files": [],
-        }
-
-    # Get file modification time
-    last_modified = datetime.fromtimestamp(os.path.getmtime(progress_file))
+    with open_jobs(jobs_db) as jobs:
+        counts = jobs.counts()
+        completed = jobs.completed_count()
+        last = jobs.last_finished()
 
     return {
-        "completed_count": len(files),
-        "last_file": files[-1] if files else None,
-        "last_modified": last_modified,
-        "files": files,
+        "completed_count": completed,
+        "last_file": last[0] if last else None,
+        "last_modified": last[1] if last else None,
+        "counts": counts,
     }
 
 
@@ -145,23 +137,17 @@ def estimate_avg_time_per_image(output_dir: str = "outputs") -> float | None:
     # Get most recent output file (check both batch files and main file)
     output_files = sorted(outputs_dir.glob("image_analysis_*.json"), reverse=True)
     if not output_files:
-        main_file = outputs_dir / "image_analysis.json"
+        main_file = Path(find_results(output_dir))
         if main_file.exists():
             output_files = [main_file]
         else:
             return None
 
     try:
-        with open(output_files[0], "r") as f:
-            data = json.load(f)
-
-        if not data:
-            return None
-
         # Calculate average from generation_time_seconds
         times = [
             item["generation_time_seconds"]
-            for item in data
+            for item in read_results(str(output_files[0]))
             if item.get("generation_time_seconds") is not None
         ]
 
@@ -199,12 +185,12 @@ def main():
     parser.add_argument(
         "--v2",
         action="store_true",
-        help="Shorthand for --progress-file photo_descriptions_v2_progress.txt --output-dir outputs/v2",
+        help="Shorthand for --jobs-db photo_descriptions_v2_jobs.db --output-dir outputs/v2",
     )
     parser.add_argument(
-        "--progress-file",
-        default=DEFAULT_PROGRESS_FILE,
-        help=f"Progress tracking file (default: {DEFAULT_PROGRESS_FILE})",
+        "--jobs-db",
+        default=DEFAULT_JOBS_DB,
+        help=f"Job table tracking progress (default: {DEFAULT_JOBS_DB})",
     )
     parser.add_argument(
         "--output-dir",
@@ -214,8 +200,8 @@ def main():
     args = parser.parse_args()
 
     if args.v2:
-        if args.progress_file == DEFAULT_PROGRESS_FILE:
-            args.progress_file = "photo_descriptions_v2_progress.txt"
+        if args.jobs_db == DEFAULT_JOBS_DB:
+            args.jobs_db = "photo_descriptions_v2_jobs.db"
         if args.output_dir == "outputs":
             args.output_dir = "outputs/v2"
 
@@ -228,7 +214,7 @@ def main():
     total_files = count_files_in_directory(args.directory)
 
     # Get progress info
-    progress = get_progress_info(args.progress_file)
+    progress = get_progress_info(args.jobs_db)
     completed = progress["completed_count"]
     remaining = total_files - completed
     percent = (completed / total_files * 100) if total_files > 0 else 0
@@ -275,6 +261,14 @@ def main():
     if progress["last_file"]:
         print(f"Last file:  {progress['last_file']}")
 
+    failed = progress["counts"].get("failed", 0)
+    if failed:
+        print(f"Failed:     {failed:,} images (python src/job_store.py reset --failed)")
+
+    timed_out = progress["counts"].get("timed_out", 0)
+    if timed_out:
+        print(f"Timed out:  {timed_out:,} images waiting for the retry pass")
+
     # Check for errors
     error_count = get_recent_errors()
     if error_count > 0:
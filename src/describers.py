@@ -0,0 +1,460 @@
+"""
+Image describer backends.
+
+generate_descriptions.py and description_worker.py talk to the model
+through the Describer protocol, so the pipeline is not tied to MLX:
+
+    mlx           SmolVLM2 via mlx-vlm (SmolVLM2Helper), Apple Silicon only
+    transformers  SmolVLM2 via Hugging Face transformers on the CPU
+    stub          No model: deterministic descriptions after a configurable,
+                  seeded delay, for load-testing the orchestrator, progress
+                  tools and importer on any machine
+
+Usage:
+    from describers import get_describer
+
+    describer = get_describer("stub", latency="lognormal:0.5,0.3")
+    describer.load()
+    result = describer.describe("photo.jpg", prompt="<image>Describe this.")
+    print(result.text, describer.token_stats())
+
+describe() takes a path or whatever prepare() returned for it. prepare()
+does the file read, decode and resize, and is safe to run on another thread
+(see image_prefetch.py), so it can overlap with inference.
+"""
+
+import hashlib
+import math
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, List, Optional, Protocol
+
+BACKENDS = ("mlx", "transformers", "stub")
+DEFAULT_BACKEND = "mlx"
+
+DEFAULT_MLX_MODEL = "mlx-community/SmolVLM2-2.2B-Instruct-mlx"
+DEFAULT_TRANSFORMERS_MODEL = "HuggingFaceTB/SmolVLM2-2.2B-Instruct"
+
+IMAGE_TOKEN = "<image>"
+
+# Options each backend takes from get_describer()
+BACKEND_OPTIONS = {
+    "mlx": ("model", "max_edge"),
+    "transformers": ("model", "device", "max_edge"),
+    "stub": ("latency", "load_seconds", "seed", "fail_pattern"),
+}
+
+
+@dataclass
+class Description:
+    """One generated description and the generation's token statistics."""
+
+    text: str
+    prompt_tokens: Optional[int] = None
+    generation_tokens: Optional[int] = None
+    prompt_tps: float = 0.0
+    generation_tps: float = 0.0
+
+
+class Describer(Protocol):
+    """What the description pipeline needs from a model backend."""
+
+    name: str
+    # The exact model and input settings, for caching descriptions
+    model_id: str
+
+    def load(self) -> None:
+        """Load the model. Called once before the first describe()."""
+        ...
+
+    def prepare(self, image_path: str) -> Any:
+        """
+        Read, decode and resize an image to the model's input resolution.
+        Thread-safe; the result can be passed to describe() in place of the
+        path.
+        """
+        ...
+
+    def describe(
+        self, image: Any, prompt: str, temp: float = 0.0, max_tokens: int = 100
+    ) -> Description:
+        """Describe one image (a path, or the result of prepare())."""
+        ...
+
+    def describe_batch(
+        self,
+        images: List[Any],
+        prompt: str,
+        temp: float = 0.0,
+        max_tokens: int = 100,
+    ) -> List[Description]:
+        """Describe several images with the same prompt, in order."""
+        ...
+
+    def token_stats(self) -> dict:
+        """Totals over every describe() since load()."""
+        ...
+
+
+def load_image(image_path: str, max_edge: Optional[int] = None):
+    """
+    Open an image as RGB, upright per its EXIF orientation, and shrink it so
+    neither side exceeds ``max_edge``. The pixels are decoded before
+    returning, so the work happens on the calling thread.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(image_path) as img:
+        img = ImageOps.exif_transpose(img).convert("RGB")
+    if max_edge and max(img.size) > max_edge:
+        img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+    return img
+
+
+def _longest_edge(processor) -> Optional[int]:
+    """The largest image side the processor keeps, or None if unknown."""
+    size = getattr(getattr(processor, "image_processor", None), "size", None) or {}
+    return size.get("longest_edge") if isinstance(size, dict) else None
+
+
+def _limit_longest_edge(processor, max_edge: Optional[int]) -> Optional[int]:
+    """
+    Lower the processor's longest_edge to ``max_edge``, so images are split
+    into fewer tiles (fewer image tokens), and return the edge in effect.
+    """
+    edge = _longest_edge(processor)
+    if not max_edge or (edge is not None and edge <= max_edge):
+        return edge
+    image_processor = getattr(processor, "image_processor", None)
+    if isinstance(getattr(image_processor, "size", None), dict):
+        image_processor.size = {**image_processor.size, "longest_edge": max_edge}
+    return max_edge
+
+
+def _model_id(model_path: str, max_edge: Optional[int]) -> str:
+    """A capped input resolution changes the output, so it is part of the id."""
+    return f"{model_path}@{max_edge}" if max_edge else model_path
+
+
+class _TokenStats:
+    """Running totals shared by the backends' token_stats()."""
+
+    def __init__(self):
+        self.images = 0
+        self.prompt_tokens = 0
+        self.generation_tokens = 0
+        self.seconds = 0.0
+
+    def add(self, description: Description, seconds: float):
+        self.images += 1
+        self.prompt_tokens += description.prompt_tokens or 0
+        self.generation_tokens += description.generation_tokens or 0
+        self.seconds += seconds
+
+    def as_dict(self) -> dict:
+        generation_tps = None
+        if self.seconds:
+            generation_tps = round(self.generation_tokens / self.seconds, 2)
+        return {
+            "images": self.images,
+            "prompt_tokens": self.prompt_tokens,
+            "generation_tokens": self.generation_tokens,
+            "seconds": round(self.seconds, 2),
+            "generation_tps": generation_tps,
+        }
+
+
+class MLXDescriber:
+    """SmolVLM2 through mlx-vlm (SmolVLM2Helper). Requires Apple Silicon."""
+
+    name = "smolvlm2"
+
+    def __init__(self, model: Optional[str] = None, max_edge: Optional[int] = None):
+        self.model_path = model or DEFAULT_MLX_MODEL
+        self.model_id = _model_id(self.model_path, max_edge)
+        self.helper = None
+        self.max_edge = max_edge
+        self.stats = _TokenStats()
+
+    def load(self) -> None:
+        from smolvlm2_helper import SmolVLM2Helper
+
+        self.helper = SmolVLM2Helper(self.model_path)
+        self.max_edge = _limit_longest_edge(self.helper.processor, self.max_edge)
+
+    def prepare(self, image_path: str):
+        # mlx-vlm accepts PIL images in place of paths
+        return load_image(image_path, self.max_edge)
+
+    def describe(
+        self, image, prompt: str, temp: float = 0.0, max_tokens: int = 100
+    ) -> Description:
+        start = time.time()
+        output = self.helper.describe_image(
+            [image], prompt=prompt, temp=temp, max_tokens=max_tokens, verbose=False
+        )
+        if hasattr(output, "text"):
+            description = Description(
+                text=output.text,
+                prompt_tokens=getattr(output, "prompt_tokens", None),
+                generation_tokens=getattr(output, "generation_tokens", None),
+                prompt_tps=getattr(output, "prompt_tps", 0.0),
+                generation_tps=getattr(output, "generation_tps", 0.0),
+            )
+        else:
+            description = Description(text=str(output))
+        self.stats.add(description, time.time() - start)
+        return description
+
+    def describe_batch(
+        self,
+        images: List,
+        prompt: str,
+        temp: float = 0.0,
+        max_tokens: int = 100,
+    ) -> List[Description]:
+        # mlx-vlm treats several images as one multi-image prompt, so a batch
+        # is described one image at a time
+        return [self.describe(image, prompt, temp, max_tokens) for image in images]
+
+    def token_stats(self) -> dict:
+        return self.stats.as_dict()
+
+
+class TransformersDescriber:
+    """
+    SmolVLM2 through Hugging Face transformers, on the CPU by default. Much
+    slower than MLX, but runs on any machine with torch installed.
+    """
+
+    name = "smolvlm2-transformers"
+
+    def __init__(
+        self,
+        model: Optional[str] = None,
+        device: str = "cpu",
+        max_edge: Optional[int] = None,
+    ):
+        self.model_path = model or DEFAULT_TRANSFORMERS_MODEL
+        self.model_id = _model_id(self.model_path, max_edge)
+        self.device = device
+        self.model = None
+        self.processor = None
+        self.max_edge = max_edge
+        self.stats = _TokenStats()
+
+    def load(self) -> None:
+        import torch
+        from transformers import AutoModelForImageTextToText, AutoProcessor
+
+        print(f"Loading {self.model_path} with transformers on {self.device}...")
+        self.processor = AutoProcessor.from_pretrained(self.model_path)
+        # Batched generation pads on the left, so every prompt ends where
+        # generation starts
+        self.processor.tokenizer.padding_side = "left"
+        self.max_edge = _limit_longest_edge(self.processor, self.max_edge)
+        self.model = AutoModelForImageTextToText.from_pretrained(
+            self.model_path, torch_dtype=torch.float32
+        ).to(self.device)
+        self.model.eval()
+        print("Model loaded successfully!")
+
+    def prepare(self, image_path: str):
+        return load_image(image_path, self.max_edge)
+
+    def _conversation(self, image, prompt: str) -> list:
+        # The chat template inserts the image itself
+        text = prompt.replace(IMAGE_TOKEN, "").strip()
+        source = {"path": image} if isinstance(image, str) else {"image": image}
+        return [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "image", **source},
+                    {"type": "text", "text": text},
+                ],
+            }
+        ]
+
+    def describe(
+        self, image, prompt: str, temp: float = 0.0, max_tokens: int = 100
+    ) -> Description:
+        return self.describe_batch([image], prompt, temp, max_tokens)[0]
+
+    def describe_batch(
+        self,
+        images: List,
+        prompt: str,
+        temp: float = 0.0,
+        max_tokens: int = 100,
+    ) -> List[Description]:
+        import torch
+
+        start = time.time()
+        inputs = self.processor.apply_chat_template(
+            [self._conversation(image, prompt) for image in images],
+            add_generation_prompt=True,
+            tokenize=True,
+            return_dict=True,
+            return_tensors="pt",
+            padding=True,
+        ).to(self.device)
+        generate_args = {"max_new_tokens": max_tokens, "do_sample": temp > 0}
+        if temp > 0:
+            generate_args["temperature"] = temp
+        with torch.inference_mode():
+            output_ids = self.model.generate(**inputs, **generate_args)
+        elapsed = time.time() - start
+
+        prompt_length = inputs["input_ids"].shape[1]
+        new_ids = output_ids[:, prompt_length:]
+        texts = self.processor.batch_decode(new_ids, skip_special_tokens=True)
+        pad_id = self.processor.tokenizer.pad_token_id
+        descriptions = []
+        for row, text, generated in zip(inputs["attention_mask"], texts, new_ids):
+            generation_tokens = int((generated != pad_id).sum())
+            descriptions.append(
+                Description(
+                    text=text,
+                    prompt_tokens=int(row.sum()),
+                    generation_tokens=generation_tokens,
+                    generation_tps=generation_tokens / elapsed if elapsed else 0.0,
+                )
+            )
+        for description in descriptions:
+            self.stats.add(description, elapsed / len(descriptions))
+        return descriptions
+
+    def token_stats(self) -> dict:
+        return self.stats.as_dict()
+
+
+def parse_latency(spec: str):
+    """
+    Parse a stub latency distribution into a function of a random.Random
+    returning seconds:
+
+        fixed:S            always S
+        uniform:A,B        uniform between A and B
+        normal:MEAN,SD     normal, clipped at 0
+        lognormal:MED,S    log-normal with median MED and shape S (long tail)
+    """
+    kind, _, values = spec.partition(":")
+    try:
+        params = [float(v) for v in values.split(",")] if values else []
+    except ValueError:
+        raise ValueError(f"Invalid latency spec: {spec!r}")
+    shapes = {
+        "fixed": (1, lambda rng, s: s),
+        "uniform": (2, lambda rng, a, b: rng.uniform(a, b)),
+        "normal": (2, lambda rng, mean, sd: max(0.0, rng.gauss(mean, sd))),
+        "lognormal": (
+            2,
+            lambda rng, median, s: rng.lognormvariate(math.log(median), s),
+        ),
+    }
+    if kind not in shapes or len(params) != shapes[kind][0]:
+        raise ValueError(
+            f"Invalid latency spec: {spec!r} "
+            "(expected fixed:S, uniform:A,B, normal:MEAN,SD or lognormal:MED,S)"
+        )
+    sample = shapes[kind][1]
+    return lambda rng: sample(rng, *params)
+
+
+class StubDescriber:
+    """
+    Stand-in for a model. Descriptions and token counts are a function of
+    the file name only, so runs are reproducible; latencies come from a
+    seeded distribution (see parse_latency). Files matching fail_pattern
+    raise, to exercise error handling.
+    """
+
+    name = "stub"
+    model_id = "stub"
+
+    WORDS = (
+        "beach mountain city street garden dog cat family sunset lake forest "
+        "building car snow children table flowers boat bridge sky"
+    ).split()
+
+    def __init__(
+        self,
+        latency: str = "fixed:0.05",
+        load_seconds: float = 0.0,
+        seed: int = 0,
+        fail_pattern: str = "",
+    ):
+        self.sample_latency = parse_latency(latency)
+        self.load_seconds = load_seconds
+        self.rng = random.Random(seed)
+        self.fail_pattern = fail_pattern
+        self.stats = _TokenStats()
+
+    def load(self) -> None:
+        time.sleep(self.load_seconds)
+
+    def prepare(self, image_path: str) -> str:
+        # Nothing to decode; the description only depends on the file name
+        return image_path
+
+    def describe(
+        self, image: str, prompt: str, temp: float = 0.0, max_tokens: int = 100
+    ) -> Description:
+        start = time.time()
+        name = os.path.basename(image)
+        if self.fail_pattern and self.fail_pattern in name:
+            raise RuntimeError(f"Stub failure for {name}")
+        delay = self.sample_latency(self.rng)
+        time.sleep(delay)
+
+        digest = hashlib.sha1(name.encode()).digest()
+        words = [self.WORDS[b % len(self.WORDS)] for b in digest[:3]]
+        text = f"A photo of a {words[0]} with a {words[1]} and a {words[2]}."
+        generation_tokens = min(max_tokens, 8 + digest[3] % 40)
+        description = Description(
+            text=text,
+            prompt_tokens=len(prompt.split()) + 64,
+            generation_tokens=generation_tokens,
+            generation_tps=round(generation_tokens / delay, 2) if delay else 0.0,
+        )
+        self.stats.add(description, time.time() - start)
+        return description
+
+    def describe_batch(
+        self,
+        images: List[str],
+        prompt: str,
+        temp: float = 0.0,
+        max_tokens: int = 100,
+    ) -> List[Description]:
+        return [self.describe(image, prompt, temp, max_tokens) for image in images]
+
+    def token_stats(self) -> dict:
+        return self.stats.as_dict()
+
+
+def get_describer(backend: str = DEFAULT_BACKEND, **options) -> Describer:
+    """
+    Create (but do not load) a describer.
+
+    Options: ``model`` and ``max_edge`` (a cap on the model's input
+    resolution) for mlx and transformers, ``device`` for transformers, and
+    ``latency``, ``load_seconds``, ``seed`` and ``fail_pattern`` for stub.
+    Options the backend does not take, or that
+    are None, are ignored, so callers can pass every command-line option.
+    """
+    options = {
+        k: options[k]
+        for k in BACKEND_OPTIONS.get(backend, ())
+        if options.get(k) is not None
+    }
+    if backend == "mlx":
+        return MLXDescriber(**options)
+    if backend == "transformers":
+        return TransformersDescriber(**options)
+    if backend == "stub":
+        return StubDescriber(**options)
+    raise ValueError(f"Unknown describer backend: {backend} (expected {BACKENDS})")
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Description cache keyed by image content and generation settings.
+
+A description is stored under (SHA-256 of the image file, prompt, model
+id, max_tokens, temperature), so re-running the same prompt and model
+over a library, describing a file that was moved or renamed, or a
+duplicate of an image already described, costs a hash instead of a model
+call. Only successful descriptions are cached.
+
+The cache is a SQLite database shared by generate_descriptions.py, the
+persistent worker and work-queue workers. Each lookup is counted per
+model and prompt, so the hit rate is reported across runs.
+
+Usage:
+    python src/description_cache.py stats [--cache-db FILE]
+    python src/description_cache.py evict [--model ID] [--prompt TEXT]
+        [--unused-days N] [--cache-db FILE]
+
+Example:
+    # Drop everything cached for the v1 prompt
+    python src/description_cache.py evict \\
+        --prompt "<image>Briefly describe this image in one or two sentences."
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+from typing import Optional
+
+DEFAULT_CACHE_DB = "description_cache.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS description_cache (
+    content_hash TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    model_id TEXT NOT NULL,
+    max_tokens INTEGER NOT NULL,
+    temp REAL NOT NULL,
+    description TEXT NOT NULL,
+    model TEXT,
+    prompt_tokens INTEGER,
+    generation_tokens INTEGER,
+    generation_seconds REAL,
+    created_at TEXT NOT NULL,
+    last_used_at TEXT NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (content_hash, prompt, model_id, max_tokens, temp)
+);
+CREATE INDEX IF NOT EXISTS idx_description_cache_version
+    ON description_cache(model_id, prompt);
+CREATE TABLE IF NOT EXISTS description_cache_lookup (
+    model_id TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    misses INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (model_id, prompt)
+);
+"""
+
+# Bytes read at a time when hashing an image
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def file_hash(path: str) -> str:
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DescriptionCache:
+    """
+    The description cache in ``path``. hits and misses count this
+    process's lookups; the lifetime counts are in the database.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_DB):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30)
+        # Several workers read and write the cache at once
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def lookup(
+        self,
+        image_path: str,
+        prompt: str,
+        model_id: str,
+        max_tokens: int,
+        temp: float,
+    ) -> tuple:
+        """
+        Return (key, cached entry or None) for an image. Pass the key to
+        store() after describing the image on a miss.
+        """
+        key = (file_hash(image_path), prompt, model_id, max_tokens, float(temp))
+        row = self.conn.execute(
+            """
+            SELECT description, model, prompt_tokens, generation_tokens,
+                   generation_seconds
+            FROM description_cache
+            WHERE content_hash = ? AND prompt = ? AND model_id = ?
+              AND max_tokens = ? AND temp = ?
+            """,
+            key,
+        ).fetchone()
+        hit = row is not None
+        with self.conn:
+            if hit:
+                self.conn.execute(
+                    """
+                    UPDATE description_cache
+                    SET hits = hits + 1, last_used_at = ?
+                    WHERE content_hash = ? AND prompt = ? AND model_id = ?
+                      AND max_tokens = ? AND temp = ?
+                    """,
+                    (now(), *key),
+                )
+            self.conn.execute(
+                """
+                INSERT INTO description_cache_lookup (model_id, prompt, hits, misses)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(model_id, prompt) DO UPDATE SET
+                    hits = hits + excluded.hits, misses = misses + excluded.misses
+                """,
+                (model_id, prompt, int(hit), int(not hit)),
+            )
+        if not hit:
+            self.misses += 1
+            return key, None
+        self.hits += 1
+        keys = (
+            "description",
+            "model",
+            "prompt_tokens",
+            "generation_tokens",
+            "generation_seconds",
+        )
+        return key, dict(zip(keys, row))
+
+    def store(self, key: tuple, result: dict):
+        """Cache a successful result log entry under ``key``."""
+        if result.get("error"):
+            return
+        created = now()
+        with self.conn:
+            self.conn.execute(
+                """
+                INSERT OR REPLACE INTO description_cache
+                    (content_hash, prompt, model_id, max_tokens, temp,
+                     description, model, prompt_tokens, generation_tokens,
+                     generation_seconds, created_at, last_used_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    *key,
+                    result["description"],
+                    result.get("model"),
+                    result.get("prompt_tokens"),
+                    result.get("generation_tokens"),
+                    result.get("generation_time_seconds"),
+                    created,
+                    created,
+                ),
+            )
+
+    def hit_rate(self) -> Optional[float]:
+        """Share of this process's lookups that were hits, or None."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else None
+
+    def summary(self) -> str:
+        """One line on this process's lookups, for run logs."""
+        rate = self.hit_rate()
+        if rate is None:
+            return "Description cache: no lookups"
+        return (
+            f"Description cache: {self.hits:,} hits, {self.misses:,} misses "
+            f"({rate * 100:.1f}% hit rate)"
+        )
+
+    def evict(
+        self,
+        model_id: Optional[str] = None,
+        prompt: Optional[str] = None,
+        unused_days: Optional[float] = None,
+    ) -> int:
+        """
+        Delete the entries for a model id and/or prompt, or not used for
+        ``unused_days``. Returns how many were deleted.
+        """
+        conditions, params = [], []
+        if model_id is not None:
+            conditions.append("model_id = ?")
+            params.append(model_id)
+        if prompt is not None:
+            conditions.append("prompt = ?")
+            params.append(prompt)
+        if unused_days is not None:
+            cutoff = datetime.now() - timedelta(days=unused_days)
+            conditions.append("last_used_at < ?")
+            params.append(cutoff.isoformat(timespec="seconds"))
+        if not conditions:
+            raise ValueError("Nothing to evict by: give a model, prompt or age")
+        where = " AND ".join(conditions)
+        with self.conn:
+            cursor = self.conn.execute(
+                f"DELETE FROM description_cache WHERE {where}", params
+            )
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return cursor.rowcount
+
+    def versions(self) -> list:
+        """
+        Per (model id, prompt): cached entries and lifetime lookup hits
+        and misses.
+        """
+        rows = self.conn.execute(
+            """
+            SELECT l.model_id, l.prompt, coalesce(c.entries, 0), l.hits, l.misses
+            FROM description_cache_lookup l
+            LEFT JOIN (
+                SELECT model_id, prompt, count(*) AS entries
+                FROM description_cache GROUP BY model_id, prompt
+            ) c ON c.model_id = l.model_id AND c.prompt = l.prompt
+            ORDER BY l.hits + l.misses DESC
+            """
+        )
+        return rows.fetchall()
+
+
+def open_cache(path: Optional[str]) -> Optional[DescriptionCache]:
+    """The cache at ``path``, or None when caching is turned off (no path)."""
+    return DescriptionCache(path) if path else None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Inspect and evict the image description cache"
+    )
+    # Every command takes --cache-db after its name
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        "--cache-db",
+        default=DEFAULT_CACHE_DB,
+        help=f"Cache database (default: {DEFAULT_CACHE_DB})",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser(
+        "stats", parents=[common], help="Entries and hit rate per model and prompt"
+    )
+    evict_parser = commands.add_parser(
+        "evict",
+        parents=[common],
+        help="Delete entries for a model or prompt version",
+    )
+    evict_parser.add_argument("--model", help="Model id, as shown by stats")
+    evict_parser.add_argument("--prompt", help="Prompt, exactly as shown by stats")
+    evict_parser.add_argument(
+        "--unused-days", type=float, help="Entries not used for this many days"
+    )
+    args = parser.parse_args()
+
+    if not os.path.exists(args.cache_db):
+        print(f"Error: Cache not found: {args.cache_db}")
+        sys.exit(1)
+
+    with DescriptionCache(args.cache_db) as cache:
+        if args.command == "evict":
+            try:
+                count = cache.evict(args.model, args.prompt, args.unused_days)
+            except ValueError as e:
+                print(f"Error: {e}")
+                sys.exit(1)
+            print(f"Evicted {count:,} entries from {args.cache_db}")
+            return
+
+        versions = cache.versions()
+        if not versions:
+            print(f"No lookups recorded in {args.cache_db}")
+            return
+        total_hits = sum(row[3] for row in versions)
+        total_lookups = total_hits + sum(row[4] for row in versions)
+        print(f"Description cache: {args.cache_db}")
+        print(
+            f"Lookups: {total_lookups:,}, hits: {total_hits:,} "
+            f"({total_hits / total_lookups * 100:.1f}%)"
+        )
+        for model_id, prompt, entries, hits, misses in versions:
+            lookups = hits + misses
+            print(f"\nModel:   {model_id}")
+            print(f"Prompt:  {prompt}")
+            print(
+                f"Entries: {entries:,}, lookups: {lookups:,}, hits: {hits:,} "
+                f"({hits / lookups * 100:.1f}%)"
+            )
+
+
+if __name__ == "__main__":
+    main()
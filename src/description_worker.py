@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+Long-lived image description worker.
+
+Loads the describer backend (see describers.py; SmolVLM2 via MLX by
+default) once and describes images sent to it one JSON object per line on
+stdin, answering with one JSON object per line on stdout. The worker exits
+on its own ("recycles") once it has described --max-images images or its
+RSS has grown by more than --max-rss-growth MB since the model finished
+loading; batch_orchestrator.py then starts a fresh one.
+
+Images are answered in the order they arrive. Up to --prefetch of them are
+read, decoded and resized on background threads while the model works on
+the current one; the orchestrator keeps that many queued ahead.
+
+Protocol (stdin -> stdout):
+    {"path": "/abs/path/img.jpg", "file": "0/img.jpg"}
+        -> {"type": "result", "result": {...image_analysis.json entry...},
+            "rss_mb": 5321.4, "wait_seconds": 0.0}
+    {"type": "shutdown"}  (or closing stdin)
+        -> worker exits
+
+The worker announces itself with
+    {"type": "ready", "pid": 123, "rss_mb": 5200.1, "load_seconds": 14.2}
+and, before exiting to recycle,
+    {"type": "recycle", "reason": "...", "images": 2000, "rss_mb": 7300.0}
+
+An image still being described after --image-timeout seconds cannot be
+interrupted, so the worker reports it and exits straight away:
+    {"type": "timeout", "file": "0/img.jpg", "seconds": 300}
+
+Images whose contents were already described with the same prompt, model
+and settings are answered from the description cache (see
+description_cache.py) without running the model; --no-cache turns it off.
+
+Anything the model libraries print goes to stderr, so stdout only carries
+the protocol.
+
+Usage:
+    python src/description_worker.py [options]
+
+Example:
+    python src/description_worker.py --max-images 2000 --max-rss-growth 2048
+    python src/description_worker.py --backend stub --stub-latency normal:1.5,0.3
+"""
+
+import argparse
+import json
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+
+import psutil
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from describers import BACKENDS, DEFAULT_BACKEND, get_describer  # noqa: E402
+from description_cache import DEFAULT_CACHE_DB, open_cache  # noqa: E402
+from generate_descriptions import (  # noqa: E402
+    DEFAULT_IMAGE_TIMEOUT,
+    TIMEOUT_EXIT_CODE,
+    describe_cached,
+    error_result,
+    image_deadline,
+)
+from image_prefetch import DEFAULT_PREFETCH_DEPTH, ImagePrefetcher  # noqa: E402
+
+DEFAULT_PROMPT = "<image>Briefly describe this image in one or two sentences."
+
+# The watchdog thread reports timeouts while the main thread may be sending
+SEND_LOCK = threading.Lock()
+
+
+def rss_mb() -> float:
+    """Resident set size of this process in MB."""
+    return psutil.Process().memory_info().rss / (1024**2)
+
+
+def open_protocol_stream():
+    """
+    Return a line-buffered file for protocol messages on the original stdout,
+    and point file descriptor 1 (and sys.stdout) at stderr, so prints from
+    the model libraries cannot corrupt the protocol.
+    """
+    protocol = os.fdopen(os.dup(sys.stdout.fileno()), "w", buffering=1)
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+    return protocol
+
+
+def send(stream, message: dict):
+    with SEND_LOCK:
+        stream.write(json.dumps(message, ensure_ascii=False) + "\n")
+        stream.flush()
+
+
+def read_requests(prefetcher: ImagePrefetcher, requests: queue.Queue):
+    """
+    Queue (request, future) for each image request on stdin, starting its
+    prefetch straight away; None marks shutdown or end of input.
+    """
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        request = json.loads(line)
+        if request.get("type") == "shutdown":
+            break
+        requests.put((request, prefetcher.submit(request["path"])))
+    requests.put(None)
+
+
+def recycle_reason(images: int, rss: float, baseline_rss: float, args) -> str:
+    """Return why the worker should recycle now, or an empty string."""
+    if args.max_images and images >= args.max_images:
+        return f"described {images} images"
+    if args.max_rss_growth and rss - baseline_rss > args.max_rss_growth:
+        return f"RSS grew {rss - baseline_rss:.0f} MB since the model loaded"
+    return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Persistent SmolVLM2 image description worker"
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default=DEFAULT_BACKEND,
+        help=f"Describer backend (default: {DEFAULT_BACKEND})",
+    )
+    parser.add_argument("--model", help="Model to load (default: per backend)")
+    parser.add_argument(
+        "--stub-latency",
+        help="Stub backend latency, e.g. fixed:0.5 or lognormal:1.2,0.4",
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=100,
+        help="Maximum tokens to generate per image (default: 100)",
+    )
+    parser.add_argument(
+        "--temp",
+        type=float,
+        default=0.0,
+        help="Temperature for generation (default: 0.0)",
+    )
+    parser.add_argument(
+        "--prompt",
+        default=DEFAULT_PROMPT,
+        help="Prompt for image description (default: brief one-sentence description)",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=DEFAULT_PREFETCH_DEPTH,
+        help="Images decoded and resized ahead of the model, on background "
+        f"threads (default: {DEFAULT_PREFETCH_DEPTH})",
+    )
+    parser.add_argument(
+        "--image-timeout",
+        type=float,
+        default=DEFAULT_IMAGE_TIMEOUT,
+        help="Report an image still not described after this many seconds and "
+        f"exit, 0 = no limit (default: {DEFAULT_IMAGE_TIMEOUT})",
+    )
+    parser.add_argument(
+        "--max-image-edge",
+        type=int,
+        help="Largest image side given to the model (default: the model's own)",
+    )
+    parser.add_argument(
+        "--cache-db",
+        default=DEFAULT_CACHE_DB,
+        help=f"Description cache (default: {DEFAULT_CACHE_DB})",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Describe every image with the model"
+    )
+    parser.add_argument(
+        "--max-images",
+        type=int,
+        default=2000,
+        help="Recycle after describing this many images, 0 = never (default: 2000)",
+    )
+    parser.add_argument(
+        "--max-rss-growth",
+        type=float,
+        default=2048.0,
+        help="Recycle once RSS has grown by this many MB after the model loaded, "
+        "0 = never (default: 2048)",
+    )
+    args = parser.parse_args()
+
+    protocol = open_protocol_stream()
+    # The orchestrator decides when to stop (it closes stdin); a Ctrl-C sent
+    # to the whole process group must not kill an image half way through
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    prompt = args.prompt if "<image>" in args.prompt else f"<image>{args.prompt}"
+
+    start = time.time()
+    describer = get_describer(
+        args.backend,
+        model=args.model,
+        latency=args.stub_latency,
+        max_edge=args.max_image_edge,
+    )
+    describer.load()
+    cache = open_cache(None if args.no_cache else args.cache_db)
+    baseline_rss = rss_mb()
+    send(
+        protocol,
+        {
+            "type": "ready",
+            "pid": os.getpid(),
+            "rss_mb": round(baseline_rss, 1),
+            "load_seconds": round(time.time() - start, 2),
+        },
+    )
+
+    # The reader starts preparing each request as it arrives, and stops
+    # reading stdin once --prefetch of them are waiting
+    prefetcher = ImagePrefetcher(describer.prepare)
+    requests = queue.Queue(maxsize=max(1, args.prefetch))
+    threading.Thread(
+        target=read_requests, args=(prefetcher, requests), daemon=True
+    ).start()
+
+    def on_timeout(rel_path: str):
+        print(f"Timed out after {args.image_timeout:g}s: {rel_path}", file=sys.stderr)
+        send(
+            protocol,
+            {"type": "timeout", "file": rel_path, "seconds": args.image_timeout},
+        )
+        os._exit(TIMEOUT_EXIT_CODE)
+
+    images = 0
+    while True:
+        item = requests.get()
+        if item is None:
+            break
+        request, prepared = item
+        rel_path = request["file"]
+        waited = prefetcher.wait_seconds
+        try:
+            with image_deadline(args.image_timeout, lambda: on_timeout(rel_path)):
+                result = describe_cached(
+                    cache,
+                    describer,
+                    request["path"],
+                    prefetcher.wait(prepared),
+                    rel_path,
+                    prompt,
+                    args.temp,
+                    args.max_tokens,
+                )
+        except Exception as e:
+            print(f"Error processing {rel_path}: {e}", file=sys.stderr)
+            result = error_result(rel_path, e, describer.name)
+        images += 1
+
+        rss = rss_mb()
+        send(
+            protocol,
+            {
+                "type": "result",
+                "result": result,
+                "rss_mb": round(rss, 1),
+                "wait_seconds": round(prefetcher.wait_seconds - waited, 3),
+            },
+        )
+
+        reason = recycle_reason(images, rss, baseline_rss, args)
+        if reason:
+            send(
+                protocol,
+                {
+                    "type": "recycle",
+                    "reason": reason,
+                    "images": images,
+                    "rss_mb": round(rss, 1),
+                },
+            )
+            break
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+"""
+Schema and refresh of the derived gallery tables in mediameta.db.
+
+One definition of gallery_items, gallery_day_counts, photo_places,
+thumb_placeholders and thumb_renditions, shared by the scripts that fill
+them (build_gallery_items.py, build_photo_places.py,
+compute_thumb_placeholders.py, build_thumbnail_pyramid.py, thumb_pack.py),
+the thumbnail import (load_thumbnails_to_db.py) and the datasette plugins,
+which create them at startup so the gallery works before any of the
+scripts have run.
+
+gallery_items holds one row per photo that has a thumbnail, with CreateDate
+normalized to 'YYYY-MM-DD HH:MM:SS' (taken_at) plus integer year and month
+columns. The table is clustered on (taken_at, path), so every gallery page,
+date range and keyset cursor is a range scan of the table itself instead of
+a filtered join of exif and thumbImages.
+
+gallery_day_counts caches the number of items per day, so the count for
+any date range is a SUM over at most a few thousand rows rather than a
+COUNT(*) over the join. Each day also stores the /-/gallery.json cursor of
+its first and last item, which the /-/timeline.json histogram aggregates
+into years and months.
+
+thumbImages.etag is a hash of each thumbnail's content, filled in by
+fill_thumb_etags() for rows that have none (new or reloaded thumbnails).
+gallery_items copies it, so pages can version /thumb/ URLs (?v=<etag>) and
+let browsers cache them for good; renditions and placeholders record the
+etag of the thumbnail they were built from, so a reloaded thumbnail is
+rebuilt.
+
+refresh() compares gallery_items against exif/thumbImages and only applies
+the difference, recomputing counts for the affected days.
+"""
+
+import hashlib
+import re
+import sqlite3
+
+# EXIF dates come as 'YYYY:MM:DD HH:MM:SS' or 'YYYY-MM-DD HH:MM:SS', with
+# optional sub-seconds and timezone suffix, sometimes without a time at all
+_CREATE_DATE_RE = re.compile(
+    r"^(\d{4})[:-](\d{2})[:-](\d{2})(?:[ T](\d{2}):(\d{2})(?::(\d{2}))?)?"
+)
+
+# photo_places columns a place filter matches on; each has its own index
+PLACE_KINDS = ("city", "region", "country")
+
+# Thumbnails hashed per transaction by fill_thumb_etags()
+ETAG_BATCH_SIZE = 500
+
+
+def table_columns(conn: sqlite3.Connection, name: str) -> list:
+    """Return the column names of a table ([] if it does not exist)."""
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({name})")]
+
+
+def create_gallery_tables(conn: sqlite3.Connection):
+    """Create gallery_items, its indexes and gallery_day_counts."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS gallery_items (
+            taken_at TEXT NOT NULL,
+            path TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            etag TEXT,
+            PRIMARY KEY (taken_at, path)
+        ) WITHOUT ROWID
+    """)
+    if "etag" not in table_columns(conn, "gallery_items"):
+        # Older layout; refresh() fills the new column in
+        conn.execute("ALTER TABLE gallery_items ADD COLUMN etag TEXT")
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_gallery_items_path
+        ON gallery_items(path)
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_gallery_items_year_month
+        ON gallery_items(year, month)
+    """)
+    columns = table_columns(conn, "gallery_day_counts")
+    if columns and "first_cursor" not in columns:
+        # Older layout without cursors; it is derived data, so rebuild it
+        conn.execute("DROP TABLE gallery_day_counts")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS gallery_day_counts (
+            day TEXT PRIMARY KEY,
+            n INTEGER NOT NULL,
+            first_cursor TEXT NOT NULL,
+            last_cursor TEXT NOT NULL
+        ) WITHOUT ROWID
+    """)
+
+
+def create_photo_places_table(conn: sqlite3.Connection):
+    """Create the photo_places table and its filter indexes."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS photo_places (
+            path TEXT PRIMARY KEY,
+            city TEXT,
+            region TEXT,
+            country TEXT,
+            country_code TEXT,
+            distance_km REAL
+        ) WITHOUT ROWID
+    """)
+    for kind in PLACE_KINDS:
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_photo_places_{kind} ON photo_places({kind})"
+        )
+
+
+def create_thumb_placeholders_table(conn: sqlite3.Connection):
+    """
+    Create the thumb_placeholders table. source_etag is the thumbImages.etag
+    of the thumbnail a placeholder was computed from.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS thumb_placeholders (
+            path TEXT PRIMARY KEY,
+            blurhash TEXT NOT NULL,
+            color TEXT,
+            width INTEGER,
+            height INTEGER,
+            source_etag TEXT
+        ) WITHOUT ROWID
+    """)
+    if "source_etag" not in table_columns(conn, "thumb_placeholders"):
+        # Older layout; compute_thumb_placeholders.py recomputes these rows
+        conn.execute("ALTER TABLE thumb_placeholders ADD COLUMN source_etag TEXT")
+
+
+def create_thumb_renditions_table(conn: sqlite3.Connection):
+    """
+    Create the thumb_renditions table and its lookup index. source_etag is
+    the thumbImages.etag of the thumbnail a rendition was encoded from.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS thumb_renditions (
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            format TEXT NOT NULL,
+            width INTEGER,
+            height INTEGER,
+            bytes INTEGER,
+            content BLOB NOT NULL,
+            source_etag TEXT
+        )
+    """)
+    if "source_etag" not in table_columns(conn, "thumb_renditions"):
+        # Older layout; build_thumbnail_pyramid.py re-encodes these rows
+        conn.execute("ALTER TABLE thumb_renditions ADD COLUMN source_etag TEXT")
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_thumb_renditions_key
+        ON thumb_renditions(path, size, format)
+    """)
+
+
+def thumb_etag(content: bytes) -> str:
+    """Content hash stored in thumbImages.etag."""
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def fill_thumb_etags(conn: sqlite3.Connection) -> int:
+    """
+    Add thumbImages.etag if needed and hash every thumbnail that has no
+    etag yet. Rows whose content was moved to a thumbnail pack keep the
+    etag they had. Returns the number of thumbnails hashed.
+    """
+    if "etag" not in table_columns(conn, "thumbImages"):
+        conn.execute("ALTER TABLE thumbImages ADD COLUMN etag TEXT")
+        conn.commit()
+    rowids = [
+        row[0]
+        for row in conn.execute(
+            "SELECT rowid FROM thumbImages WHERE etag IS NULL AND content IS NOT NULL"
+        )
+    ]
+    for i in range(0, len(rowids), ETAG_BATCH_SIZE):
+        batch = rowids[i : i + ETAG_BATCH_SIZE]
+        placeholders = ",".join("?" for _ in batch)
+        rows = conn.execute(
+            f"SELECT rowid, content FROM thumbImages WHERE rowid IN ({placeholders})",
+            batch,
+        ).fetchall()
+        with conn:
+            conn.executemany(
+                "UPDATE thumbImages SET etag = ? WHERE rowid = ?",
+                [(thumb_etag(content), rowid) for rowid, content in rows],
+            )
+    return len(rowids)
+
+
+def normalize_create_date(value):
+    """
+    Return CreateDate as 'YYYY-MM-DD HH:MM:SS', or None if it is not a
+    usable date (empty, '0000:00:00 00:00:00', out of range).
+    """
+    if not value:
+        return None
+    match = _CREATE_DATE_RE.match(str(value).strip())
+    if not match:
+        return None
+    year, month, day, hour, minute, second = match.groups()
+    if year == "0000" or not ("01" <= month <= "12") or not ("01" <= day <= "31"):
+        return None
+    return f"{year}-{month}-{day} {hour or '00'}:{minute or '00'}:{second or '00'}"
+
+
+def load_source_items(conn: sqlite3.Connection) -> tuple:
+    """
+    Return ({path: (taken_at, file_name, etag)}, skipped) for photos that
+    belong in the gallery; skipped counts photos without a usable
+    CreateDate.
+    """
+    items = {}
+    skipped = 0
+    for path, file_name, create_date, etag in conn.execute("""
+        SELECT e.SourceFile, e.FileName, e.CreateDate, t.etag
+        FROM exif e
+        JOIN thumbImages t ON t.path = e.SourceFile
+    """):
+        taken_at = normalize_create_date(create_date)
+        if taken_at is None:
+            skipped += 1
+            continue
+        items[path] = (taken_at, file_name or path.rsplit("/", 1)[-1], etag)
+    return items, skipped
+
+
+def refresh_days(conn: sqlite3.Connection, days):
+    """
+    Recompute gallery_day_counts rows for the given days.
+
+    A cursor is ``<taken_at>|<path without ./>``. taken_at is fixed-width,
+    so MIN/MAX over the cursor string give the first and last item of the
+    day in (taken_at, path) order.
+    """
+    for day in days:
+        conn.execute("DELETE FROM gallery_day_counts WHERE day = ?", (day,))
+        conn.execute(
+            """INSERT INTO gallery_day_counts (day, n, first_cursor, last_cursor)
+               SELECT ?, COUNT(*),
+                      MIN(taken_at || '|' || substr(path, 3)),
+                      MAX(taken_at || '|' || substr(path, 3))
+               FROM gallery_items
+               WHERE taken_at >= ? AND taken_at <= ? || ' 23:59:59'
+               HAVING COUNT(*) > 0""",
+            (day, day, day),
+        )
+
+
+def refresh(conn: sqlite3.Connection) -> dict:
+    """
+    Bring gallery_items in line with exif/thumbImages and recompute the day
+    counts that changed, in one transaction. A row whose date or name
+    changed is deleted and re-inserted; a row whose thumbnail changed only
+    gets the new etag. Creates the tables and fills in missing thumbnail
+    etags first.
+
+    Returns {"inserted", "deleted", "updated", "days", "skipped"}: rows
+    inserted, deleted and given a new etag, days recounted, and photos left
+    out for lack of a usable CreateDate.
+    """
+    create_gallery_tables(conn)
+    fill_thumb_etags(conn)
+    source, skipped = load_source_items(conn)
+    current = {
+        path: (taken_at, file_name, etag)
+        for taken_at, path, file_name, etag in conn.execute(
+            "SELECT taken_at, path, file_name, etag FROM gallery_items"
+        )
+    }
+
+    stale = [path for path, item in current.items() if path not in source]
+    fresh = []
+    retagged = []
+    for path, (taken_at, file_name, etag) in source.items():
+        old = current.get(path)
+        if old is not None and old[:2] == (taken_at, file_name):
+            if old[2] != etag:
+                retagged.append((etag, path))
+            continue
+        if old is not None:
+            stale.append(path)
+        fresh.append(
+            (taken_at, path, file_name, int(taken_at[:4]), int(taken_at[5:7]), etag)
+        )
+
+    days = {current[path][0][:10] for path in stale}
+    days.update(row[0][:10] for row in fresh)
+    # Days whose counts are missing entirely (first build, or a rebuilt
+    # gallery_day_counts table)
+    days.update(
+        row[0]
+        for row in conn.execute("""
+            SELECT DISTINCT substr(taken_at, 1, 10) FROM gallery_items
+            WHERE substr(taken_at, 1, 10) NOT IN (SELECT day FROM gallery_day_counts)
+        """)
+    )
+
+    with conn:
+        conn.executemany(
+            "DELETE FROM gallery_items WHERE path = ?", [(p,) for p in stale]
+        )
+        conn.executemany(
+            """INSERT INTO gallery_items (taken_at, path, file_name, year, month, etag)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            fresh,
+        )
+        conn.executemany("UPDATE gallery_items SET etag = ? WHERE path = ?", retagged)
+        refresh_days(conn, sorted(days))
+    return {
+        "inserted": len(fresh),
+        "deleted": len(stale),
+        "updated": len(retagged),
+        "days": len(days),
+        "skipped": skipped,
+    }
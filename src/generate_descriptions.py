@@ -9,83 +9,69 @@
 """
 Generate photo descriptions using SmolVLM2.
 
-This script uses the SmolVLM2Helper class to generate descriptions for images
-in a directory. It supports progress tracking to allow resuming from where
-you left off.
+This script uses a describer backend (see describers.py; SmolVLM2 via MLX by
+default) to generate descriptions for images in a directory. It tracks
+progress in a SQLite job table (see job_store.py) to allow resuming from
+where you left off.
 
 Usage:
     python src/generate_descriptions.py <directory> <num_files>
 
+With --near-duplicates, burst shots and duplicates (see near_duplicates.py)
+are described once per group and the description is copied to the rest of
+the group, marked "inherited_from" in the result log.
+
 Example:
     python src/generate_descriptions.py ~/Photos 100
+    python src/generate_descriptions.py ~/Photos 100 --backend stub \
+        --stub-latency normal:1.5,0.3
 """
 
 import click
-import json
 import os
 import sys
+import threading
 import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Set, List
-
-# Progress tracking
-DEFAULT_PROGRESS_FILE = "photo_descriptions_progress.txt"
-STOP_FLAG_FILE = ".stop_requested"
-
-
-def check_stop_requested() -> bool:
-    """Check if a graceful stop has been requested."""
-    return os.path.exists(STOP_FLAG_FILE)
-
+from typing import Callable, List, Optional
 
-def load_progress_file(progress_file: str) -> Set[str]:
-    """Load the set of already processed files from the progress file."""
-    if not os.path.exists(progress_file):
-        return set()
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-    with open(progress_file, "r") as f:
-        return set(line.strip() for line in f if line.strip())
-
-
-def append_to_progress_file(file_path: str, progress_file: str):
-    """Append a processed file path to the progress file."""
-    with open(progress_file, "a") as f:
-        f.write(f"{file_path}\n")
+from describers import BACKENDS, DEFAULT_BACKEND, get_describer  # noqa: E402
+from description_cache import (  # noqa: E402
+    DEFAULT_CACHE_DB,
+    DescriptionCache,
+    open_cache,
+)
+from image_prefetch import DEFAULT_PREFETCH_DEPTH, ImagePrefetcher  # noqa: E402
+from job_store import DEFAULT_JOBS_DB, JobStore, open_jobs  # noqa: E402
+from near_duplicates import (  # noqa: E402
+    DEFAULT_DUPLICATE_DISTANCE,
+    DEFAULT_DUPLICATE_WINDOW,
+    DEFAULT_EXIF_DB,
+    capture_times,
+    find_clusters,
+    hash_images,
+)
+from result_log import (  # noqa: E402
+    ResultLog,
+    migrate_legacy_json,
+    result_log_path,
+)
 
+STOP_FLAG_FILE = ".stop_requested"
 
-def delete_progress_file(progress_file: str):
-    """Delete the progress file to start fresh."""
-    if os.path.exists(progress_file):
-        os.remove(progress_file)
+# Seconds one image may take before it is moved to the retry queue
+DEFAULT_IMAGE_TIMEOUT = 300
 
+# Exit status of a process stopped by the per-image deadline (as timeout(1))
+TIMEOUT_EXIT_CODE = 124
 
-def flush_results_to_json(output_file: str, new_results: list) -> bool:
-    """
-    Append new results to JSON file.
-    Returns True on success, False on error.
-    """
-    if not new_results:
-        return True
 
-    # Load existing results
-    all_results = []
-    if os.path.exists(output_file):
-        try:
-            with open(output_file, "r", encoding="utf-8") as f:
-                all_results = json.load(f)
-        except (json.JSONDecodeError, IOError) as e:
-            click.echo(f"Error reading JSON file: {e}", err=True)
-            return False
-
-    # Append new results and write
-    all_results.extend(new_results)
-    try:
-        with open(output_file, "w", encoding="utf-8") as f:
-            json.dump(all_results, f, indent=2, ensure_ascii=False)
-        return True
-    except IOError as e:
-        click.echo(f"Error writing JSON file: {e}", err=True)
-        return False
+def check_stop_requested() -> bool:
+    """Check if a graceful stop has been requested."""
+    return os.path.exists(STOP_FLAG_FILE)
 
 
 def find_all_files(directory: str) -> tuple[List[Path], Path]:
@@ -115,15 +101,197 @@ def find_all_files(directory: str) -> tuple[List[Path], Path]:
     return files, directory_path
 
 
+def describe_to_result(
+    describer,
+    image,
+    rel_path: Path,
+    prompt: str,
+    temp: float,
+    max_tokens: int,
+) -> dict:
+    """
+    Describe one image with a describers.Describer and return its entry for
+    the result log. ``image`` is a path or the describer's prepare()
+    result. Exceptions from the model are left to the caller (see
+    error_result).
+    """
+    if isinstance(image, Path):
+        image = str(image)
+
+    # Time the description generation
+    start_time = time.time()
+
+    description = describer.describe(
+        image, prompt=prompt, temp=temp, max_tokens=max_tokens
+    )
+
+    elapsed_time = time.time() - start_time
+
+    prompt_tps = round(description.prompt_tps or 0, 2)
+    generation_tps = round(description.generation_tps or 0, 2)
+    return {
+        "file": f"./{rel_path}",
+        "model": describer.name,
+        "generation_time_seconds": round(elapsed_time, 2),
+        "error": False,
+        "description": description.text.strip(),
+        "prompt_tokens": description.prompt_tokens,
+        "generation_tokens": description.generation_tokens,
+        "prompt_tps": None if prompt_tps == 0 else prompt_tps,
+        "generation_tps": None if generation_tps == 0 else generation_tps,
+    }
+
+
+def describe_cached(
+    cache: Optional[DescriptionCache],
+    describer,
+    image_path,
+    image,
+    rel_path: Path,
+    prompt: str,
+    temp: float,
+    max_tokens: int,
+) -> dict:
+    """
+    describe_to_result() through the description cache: an image whose
+    contents were already described with the same prompt, model and
+    settings is not given to the model. Cached entries are marked
+    "cached" and timed by the lookup, not the original generation.
+    """
+    if cache is None:
+        return describe_to_result(describer, image, rel_path, prompt, temp, max_tokens)
+
+    start_time = time.time()
+    key, cached = cache.lookup(
+        str(image_path), prompt, describer.model_id, max_tokens, temp
+    )
+    if cached is None:
+        result_entry = describe_to_result(
+            describer, image, rel_path, prompt, temp, max_tokens
+        )
+        cache.store(key, result_entry)
+        return result_entry
+
+    return {
+        "file": f"./{rel_path}",
+        "model": cached["model"] or describer.name,
+        "generation_time_seconds": round(time.time() - start_time, 2),
+        "error": False,
+        "description": cached["description"],
+        "prompt_tokens": cached["prompt_tokens"],
+        "generation_tokens": cached["generation_tokens"],
+        "prompt_tps": None,
+        "generation_tps": None,
+        "cached": True,
+    }
+
+
+def completion_message(result_entry: dict) -> str:
+    """Progress line for a described image."""
+    if result_entry.get("cached"):
+        return "  Cached description"
+    gen_tps = result_entry.get("generation_tps")
+    tps_info = f", {gen_tps:.1f} tokens/s" if gen_tps else ""
+    return f"  Completed in {result_entry['generation_time_seconds']:.2f}s{tps_info}"
+
+
+def inherited_result(result_entry: dict, rel_path: Path) -> dict:
+    """
+    The result log entry for a near-duplicate of the image described in
+    ``result_entry``: the same description, not generated for this file.
+    """
+    return {
+        "file": f"./{rel_path}",
+        "model": result_entry["model"],
+        "generation_time_seconds": 0.0,
+        "error": False,
+        "description": result_entry["description"],
+        "prompt_tokens": result_entry.get("prompt_tokens"),
+        "generation_tokens": result_entry.get("generation_tokens"),
+        "prompt_tps": None,
+        "generation_tps": None,
+        "inherited_from": result_entry["file"],
+    }
+
+
+def group_near_duplicates(
+    jobs: JobStore,
+    files: List[Path],
+    base_path: Path,
+    exif_db: str,
+    max_distance: int,
+    window: float,
+) -> dict:
+    """
+    {representative: [near-duplicates]} among ``files``, for groups of
+    more than one image. Hashes are kept in the job table, so each image
+    is only hashed once.
+    """
+    paths = {str(f.relative_to(base_path)): f for f in files}
+    hashes = {f: h for f, h in jobs.dhashes().items() if f in paths}
+    new_hashes = hash_images({f: str(p) for f, p in paths.items() if f not in hashes})
+    jobs.store_dhashes(new_hashes)
+    hashes.update(new_hashes)
+    times = capture_times(exif_db, paths)
+    clusters = find_clusters(hashes, times, max_distance, window)
+    return {
+        paths[c.representative]: [paths[m] for m in c.members]
+        for c in clusters
+        if c.members
+    }
+
+
+@contextmanager
+def image_deadline(seconds: float, on_timeout: Callable[[], None]):
+    """
+    Call on_timeout() from a watchdog thread if the block is still running
+    after ``seconds`` (0 = no deadline). Model calls cannot be interrupted,
+    so on_timeout is expected to record the image and end the process
+    (os._exit); the block never finishes once it has been called.
+    """
+    if not seconds:
+        yield
+        return
+
+    lock = threading.Lock()
+    finished = False
+
+    def expire():
+        with lock:
+            if not finished:
+                on_timeout()
+
+    timer = threading.Timer(seconds, expire)
+    timer.daemon = True
+    timer.start()
+    try:
+        yield
+    finally:
+        with lock:
+            finished = True
+        timer.cancel()
+
+
+def error_result(rel_path, error, model: str = "smolvlm2") -> dict:
+    """Return the result log entry recorded for a failed image."""
+    return {
+        "file": f"./{rel_path}",
+        "description": f"Error: {str(error)}",
+        "model": model,
+        "generation_time_seconds": None,
+        "error": True,
+    }
+
+
 def prompt_resume() -> bool:
     """Ask user if they want to resume from previous progress."""
     # Auto-resume in non-interactive mode (e.g., batch processing)
     if not sys.stdin.isatty():
-        click.echo("Progress file found. Auto-resuming in non-interactive mode.")
+        click.echo("Progress found. Auto-resuming in non-interactive mode.")
         return True
 
     response = (
-        input("Progress file found. Resume from previous run? (y/n): ").strip().lower()
+        input("Progress found. Resume from previous run? (y/n): ").strip().lower()
     )
     return response in ("y", "yes")
 
@@ -135,9 +303,9 @@ def prompt_resume() -> bool:
 @click.argument("num_files", type=int)
 @click.option("--output-dir", default="outputs", help="Directory for output files")
 @click.option(
-    "--progress-file",
-    default=DEFAULT_PROGRESS_FILE,
-    help=f"Progress tracking file (default: {DEFAULT_PROGRESS_FILE})",
+    "--jobs-db",
+    default=DEFAULT_JOBS_DB,
+    help=f"Job table tracking progress (default: {DEFAULT_JOBS_DB})",
 )
 @click.option(
     "--prompt",
@@ -156,7 +324,102 @@ def prompt_resume() -> bool:
     type=float,
     help="Temperature for generation, range 0.0-1.0 (default: 0.0)",
 )
-def main(directory, num_files, output_dir, progress_file, prompt, max_tokens, temp):
+@click.option(
+    "--backend",
+    default=DEFAULT_BACKEND,
+    type=click.Choice(BACKENDS),
+    help=f"Describer backend (default: {DEFAULT_BACKEND})",
+)
+@click.option("--model", default=None, help="Model to load (default: per backend)")
+@click.option(
+    "--stub-latency",
+    default=None,
+    help="Stub backend latency, e.g. fixed:0.5, uniform:0.2,0.8, normal:1.5,0.3 "
+    "or lognormal:1.2,0.4",
+)
+@click.option(
+    "--prefetch",
+    default=DEFAULT_PREFETCH_DEPTH,
+    type=int,
+    help="Images decoded and resized ahead of the model, on background threads "
+    f"(default: {DEFAULT_PREFETCH_DEPTH})",
+)
+@click.option(
+    "--image-timeout",
+    default=DEFAULT_IMAGE_TIMEOUT,
+    type=float,
+    help="Seconds one image may take; a slower image is moved to the retry "
+    f"queue and the run stops, 0 = no limit (default: {DEFAULT_IMAGE_TIMEOUT})",
+)
+@click.option(
+    "--retry-timed-out",
+    is_flag=True,
+    help="Describe the images in the timeout retry queue instead of pending "
+    "ones; one that times out again is recorded as failed",
+)
+@click.option(
+    "--max-image-edge",
+    default=None,
+    type=int,
+    help="Largest image side given to the model (default: the model's own)",
+)
+@click.option(
+    "--cache-db",
+    default=DEFAULT_CACHE_DB,
+    help="Description cache, keyed by image contents, prompt, model and "
+    f"settings (default: {DEFAULT_CACHE_DB})",
+)
+@click.option(
+    "--no-cache", is_flag=True, help="Describe every image with the model"
+)
+@click.option(
+    "--near-duplicates",
+    is_flag=True,
+    help="Describe one image per group of near-duplicates (similar perceptual "
+    "hash, close capture time) and copy its description to the rest",
+)
+@click.option(
+    "--duplicate-distance",
+    default=DEFAULT_DUPLICATE_DISTANCE,
+    type=int,
+    help="Most bits, of 64, in which near-duplicates' hashes may differ "
+    f"(default: {DEFAULT_DUPLICATE_DISTANCE})",
+)
+@click.option(
+    "--duplicate-window",
+    default=DEFAULT_DUPLICATE_WINDOW,
+    type=float,
+    help="Most seconds between near-duplicates' capture times "
+    f"(default: {DEFAULT_DUPLICATE_WINDOW:g})",
+)
+@click.option(
+    "--exif-db",
+    default=DEFAULT_EXIF_DB,
+    help="Database with the exif table, for capture times "
+    f"(default: {DEFAULT_EXIF_DB})",
+)
+def main(
+    directory,
+    num_files,
+    output_dir,
+    jobs_db,
+    prompt,
+    max_tokens,
+    temp,
+    backend,
+    model,
+    stub_latency,
+    prefetch,
+    image_timeout,
+    retry_timed_out,
+    max_image_edge,
+    cache_db,
+    no_cache,
+    near_duplicates,
+    duplicate_distance,
+    duplicate_window,
+    exif_db,
+):
     """
     Generate descriptions for images in a directory using SmolVLM2.
 
@@ -166,23 +429,26 @@ def main(directory, num_files, output_dir, progress_file, prompt, max_tokens, te
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
 
-    # Define output file path
-    output_file = os.path.join(output_dir, "image_analysis.json")
+    # Results are appended to a JSON-lines log (see result_log.py)
+    migrated = migrate_legacy_json(output_dir)
+    if migrated:
+        click.echo(f"Copied {migrated} results from image_analysis.json to the log")
+    output_file = result_log_path(output_dir)
 
-    # Check for existing progress file and output file
-    completed_files = set()
-    if os.path.exists(progress_file):
+    # Check for earlier progress in the job table and output file
+    jobs = open_jobs(jobs_db)
+    completed = jobs.completed_count()
+    if completed:
         # Check if output file also exists (consistent state)
         if not os.path.exists(output_file):
-            click.echo("Warning: Progress file exists but output file is missing.")
+            click.echo("Warning: Job table has progress but output file is missing.")
             click.echo("This indicates an inconsistent state. Starting fresh.")
-            delete_progress_file(progress_file)
-            click.echo("Deleted progress file. Starting fresh.")
+            jobs.reset()
+            click.echo("Reset all jobs to pending. Starting fresh.")
         elif prompt_resume():
-            completed_files = load_progress_file(progress_file)
-            click.echo(f"Resuming: {len(completed_files)} files already processed")
+            click.echo(f"Resuming: {completed} files already processed")
         else:
-            delete_progress_file(progress_file)
+            jobs.reset()
             click.echo("Starting fresh")
 
     # Find all files in directory
@@ -196,154 +462,177 @@ def main(directory, num_files, output_dir, progress_file, prompt, max_tokens, te
     click.echo(f"Found {len(all_files)} total files")
 
     # Filter out already completed files
-    files_to_process = [
-        f for f in all_files if str(f.relative_to(base_path)) not in completed_files
-    ]
+    jobs.add_files(str(f.relative_to(base_path)) for f in all_files)
+    if retry_timed_out:
+        pending = set(jobs.timed_out_files())
+    else:
+        pending = set(jobs.pending_files())
+    files_to_process = [f for f in all_files if str(f.relative_to(base_path)) in pending]
 
     if not files_to_process:
-        click.echo("All files have already been processed!")
+        if retry_timed_out:
+            click.echo("No timed-out files to retry.")
+        else:
+            click.echo("All files have already been processed!")
         return
 
-    click.echo(f"Files remaining to process: {len(files_to_process)}")
+    queue_name = "timed-out files to retry" if retry_timed_out else "files remaining"
+    click.echo(f"{queue_name.capitalize()} to process: {len(files_to_process)}")
+
+    # Near-duplicates of a representative get its description when it is
+    # described, instead of going to the model themselves
+    members_of = {}
+    if near_duplicates and not retry_timed_out:
+        click.echo("Grouping near-duplicates...")
+        members_of = group_near_duplicates(
+            jobs,
+            files_to_process,
+            base_path,
+            exif_db,
+            duplicate_distance,
+            duplicate_window,
+        )
+        inheriting = {m for members in members_of.values() for m in members}
+        files_to_process = [f for f in files_to_process if f not in inheriting]
+        click.echo(
+            f"Near-duplicates: {len(inheriting)} files will inherit descriptions "
+            f"from {len(members_of)} representatives"
+        )
 
     # Limit to the specified number of files
     files_to_process = files_to_process[:num_files]
     click.echo(f"Processing {len(files_to_process)} files in this run")
 
     # Load the model
-    click.echo("\nLoading SmolVLM2 model...")
-    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
-    from smolvlm2_helper import SmolVLM2Helper
-
-    vlm = SmolVLM2Helper()
+    click.echo(f"\nLoading {backend} describer...")
+    describer = get_describer(
+        backend, model=model, latency=stub_latency, max_edge=max_image_edge
+    )
+    describer.load()
+    cache = open_cache(None if no_cache else cache_db)
 
     # Ensure prompt has <image> token
     if "<image>" not in prompt:
         prompt = f"<image>{prompt}"
         click.echo("Note: Added <image> token to prompt")
 
-    # Process images and collect results
-    # Flush to JSON every FLUSH_INTERVAL images to prevent data loss
-    FLUSH_INTERVAL = 10
-    pending_results = []
+    # Each result is appended as soon as it is ready, and synced to disk
+    # every SYNC_INTERVAL images
+    SYNC_INTERVAL = 10
+    results = ResultLog(output_file, sync_every=SYNC_INTERVAL)
     total_processed = 0
     total_successful = 0
     total_failed = 0
+    total_inherited = 0
 
     click.echo(f"\nProcessing images with prompt: '{prompt}'")
     click.echo(f"Temperature: {temp}, Max tokens: {max_tokens}")
-    click.echo(f"Writing to JSON every {FLUSH_INTERVAL} images\n")
-
-    for i, image_path in enumerate(files_to_process, 1):
+    if image_timeout:
+        click.echo(f"Image timeout: {image_timeout:g}s")
+    click.echo(f"Syncing results to disk every {SYNC_INTERVAL} images\n")
+
+    # Read, decode and resize the next images while the model works
+    prefetcher = ImagePrefetcher(describer.prepare, depth=prefetch)
+    images = prefetcher.iterate(files_to_process)
+
+    def on_timeout(rel_path: Path):
+        # Runs on the watchdog thread while the model is stuck on rel_path;
+        # the job table connection belongs to the main thread
+        click.echo(f"  Timed out after {image_timeout:g}s: {rel_path}", err=True)
+        with open_jobs(jobs_db) as timeout_jobs:
+            timeout_jobs.time_out(str(rel_path), image_timeout)
+            if retry_timed_out:
+                error = f"timed out after {image_timeout:g}s again on retry"
+                result_entry = error_result(rel_path, error, describer.name)
+                results.append(result_entry)
+                timeout_jobs.finish(str(rel_path), result_entry, prompt)
+        results.close()
+        os._exit(TIMEOUT_EXIT_CODE)
+
+    for i, (image_path, prepared) in enumerate(images, 1):
         # Get relative path from input directory
         rel_path = image_path.relative_to(base_path)
 
         click.echo(f"[{i}/{len(files_to_process)}] Processing: {rel_path}")
+        jobs.start(str(rel_path))
 
         try:
-            # Time the description generation
-            start_time = time.time()
-
-            description = vlm.describe_image(
-                str(image_path),
-                prompt=prompt,
-                temp=temp,
-                max_tokens=max_tokens,
-                verbose=False,
-            )
-
-            elapsed_time = time.time() - start_time
-
-            # Extract text and throughput metrics from GenerationResult
-            result_entry = {
-                "file": f"./{rel_path}",
-                "model": "smolvlm2",
-                "generation_time_seconds": round(elapsed_time, 2),
-                "error": False,
-            }
-
-            if hasattr(description, "text"):
-                result_entry["description"] = description.text.strip()  # type: ignore[union-attr]
-                result_entry["prompt_tokens"] = getattr(
-                    description, "prompt_tokens", None
+            with image_deadline(image_timeout, lambda: on_timeout(rel_path)):
+                result_entry = describe_cached(
+                    cache,
+                    describer,
+                    image_path,
+                    prefetcher.wait(prepared),
+                    rel_path,
+                    prompt,
+                    temp,
+                    max_tokens,
                 )
-                result_entry["generation_tokens"] = getattr(
-                    description, "generation_tokens", None
-                )
-                prompt_tps = round(getattr(description, "prompt_tps", 0), 2)
-                result_entry["prompt_tps"] = None if prompt_tps == 0 else prompt_tps
-                generation_tps = round(getattr(description, "generation_tps", 0), 2)
-                result_entry["generation_tps"] = (
-                    None if generation_tps == 0 else generation_tps
-                )
-            else:
-                result_entry["description"] = str(description).strip()
-
-            pending_results.append(result_entry)
-
-            gen_tps = result_entry.get("generation_tps")
-            tps_info = f", {gen_tps:.1f} tokens/s" if gen_tps else ""
-            click.echo(f"  Completed in {elapsed_time:.2f}s{tps_info}")
+            results.append(result_entry)
+            click.echo(completion_message(result_entry))
             total_successful += 1
 
-            # Save to progress file after successful processing
-            append_to_progress_file(str(rel_path), progress_file)
-
         except Exception as e:
             click.echo(f"  Error processing {rel_path}: {e}", err=True)
-            pending_results.append(
-                {
-                    "file": f"./{rel_path}",
-                    "description": f"Error: {str(e)}",
-                    "model": "smolvlm2",
-                    "generation_time_seconds": None,
-                    "error": True,
-                }
-            )
+            result_entry = error_result(rel_path, e, describer.name)
+            results.append(result_entry)
             total_failed += 1
 
-            # Track failed files to prevent duplicate entries on resume
-            append_to_progress_file(str(rel_path), progress_file)
+        # Failed files are marked too, to prevent duplicate entries on resume
+        jobs.finish(str(rel_path), result_entry, prompt)
+
+        # A failed representative's near-duplicates stay pending, to be
+        # grouped again on the next run
+        members = [] if result_entry["error"] else members_of.get(image_path, [])
+        if members:
+            inherited = [
+                (rel, inherited_result(result_entry, rel))
+                for rel in (member.relative_to(base_path) for member in members)
+            ]
+            for _, entry in inherited:
+                results.append(entry)
+            jobs.finish_many(inherited, prompt)
+            total_inherited += len(inherited)
+            click.echo(f"  Inherited by {len(inherited)} near-duplicates")
 
         total_processed += 1
 
-        # Flush to JSON every FLUSH_INTERVAL images
-        if len(pending_results) >= FLUSH_INTERVAL:
-            click.echo(f"  Saving {len(pending_results)} results to JSON...")
-            if not flush_results_to_json(output_file, pending_results):
-                click.echo("Error: Failed to write to JSON. Stopping.", err=True)
-                sys.exit(1)
-            pending_results = []
-
         # Check for graceful stop request
         if check_stop_requested():
             click.echo("\n⚠ Stop requested - finishing gracefully...")
-            if pending_results:
-                click.echo(
-                    f"  Saving {len(pending_results)} pending results to JSON..."
-                )
-                if not flush_results_to_json(output_file, pending_results):
-                    click.echo("Error: Failed to write to JSON.", err=True)
-                    sys.exit(1)
+            results.close()
+            jobs.close()
+            if cache:
+                click.echo(f"  {cache.summary()}")
+                cache.close()
             click.echo(
                 f"  Stopped after {total_processed} files ({total_successful} successful, {total_failed} failed)"
             )
             click.echo(f"  Output saved to: {output_file}")
             sys.exit(0)
 
-    # Flush any remaining results
-    if pending_results:
-        click.echo(f"  Saving final {len(pending_results)} results to JSON...")
-        if not flush_results_to_json(output_file, pending_results):
-            click.echo("Error: Failed to write to JSON.", err=True)
-            sys.exit(1)
+    prefetcher.close()
+    results.close()
+    timed_out = 0 if retry_timed_out else len(jobs.timed_out_files())
+    jobs.close()
+    if cache:
+        cache.close()
+    click.echo(f"Waited {prefetcher.wait_seconds:.2f}s in total for images to load")
 
     click.echo("\n✓ Analysis complete!")
     click.echo(
         f"  This batch: {total_processed} files ({total_successful} successful, {total_failed} failed)"
     )
     click.echo(f"  Output saved to: {output_file}")
-    click.echo(f"  Progress tracked in: {progress_file}")
+    click.echo(f"  Progress tracked in: {jobs_db}")
+    if near_duplicates:
+        click.echo(f"  Inherited by near-duplicates: {total_inherited} files")
+    if cache:
+        click.echo(f"  {cache.summary()}")
+    if timed_out:
+        click.echo(
+            f"  {timed_out} files timed out - describe them with --retry-timed-out"
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,76 @@
+"""
+Prepare images ahead of inference.
+
+Reading, decoding and resizing an image (Describer.prepare) runs on a small
+thread pool while the model is busy with the previous image, so generate()
+starts as soon as the last one finishes instead of waiting on disk I/O.
+
+Usage:
+    prefetcher = ImagePrefetcher(describer.prepare, depth=4)
+    for path, future in prefetcher.iterate(paths):
+        image = future.result()  # re-raises a decode error for this image
+        describer.describe(image, prompt)
+    prefetcher.close()
+"""
+
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Tuple
+
+DEFAULT_PREFETCH_DEPTH = 4
+DEFAULT_PREFETCH_WORKERS = 2
+
+
+class ImagePrefetcher:
+    """
+    Run ``prepare(path)`` on a thread pool, up to ``depth`` images ahead of
+    the consumer. wait_seconds adds up how long the consumer was left
+    waiting for an image, i.e. how long the model sat idle on input.
+    """
+
+    def __init__(
+        self,
+        prepare: Callable,
+        depth: int = DEFAULT_PREFETCH_DEPTH,
+        workers: int = DEFAULT_PREFETCH_WORKERS,
+    ):
+        self.prepare = prepare
+        self.depth = max(1, depth)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, workers), thread_name_prefix="image-prefetch"
+        )
+        self.wait_seconds = 0.0
+
+    def submit(self, path) -> Future:
+        """Start preparing ``path``; the future holds the prepared image."""
+        return self.executor.submit(self.prepare, path)
+
+    def wait(self, future: Future):
+        """Return the future's image, counting time spent blocked on it."""
+        start = time.perf_counter()
+        try:
+            return future.result()
+        finally:
+            self.wait_seconds += time.perf_counter() - start
+
+    def iterate(self, items: Iterable, key: Callable = str) -> Iterator[Tuple]:
+        """
+        Yield (item, future) in order, keeping ``depth`` items submitted
+        ahead. ``key(item)`` is the path passed to prepare().
+        """
+        pending = deque()
+        items = iter(items)
+        for item in items:
+            pending.append((item, self.submit(key(item))))
+            if len(pending) >= self.depth:
+                break
+        while pending:
+            item, future = pending.popleft()
+            for next_item in items:
+                pending.append((next_item, self.submit(key(next_item))))
+                break
+            yield item, future
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,596 @@
+#!/usr/bin/env python3
+"""
+SQLite job table for image description runs.
+
+One row per image (path relative to the input directory, as the old
+photo_descriptions_progress.txt stored it) with its status, attempt count,
+timings, error text and the model and prompt that produced its result.
+Each image's row is updated in its own transaction, so resume, progress
+counts and "what's left" are indexed queries instead of re-reading a
+text file.
+
+Status: pending -> running -> done | failed. Failed images count as
+completed, like they did in the progress file; running rows left behind
+by a crash are picked up again on resume. An image that runs past the
+per-image deadline becomes timed_out: it waits in a retry queue that is
+described after everything else, with cheaper settings, and ``timeouts``
+keeps count of how often each image hit the deadline.
+
+Queue workers (work_queue.py) lease chunks of images instead: ``worker``
+and ``lease_expires`` say who holds a running image and until when, and a
+running image whose lease has expired can be claimed again. Their results
+wait in ``result`` until they are collected into the result log.
+
+``dhash`` keeps each image's perceptual hash (see near_duplicates.py), so
+near-duplicate grouping only hashes images once.
+
+Usage:
+    python src/job_store.py status [--jobs-db FILE] [--journal-mode MODE]
+    python src/job_store.py import-progress FILE [--jobs-db FILE]
+    python src/job_store.py reset [--failed | --timed-out] [--jobs-db FILE]
+
+Example:
+    # Carry over a v2 run tracked in a progress file
+    python src/job_store.py import-progress photo_descriptions_v2_progress.txt \\
+        --jobs-db photo_descriptions_v2_jobs.db
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterable, Optional
+
+DEFAULT_JOBS_DB = "photo_descriptions_jobs.db"
+LEGACY_PROGRESS_FILE = "photo_descriptions_progress.txt"
+
+# Journal modes a job table can be opened in. WAL lets readers run beside
+# the batch but only works on one host; a table shared by several machines
+# needs the rollback journal (delete).
+JOURNAL_MODES = ("wal", "delete")
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+TIMED_OUT = "timed_out"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS description_job (
+    file TEXT PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    started_at TEXT,
+    finished_at TEXT,
+    generation_seconds REAL,
+    error TEXT,
+    model TEXT,
+    prompt TEXT,
+    timeouts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_expires TEXT,
+    result TEXT,
+    dhash TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_description_job_status
+    ON description_job(status, file);
+CREATE INDEX IF NOT EXISTS idx_description_job_finished
+    ON description_job(finished_at);
+"""
+
+# Columns added to description_job after it was first released, added to
+# older tables on open
+ADDED_COLUMNS = {
+    "timeouts": "INTEGER NOT NULL DEFAULT 0",
+    "worker": "TEXT",
+    "lease_expires": "TEXT",
+    "result": "TEXT",
+    "dhash": "TEXT",
+}
+
+
+# Times are stored in UTC, so leases shared by machines in different time
+# zones, or across a DST change, expire when they should.
+def now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def ago(minutes: float) -> str:
+    return (datetime.now(timezone.utc) - timedelta(minutes=minutes)).isoformat(
+        timespec="seconds"
+    )
+
+
+def lease_until(seconds: float) -> str:
+    return (datetime.now(timezone.utc) + timedelta(seconds=seconds)).isoformat(
+        timespec="seconds"
+    )
+
+
+class JobStore:
+    """
+    The description_job table in ``path``. A legacy progress file is
+    imported as done the first time the table is created.
+
+    ``journal_mode`` (one of JOURNAL_MODES) switches the database to that
+    mode; by default a new table uses WAL and an existing one keeps its mode.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_JOBS_DB,
+        legacy_progress_file: Optional[str] = None,
+        journal_mode: Optional[str] = None,
+    ):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30)
+        existed = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'description_job'"
+        ).fetchone()
+        if journal_mode is None and not existed:
+            # Readers (check_progress.py) must not block the running batch
+            journal_mode = "wal"
+        if journal_mode is not None:
+            if journal_mode not in JOURNAL_MODES:
+                raise ValueError(f"Unknown journal mode: {journal_mode}")
+            current = self.conn.execute("PRAGMA journal_mode").fetchone()[0]
+            if current != journal_mode:
+                self.conn.execute(f"PRAGMA journal_mode={journal_mode.upper()}")
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+            info = self.conn.execute("PRAGMA table_info(description_job)")
+            columns = {row[1] for row in info}
+            for column, definition in ADDED_COLUMNS.items():
+                if column not in columns:
+                    self.conn.execute(
+                        f"ALTER TABLE description_job ADD COLUMN {column} {definition}"
+                    )
+        if (
+            not existed
+            and legacy_progress_file
+            and os.path.exists(legacy_progress_file)
+        ):
+            self.import_progress_file(legacy_progress_file)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_files(self, files: Iterable[str]) -> int:
+        """Add images not in the table yet as pending; returns how many."""
+        with self.conn:
+            cursor = self.conn.executemany(
+                "INSERT OR IGNORE INTO description_job (file) VALUES (?)",
+                ((str(f),) for f in files),
+            )
+        return cursor.rowcount
+
+    def pending_files(self) -> list:
+        """Images still to describe, including ones a crash left running."""
+        rows = self.conn.execute(
+            "SELECT file FROM description_job WHERE status IN (?, ?) ORDER BY file",
+            (PENDING, RUNNING),
+        )
+        return [row[0] for row in rows]
+
+    def timed_out_files(self) -> list:
+        """Images waiting in the retry queue after running past the deadline."""
+        rows = self.conn.execute(
+            "SELECT file FROM description_job WHERE status = ? ORDER BY file",
+            (TIMED_OUT,),
+        )
+        return [row[0] for row in rows]
+
+    def completed_files(self) -> set:
+        rows = self.conn.execute(
+            "SELECT file FROM description_job WHERE status IN (?, ?)",
+            (DONE, FAILED),
+        )
+        return {row[0] for row in rows}
+
+    def dhashes(self) -> dict:
+        """Perceptual hashes stored so far, {file: hash as an integer}."""
+        rows = self.conn.execute(
+            "SELECT file, dhash FROM description_job WHERE dhash IS NOT NULL"
+        )
+        return {file: int(value, 16) for file, value in rows}
+
+    def store_dhashes(self, hashes: dict):
+        """Store {file: hash} for files already in the table."""
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE description_job SET dhash = ? WHERE file = ?",
+                ((f"{value:016x}", str(file)) for file, value in hashes.items()),
+            )
+
+    def start(self, file: str, worker: Optional[str] = None) -> bool:
+        """
+        Mark an image as being described and count the attempt. A queue
+        worker only starts an image it still holds the lease on, so an image
+        another worker has claimed or finished since is left alone. Returns
+        whether the image was started.
+        """
+        sql = """
+            UPDATE description_job
+            SET status = ?, attempts = attempts + 1, started_at = ?
+            WHERE file = ?
+        """
+        params = (RUNNING, now(), str(file))
+        if worker is not None:
+            sql += " AND worker = ? AND status = ?"
+            params += (worker, RUNNING)
+        with self.conn:
+            cursor = self.conn.execute(sql, params)
+        return cursor.rowcount > 0
+
+    def time_out(self, file: str, seconds: float):
+        """Move an image that ran past the deadline to the retry queue."""
+        with self.conn:
+            self.conn.execute(
+                """
+                UPDATE description_job
+                SET status = ?, timeouts = timeouts + 1, finished_at = ?,
+                    generation_seconds = NULL, error = ?
+                WHERE file = ?
+                """,
+                (TIMED_OUT, now(), f"Timed out after {seconds:g}s", str(file)),
+            )
+
+    def timeout_stats(self) -> dict:
+        """How images that hit the deadline at least once ended up."""
+        row = self.conn.execute(
+            """
+            SELECT count(*), sum(timeouts), sum(status = ?), sum(status = ?),
+                   sum(status = ?)
+            FROM description_job WHERE timeouts > 0
+            """,
+            (DONE, FAILED, TIMED_OUT),
+        ).fetchone()
+        keys = ("images", "timeouts", "recovered", "failed", "waiting")
+        return {key: value or 0 for key, value in zip(keys, row)}
+
+    def claim(
+        self, worker: str, count: int, lease_seconds: float, status: str = PENDING
+    ) -> list:
+        """
+        Lease up to ``count`` images with ``status`` to ``worker``, along
+        with running images whose lease has expired (their worker died).
+        Returns the claimed files in order.
+        """
+        current = now()
+        with self.conn:
+            rows = self.conn.execute(
+                """
+                UPDATE description_job
+                SET status = ?, worker = ?, lease_expires = ?
+                WHERE file IN (
+                    SELECT file FROM description_job
+                    WHERE status = ?
+                       OR (status = ? AND (lease_expires IS NULL
+                                           OR lease_expires < ?))
+                    ORDER BY file LIMIT ?
+                )
+                RETURNING file
+                """,
+                (
+                    RUNNING,
+                    worker,
+                    lease_until(lease_seconds),
+                    status,
+                    RUNNING,
+                    current,
+                    count,
+                ),
+            ).fetchall()
+        return sorted(row[0] for row in rows)
+
+    def renew(self, worker: str, files: Iterable[str], lease_seconds: float):
+        """Extend ``worker``'s leases on the images it has not finished yet."""
+        expires = lease_until(lease_seconds)
+        with self.conn:
+            self.conn.executemany(
+                """
+                UPDATE description_job SET lease_expires = ?
+                WHERE file = ? AND worker = ? AND status = ?
+                """,
+                ((expires, str(f), worker, RUNNING) for f in files),
+            )
+
+    def release(self, worker: str, files: Iterable[str], status: str = PENDING):
+        """Hand ``worker``'s unfinished leased images back to ``status``."""
+        with self.conn:
+            self.conn.executemany(
+                """
+                UPDATE description_job SET status = ?, lease_expires = NULL
+                WHERE file = ? AND worker = ? AND status = ?
+                """,
+                ((status, str(f), worker, RUNNING) for f in files),
+            )
+
+    def complete(
+        self, worker: str, file: str, result: dict, prompt: Optional[str] = None
+    ) -> bool:
+        """
+        Record a queue worker's result for an image and keep it for
+        collect_results(). The first result for an image wins: if a worker
+        whose lease expired finishes after the image was done again, its
+        result is dropped. Returns whether the result was recorded.
+        """
+        failed = bool(result.get("error"))
+        with self.conn:
+            cursor = self.conn.execute(
+                """
+                UPDATE description_job
+                SET status = ?, finished_at = ?, generation_seconds = ?,
+                    error = ?, model = ?, prompt = ?, worker = ?,
+                    lease_expires = NULL, result = ?
+                WHERE file = ? AND status NOT IN (?, ?)
+                """,
+                (
+                    FAILED if failed else DONE,
+                    now(),
+                    result.get("generation_time_seconds"),
+                    result.get("description") if failed else None,
+                    result.get("model"),
+                    prompt,
+                    worker,
+                    json.dumps(result, ensure_ascii=False),
+                    str(file),
+                    DONE,
+                    FAILED,
+                ),
+            )
+        return cursor.rowcount > 0
+
+    def collect_results(self, write: Callable[[list], None]) -> int:
+        """
+        Pass the results queue workers recorded to write(entries), then drop
+        them from the table. Holds the database write lock throughout, so
+        concurrent collectors never write a result twice. Returns how many.
+        """
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self.conn.execute(
+                """
+                SELECT file, result FROM description_job
+                WHERE result IS NOT NULL ORDER BY finished_at, file
+                """
+            ).fetchall()
+            if rows:
+                write([json.loads(row[1]) for row in rows])
+                self.conn.executemany(
+                    "UPDATE description_job SET result = NULL WHERE file = ?",
+                    ((row[0],) for row in rows),
+                )
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        return len(rows)
+
+    def leased_count(self) -> int:
+        """Images currently leased to a live worker."""
+        return self.conn.execute(
+            """
+            SELECT count(*) FROM description_job
+            WHERE status = ? AND lease_expires >= ?
+            """,
+            (RUNNING, now()),
+        ).fetchone()[0]
+
+    def worker_stats(self, since: str) -> list:
+        """
+        Per queue worker: (worker, done, failed, finished since ``since``,
+        images leased now, last finished_at), busiest first.
+        """
+        rows = self.conn.execute(
+            """
+            SELECT worker,
+                   sum(status = ?),
+                   sum(status = ?),
+                   sum(status IN (?, ?) AND finished_at >= ?),
+                   sum(status = ? AND lease_expires >= ?),
+                   max(finished_at)
+            FROM description_job
+            WHERE worker IS NOT NULL
+            GROUP BY worker
+            ORDER BY 4 DESC, 2 DESC
+            """,
+            (DONE, FAILED, DONE, FAILED, since, RUNNING, now()),
+        )
+        return rows.fetchall()
+
+    def finish(self, file: str, result: dict, prompt: Optional[str] = None):
+        """Record an image's result log entry as its outcome."""
+        self.finish_many([(file, result)], prompt)
+
+    def finish_many(self, results: Iterable[tuple], prompt: Optional[str] = None):
+        """finish() for several (file, result) pairs in one transaction."""
+        finished_at = now()
+        rows = []
+        for file, result in results:
+            failed = bool(result.get("error"))
+            rows.append(
+                (
+                    str(file),
+                    FAILED if failed else DONE,
+                    finished_at,
+                    result.get("generation_time_seconds"),
+                    result.get("description") if failed else None,
+                    result.get("model"),
+                    prompt,
+                )
+            )
+        with self.conn:
+            self.conn.executemany(
+                """
+                INSERT INTO description_job
+                    (file, status, attempts, finished_at, generation_seconds,
+                     error, model, prompt)
+                VALUES (?1, ?2, 1, ?3, ?4, ?5, ?6, ?7)
+                ON CONFLICT(file) DO UPDATE SET
+                    status = ?2,
+                    attempts = max(attempts, 1),
+                    finished_at = ?3,
+                    generation_seconds = ?4,
+                    error = ?5,
+                    model = ?6,
+                    prompt = ?7
+                """,
+                rows,
+            )
+
+    def reset(self, files: Optional[Iterable[str]] = None, status=None) -> int:
+        """
+        Put images back to pending so they are described again: ``files``,
+        every image with ``status``, or every image. Returns how many.
+        """
+        clear = """
+            UPDATE description_job
+            SET status = 'pending', started_at = NULL, finished_at = NULL,
+                generation_seconds = NULL, error = NULL, model = NULL,
+                prompt = NULL, worker = NULL, lease_expires = NULL, result = NULL
+        """
+        with self.conn:
+            if files is not None:
+                cursor = self.conn.executemany(
+                    clear + " WHERE file = ?", ((str(f),) for f in files)
+                )
+            elif status is not None:
+                cursor = self.conn.execute(clear + " WHERE status = ?", (status,))
+            else:
+                cursor = self.conn.execute(clear)
+        return cursor.rowcount
+
+    def counts(self) -> dict:
+        """Number of images per status."""
+        rows = self.conn.execute(
+            "SELECT status, count(*) FROM description_job GROUP BY status"
+        )
+        return dict(rows.fetchall())
+
+    def completed_count(self) -> int:
+        return self.conn.execute(
+            "SELECT count(*) FROM description_job WHERE status IN (?, ?)",
+            (DONE, FAILED),
+        ).fetchone()[0]
+
+    def last_finished(self) -> Optional[tuple]:
+        """(file, finished_at datetime) of the latest image, or None."""
+        row = self.conn.execute(
+            """
+            SELECT file, finished_at FROM description_job
+            WHERE finished_at IS NOT NULL
+            ORDER BY finished_at DESC, rowid DESC LIMIT 1
+            """
+        ).fetchone()
+        if row is None:
+            return None
+        finished_at = datetime.fromisoformat(row[1])
+        if finished_at.tzinfo is not None:
+            # Local time, like rows written before times were stored in UTC
+            finished_at = finished_at.astimezone().replace(tzinfo=None)
+        return row[0], finished_at
+
+    def import_progress_file(self, progress_file: str) -> int:
+        """Mark every image listed in a progress text file as done."""
+        with open(progress_file, "r") as f:
+            files = [line.strip() for line in f if line.strip()]
+        finished_at = datetime.fromtimestamp(
+            os.path.getmtime(progress_file)
+        ).isoformat(timespec="seconds")
+        with self.conn:
+            cursor = self.conn.executemany(
+                """
+                INSERT INTO description_job (file, status, attempts, finished_at)
+                VALUES (?, ?, 1, ?)
+                ON CONFLICT(file) DO UPDATE SET
+                    status = excluded.status, finished_at = excluded.finished_at
+                WHERE description_job.status NOT IN ('done', 'failed')
+                """,
+                ((f, DONE, finished_at) for f in files),
+            )
+        return cursor.rowcount
+
+
+def open_jobs(
+    path: str = DEFAULT_JOBS_DB, journal_mode: Optional[str] = None
+) -> JobStore:
+    """
+    Open the job table at ``path``; the default table starts from
+    photo_descriptions_progress.txt if that exists.
+    """
+    legacy = LEGACY_PROGRESS_FILE if path == DEFAULT_JOBS_DB else None
+    return JobStore(path, legacy_progress_file=legacy, journal_mode=journal_mode)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Inspect and maintain the image description job table"
+    )
+    parser.add_argument(
+        "--jobs-db",
+        default=DEFAULT_JOBS_DB,
+        help=f"Job table database (default: {DEFAULT_JOBS_DB})",
+    )
+    parser.add_argument(
+        "--journal-mode",
+        choices=JOURNAL_MODES,
+        help="Switch the job table to this journal mode; use delete for a table "
+        "shared by several machines (default: wal for a new table)",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="Show the number of images per status")
+    import_parser = commands.add_parser(
+        "import-progress", help="Mark the images in a progress text file as done"
+    )
+    import_parser.add_argument("progress_file")
+    reset_parser = commands.add_parser(
+        "reset", help="Put images back to pending so they are described again"
+    )
+    only = reset_parser.add_mutually_exclusive_group()
+    only.add_argument("--failed", action="store_true", help="Only reset failed images")
+    only.add_argument(
+        "--timed-out",
+        action="store_true",
+        help="Only reset images waiting for a timeout retry, to retry them at "
+        "full settings",
+    )
+    args = parser.parse_args()
+
+    if args.command != "import-progress" and not os.path.exists(args.jobs_db):
+        print(f"Error: Job table not found: {args.jobs_db}")
+        sys.exit(1)
+
+    with open_jobs(args.jobs_db, args.journal_mode) as jobs:
+        if args.command == "import-progress":
+            count = jobs.import_progress_file(args.progress_file)
+            print(f"Marked {count:,} images done in {args.jobs_db}")
+        elif args.command == "reset":
+            status = FAILED if args.failed else TIMED_OUT if args.timed_out else None
+            count = jobs.reset(status=status)
+            print(f"Reset {count:,} images to pending")
+        else:
+            counts = jobs.counts()
+            total = sum(counts.values())
+            print(f"Jobs in {args.jobs_db}: {total:,}")
+            for status in (PENDING, RUNNING, DONE, FAILED, TIMED_OUT):
+                print(f"  {status + ':':<11}{counts.get(status, 0):>8,}")
+            stats = jobs.timeout_stats()
+            if stats["images"]:
+                print(
+                    f"Timed out: {stats['images']:,} images ({stats['timeouts']:,} "
+                    f"timeouts) - {stats['recovered']:,} recovered on retry, "
+                    f"{stats['failed']:,} failed, {stats['waiting']:,} waiting"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Group burst shots and duplicates so only one image per group is described.
+
+Images are compared by difference hash (dHash: 64 bits, one per pair of
+neighbouring pixels in a 9x8 grayscale thumbnail, set where the left one
+is brighter) and by EXIF capture time from the exif table in
+mediameta.db, the same CreateDate the duptime table groups on. Two images
+join a group when their hash differs from the group's first image in at
+most --duplicate-distance bits and they were taken within
+--duplicate-window seconds of the group's latest image, so a long burst
+stays one group. Images without a capture time are only grouped with
+identical hashes.
+
+generate_descriptions.py --near-duplicates describes each group's
+representative (its earliest image) and gives the other members the same
+description, marked with "inherited_from" in the result log.
+
+Usage:
+    from near_duplicates import capture_times, find_clusters, hash_images
+
+    hashes = hash_images(paths)
+    clusters = find_clusters(hashes, capture_times(exif_db, hashes))
+"""
+
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+DEFAULT_EXIF_DB = os.environ.get("MEDIAMETA_DB_PATH", "database/mediameta.db")
+
+# Most bits two 64-bit dHashes may differ in for near-duplicates
+DEFAULT_DUPLICATE_DISTANCE = 6
+
+# Most seconds between an image's capture time and the latest in its group
+DEFAULT_DUPLICATE_WINDOW = 2.0
+
+# Side of the dHash grid; the hash has HASH_SIZE * HASH_SIZE bits
+HASH_SIZE = 8
+
+# CreateDate as exiftool writes it, before date_to_iso.py converts it
+EXIF_DATE_FORMAT = "%Y:%m:%d %H:%M:%S"
+
+# SourceFiles looked up per query, below SQLite's bound-parameter limit
+CAPTURE_TIME_BATCH_SIZE = 500
+
+
+@dataclass
+class Cluster:
+    """A representative image and the near-duplicates that inherit from it."""
+
+    representative: str
+    members: List[str] = field(default_factory=list)
+
+
+def dhash(image_path: str) -> int:
+    """Difference hash of an image, as a HASH_SIZE * HASH_SIZE bit integer."""
+    from PIL import Image, ImageOps
+
+    with Image.open(image_path) as img:
+        # JPEGs decode straight to a reduced size
+        img.draft("L", (HASH_SIZE * 4, HASH_SIZE * 4))
+        img = ImageOps.exif_transpose(img).convert("L")
+        img = img.resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS)
+    pixels = img.tobytes()
+    bits = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            bits = (bits << 1) | (left > pixels[row * (HASH_SIZE + 1) + col + 1])
+    return bits
+
+
+def hash_images(paths: Dict[str, str], workers: int = 4) -> Dict[str, int]:
+    """
+    dHashes for {key: image path}, computed on a thread pool. Images that
+    cannot be read are left out, so they are never grouped.
+    """
+
+    def safe_dhash(path: str) -> Optional[int]:
+        try:
+            return dhash(path)
+        except Exception:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        hashes = executor.map(safe_dhash, paths.values())
+        return {key: value for key, value in zip(paths, hashes) if value is not None}
+
+
+def parse_capture_time(value: Optional[str]) -> Optional[datetime]:
+    """A CreateDate in ISO or EXIF format, without its time zone."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        try:
+            parsed = datetime.strptime(value[:19], EXIF_DATE_FORMAT)
+        except ValueError:
+            return None
+    return parsed.replace(tzinfo=None)
+
+
+def capture_times(exif_db: str, files: Iterable[str]) -> Dict[str, datetime]:
+    """
+    EXIF CreateDate of each file (a path relative to the thumbnail
+    directory, as exif.SourceFile stores it without the leading ./).
+    Returns an empty dict if the database or its exif table is missing.
+    """
+    if not os.path.exists(exif_db):
+        return {}
+    wanted = {f"./{f}": f for f in files}
+    source_files = list(wanted)
+    rows = []
+    conn = sqlite3.connect(f"file:{exif_db}?mode=ro", uri=True)
+    try:
+        for i in range(0, len(source_files), CAPTURE_TIME_BATCH_SIZE):
+            batch = source_files[i : i + CAPTURE_TIME_BATCH_SIZE]
+            placeholders = ",".join("?" for _ in batch)
+            rows.extend(
+                conn.execute(
+                    f"""SELECT SourceFile, CreateDate FROM exif
+                        WHERE SourceFile IN ({placeholders})""",
+                    batch,
+                )
+            )
+    except sqlite3.OperationalError:
+        return {}
+    finally:
+        conn.close()
+    times = {}
+    for source_file, create_date in rows:
+        taken = parse_capture_time(create_date)
+        if taken:
+            times[wanted[source_file]] = taken
+    return times
+
+
+def find_clusters(
+    hashes: Dict[str, int],
+    times: Dict[str, datetime],
+    max_distance: int = DEFAULT_DUPLICATE_DISTANCE,
+    window: float = DEFAULT_DUPLICATE_WINDOW,
+) -> List[Cluster]:
+    """
+    Group hashed files into clusters of near-duplicates. In capture time
+    order, each file joins the cluster whose representative's hash is
+    closest, within ``max_distance`` bits, among clusters with an image
+    taken up to ``window`` seconds before it; otherwise it starts one.
+    """
+    clusters = []
+    timed = sorted((f for f in hashes if f in times), key=lambda f: (times[f], f))
+    # Clusters whose latest image is recent enough to take the next file,
+    # with that image's capture time
+    open_clusters: List[Cluster] = []
+    latest: Dict[str, datetime] = {}
+    for file in timed:
+        taken = times[file]
+        open_clusters = [
+            c
+            for c in open_clusters
+            if (taken - latest[c.representative]).total_seconds() <= window
+        ]
+        best, best_distance = None, max_distance + 1
+        for cluster in open_clusters:
+            distance = (hashes[file] ^ hashes[cluster.representative]).bit_count()
+            if distance < best_distance:
+                best, best_distance = cluster, distance
+        if best is None:
+            best = Cluster(file)
+            clusters.append(best)
+            open_clusters.append(best)
+        else:
+            best.members.append(file)
+        latest[best.representative] = taken
+
+    # Without a capture time only an identical hash is a safe match
+    by_hash: Dict[int, Cluster] = {}
+    for file in sorted(f for f in hashes if f not in times):
+        cluster = by_hash.get(hashes[file])
+        if cluster is None:
+            by_hash[hashes[file]] = cluster = Cluster(file)
+            clusters.append(cluster)
+        else:
+            cluster.members.append(file)
+    return clusters
@@ -15,23 +15,32 @@ Usage:
 """
 
 import argparse
-import json
 import os
 import re
+import sys
 from collections import defaultdict
 from pathlib import Path
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-PROGRESS_FILE = "photo_descriptions_progress.txt"
+from job_store import DEFAULT_JOBS_DB, open_jobs  # noqa: E402
+from result_log import read_results  # noqa: E402
 
 
 def get_output_files():
-    """Get all JSON output files sorted by timestamp."""
+    """Get the result log and any JSON output files, sorted by name."""
     outputs_dir = Path("outputs")
     if not outputs_dir.exists():
         return []
 
-    return sorted(outputs_dir.glob("image_analysis*.json"))
+    output_files = sorted(
+        list(outputs_dir.glob("image_analysis*.json"))
+        + list(outputs_dir.glob("image_analysis*.jsonl"))
+    )
+    if (outputs_dir / "image_analysis.jsonl").exists():
+        # image_analysis.json is then an export of the log, not extra results
+        output_files = [f for f in output_files if f.name != "image_analysis.json"]
+    return output_files
 
 
 def analyze_outputs():
@@ -54,10 +63,7 @@ def analyze_outputs():
 
     for output_file in output_files:
         try:
-            with open(output_file, "r") as f:
-                data = json.load(f)
-
-            for item in data:
+            for item in read_results(str(output_file)):
                 total_processed += 1
 
                 if item.get("error", False):
@@ -273,13 +279,13 @@ def analyze_logs(all_logs=False):
     return result
 
 
-def get_progress_count():
-    """Get count of completed files from progress file."""
-    if not os.path.exists(PROGRESS_FILE):
-        return 0
+def get_job_counts():
+    """Get the number of images per status from the job table."""
+    if not os.path.exists(DEFAULT_JOBS_DB):
+        return {}
 
-    with open(PROGRESS_FILE, "r") as f:
-        return sum(1 for line in f if line.strip())
+    with open_jobs(DEFAULT_JOBS_DB) as jobs:
+        return jobs.counts()
 
 
 def main():
@@ -298,8 +304,16 @@ def main():
     print("=" * 70)
 
     # Overall progress
-    completed = get_progress_count()
+    job_counts = get_job_counts()
+    completed = job_counts.get("done", 0) + job_counts.get("failed", 0)
     print(f"\nTotal files processed: {completed:,}")
+    if job_counts:
+        print(
+            f"Job table:            {job_counts.get('done', 0):,} done, "
+            f"{job_counts.get('failed', 0):,} failed, "
+            f"{job_counts.get('pending', 0) + job_counts.get('running', 0):,} left, "
+            f"{job_counts.get('timed_out', 0):,} timed out"
+        )
 
     # Output file analysis
     print("\n" + "-" * 70)
@@ -402,11 +416,11 @@ def main():
     print("\n" + "-" * 70)
     print("FILES")
     print("-" * 70)
-    print(f"Progress file:        {PROGRESS_FILE}")
+    print(f"Job table:            {DEFAULT_JOBS_DB}")
 
     outputs_dir = Path("outputs")
     if outputs_dir.exists():
-        output_files = list(outputs_dir.glob("image_analysis*.json"))
+        output_files = get_output_files()
         print(f"Output files:         {len(output_files)} files in outputs/")
 
     log_dir = Path("logs")
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Append-only result log for image descriptions.
+
+Each description is one JSON object per line in outputs/image_analysis.jsonl.
+Writers append a line and flush it to the OS straight away, and fsync the
+file every few entries, so recording a result costs one small write instead
+of rewriting the whole output. A crash can at worst leave a torn last line,
+which readers skip and the next writer trims off.
+
+Every image_analysis.json consumer reads through read_results(), which
+streams either format, so older .json outputs keep working.
+
+Usage:
+    python src/result_log.py export [--log FILE] [--output FILE]
+    python src/result_log.py compact [--log FILE]
+    python src/result_log.py migrate [--json FILE] [--log FILE]
+
+Example:
+    # Write outputs/image_analysis.json in the old format, one entry per file
+    python src/result_log.py export
+"""
+
+import argparse
+import json
+import os
+import sys
+from typing import Iterable, Iterator
+
+RESULT_LOG_NAME = "image_analysis.jsonl"
+LEGACY_JSON_NAME = "image_analysis.json"
+
+# Entries written between fsyncs
+DEFAULT_SYNC_EVERY = 10
+
+
+def result_log_path(output_dir: str) -> str:
+    """Path of the result log in ``output_dir``."""
+    return os.path.join(output_dir, RESULT_LOG_NAME)
+
+
+def find_results(output_dir: str) -> str:
+    """
+    The results to read in ``output_dir``: the result log, or a legacy
+    image_analysis.json when no log has been started there.
+    """
+    log_path = result_log_path(output_dir)
+    json_path = os.path.join(output_dir, LEGACY_JSON_NAME)
+    if not os.path.exists(log_path) and os.path.exists(json_path):
+        return json_path
+    return log_path
+
+
+class ResultLog:
+    """
+    Append image_analysis entries to a JSON-lines file, fsyncing every
+    ``sync_every`` entries and on close.
+    """
+
+    def __init__(self, path: str, sync_every: int = DEFAULT_SYNC_EVERY):
+        self.path = path
+        self.sync_every = max(1, sync_every)
+        self.unsynced = 0
+        trim_torn_tail(path)
+        self.file = open(path, "a", encoding="utf-8")
+
+    def append(self, entry: dict):
+        self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        """Flush appended entries to disk."""
+        if self.unsynced:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def trim_torn_tail(path: str):
+    """Cut a partial last line, left by a crash mid-write, off the log."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # Walk back to the last complete line
+        pos = size
+        while pos > 0:
+            step = min(4096, pos)
+            f.seek(pos - step)
+            newline = f.read(step).rfind(b"\n")
+            if newline != -1:
+                pos = pos - step + newline + 1
+                break
+            pos -= step
+        f.truncate(pos)
+
+
+def read_results(path: str) -> Iterator[dict]:
+    """
+    Yield the entries of a result log, or of a legacy image_analysis JSON
+    array (any path ending in .json). A torn last line is skipped.
+    """
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            yield from json.load(f)
+        return
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                if line.endswith("\n"):
+                    raise ValueError(f"{path}:{line_number}: invalid JSON line")
+                # Still being written (or torn by a crash)
+                return
+
+
+def latest_per_file(entries: Iterable[dict]) -> list:
+    """
+    Keep the last entry recorded for each file, in the order files were
+    first seen. A resumed or retried image can be in the log twice.
+    """
+    latest = {}
+    for entry in entries:
+        latest[entry.get("file")] = entry
+    return list(latest.values())
+
+
+def write_atomic(path: str, write):
+    """Call write(f) on a temporary file, then move it over ``path``."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def export_json(log_path: str, json_path: str) -> int:
+    """Write the log as an image_analysis.json array; returns the entry count."""
+    entries = latest_per_file(read_results(log_path))
+    write_atomic(
+        json_path, lambda f: json.dump(entries, f, indent=2, ensure_ascii=False)
+    )
+    return len(entries)
+
+
+def write_lines(path: str, entries: Iterable[dict]):
+    """Replace ``path`` with a result log holding ``entries``."""
+
+    def write(f):
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    write_atomic(path, write)
+
+
+def compact(log_path: str) -> tuple[int, int]:
+    """
+    Rewrite the log keeping one entry per file. Returns (entries before,
+    entries after). Not safe while a writer has the log open.
+    """
+    entries = list(read_results(log_path))
+    kept = latest_per_file(entries)
+    write_lines(log_path, kept)
+    return len(entries), len(kept)
+
+
+def migrate_legacy_json(output_dir: str) -> int:
+    """
+    Start the result log from an existing image_analysis.json in
+    ``output_dir`` so resumed runs keep earlier results. Does nothing once
+    the log exists; returns the number of entries copied.
+    """
+    log_path = result_log_path(output_dir)
+    json_path = os.path.join(output_dir, LEGACY_JSON_NAME)
+    if os.path.exists(log_path) or not os.path.exists(json_path):
+        return 0
+    entries = list(read_results(json_path))
+    write_lines(log_path, entries)
+    return len(entries)
+
+
+def main():
+    default_log = result_log_path("outputs")
+    default_json = os.path.join("outputs", LEGACY_JSON_NAME)
+
+    parser = argparse.ArgumentParser(
+        description="Export, compact or migrate the image description result log"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser(
+        "export", help="Write the log as a JSON array, one entry per file"
+    )
+    export_parser.add_argument(
+        "--log", default=default_log, help=f"Result log (default: {default_log})"
+    )
+    export_parser.add_argument(
+        "--output",
+        default=default_json,
+        help=f"JSON file to write (default: {default_json})",
+    )
+
+    compact_parser = commands.add_parser(
+        "compact", help="Drop superseded entries from the log (stop writers first)"
+    )
+    compact_parser.add_argument(
+        "--log", default=default_log, help=f"Result log (default: {default_log})"
+    )
+
+    migrate_parser = commands.add_parser(
+        "migrate", help="Create the log from an existing image_analysis.json"
+    )
+    migrate_parser.add_argument(
+        "--json",
+        default=default_json,
+        help=f"JSON file to read (default: {default_json})",
+    )
+    migrate_parser.add_argument(
+        "--log", default=default_log, help=f"Result log (default: {default_log})"
+    )
+
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        if os.path.exists(args.log):
+            print(f"Error: {args.log} already exists")
+            sys.exit(1)
+        if not os.path.exists(args.json):
+            print(f"Error: JSON file not found: {args.json}")
+            sys.exit(1)
+        entries = list(read_results(args.json))
+        write_lines(args.log, entries)
+        print(f"Copied {len(entries):,} entries to {args.log}")
+        return
+
+    if not os.path.exists(args.log):
+        print(f"Error: Result log not found: {args.log}")
+        sys.exit(1)
+
+    if args.command == "export":
+        count = export_json(args.log, args.output)
+        print(f"Exported {count:,} entries to {args.output}")
+    else:
+        before, after = compact(args.log)
+        print(f"Compacted {args.log}: {before:,} -> {after:,} entries")
+
+
+if __name__ == "__main__":
+    main()
@@ -31,11 +31,13 @@ class SmolVLM2Helper:
         print("Note: First run will download ~5.2GB model to ~/.cache/huggingface/hub/")
         self.model, self.processor = load(model_path)
         self.config = load_config(model_path)
+        # Chat-template output per prompt; the prompt rarely changes
+        self._formatted_prompts = {}
         print("SmolVLM2 model loaded successfully!")
 
     def describe_image(
         self,
-        image_path: Union[str, List[str]],
+        image_path: Union[str, List],
         prompt: str = "Describe this image in detail.",
         temp: float = 0.0,
         max_tokens: int = 100,
@@ -51,7 +53,8 @@ class SmolVLM2Helper:
         - Better at scientific visual questions
 
         Args:
-            image_path: Path to the image or list of image paths
+            image_path: Path to the image, or a list of image paths and/or
+                PIL images (already loaded, e.g. by describers.load_image)
             prompt: Text prompt for the model
             temp: Temperature for generation (lower = more deterministic)
             max_tokens: Maximum number of tokens to generate
@@ -67,9 +70,12 @@ class SmolVLM2Helper:
             image_paths = image_path
 
         # Apply chat template
-        formatted_prompt = apply_chat_template(
-            self.processor, self.config, prompt
-        )
+        formatted_prompt = self._formatted_prompts.get(prompt)
+        if formatted_prompt is None:
+            formatted_prompt = apply_chat_template(
+                self.processor, self.config, prompt
+            )
+            self._formatted_prompts[prompt] = formatted_prompt
 
         # Generate output - NOTE ORDER: formatted_prompt comes before image
         output = generate(
@@ -2,7 +2,6 @@
 
 import argparse
 import html
-import json
 import mimetypes
 import sqlite3
 import sys
@@ -10,8 +9,12 @@ import urllib.parse
 from http.server import HTTPServer, SimpleHTTPRequestHandler
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from result_log import find_results, latest_per_file, read_results  # noqa: E402
+
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
-JSON_PATH = PROJECT_ROOT / "outputs" / "image_analysis.json"
+JSON_PATH = Path(find_results(str(PROJECT_ROOT / "outputs")))
 IMAGE_ROOT = PROJECT_ROOT / "database" / "512x512"
 MEDIAMETA_DB = PROJECT_ROOT / "database" / "mediameta.db"
 
@@ -126,7 +129,7 @@ def main():
         print(f"Error: {JSON_PATH} not found", file=sys.stderr)
         sys.exit(1)
 
-    entries = json.loads(JSON_PATH.read_text())
+    entries = latest_per_file(read_results(str(JSON_PATH)))
     dates = load_photo_dates()
     Handler.html_content, image_count = build_html(entries, dates)
 
@@ -0,0 +1,600 @@
+#!/usr/bin/env python3
+"""
+Lease-based work queue for image description runs.
+
+Several workers, as processes on one machine or on several machines that
+share the job table, describe the images in one directory together. Each
+worker claims a lease on a chunk of pending images (see JobStore.claim),
+renews it after every image, and hands back what it has not described
+when it stops. If a worker dies, its leases expire after --lease-seconds
+and another worker picks the images up.
+
+A result is recorded in the job table in the same transaction that marks
+its image done; the first result for an image wins, so an image described
+twice (its lease expired while the worker was still busy) is only recorded
+once. Workers then collect recorded results into the result log, holding
+the database write lock while they do, so the log gets every result once.
+
+With --near-duplicates, each worker groups the chunk it claims (see
+near_duplicates.py), describes one image per group and records its
+description for the rest, marked "inherited_from". Burst shots sort next
+to each other, so a chunk usually holds the whole group; a group split
+across chunks is described once per chunk. If a representative fails, its
+near-duplicates go back to the queue.
+
+Images that run past --image-timeout are moved to the retry queue, and the
+``work`` supervisor runs a retry pass with --retry-max-tokens and
+--retry-max-edge once every image has been leased and described.
+
+Usage:
+    python src/work_queue.py work <directory> [--workers N] [options]
+    python src/work_queue.py worker <directory> [options]
+    python src/work_queue.py status [--jobs-db FILE]
+    python src/work_queue.py collect [--jobs-db FILE] [--output-dir DIR]
+
+Workers on several machines need the job table on storage where SQLite's
+file locking works, in rollback journal mode (--journal-mode delete; WAL
+only works on one host). Lease times are stored in UTC, but machine clocks
+should still be in sync, since leases expire by wall-clock time.
+
+Example:
+    # Two workers on this machine
+    python src/work_queue.py work ~/Photos --workers 2
+
+    # One more on another machine, sharing the job table and outputs
+    python src/work_queue.py work /Volumes/photos --jobs-db /Volumes/shared/jobs.db \\
+        --journal-mode delete --output-dir /Volumes/shared/outputs
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from batch_orchestrator import (  # noqa: E402
+    DEFAULT_RETRY_MAX_EDGE,
+    DEFAULT_RETRY_MAX_TOKENS,
+)
+from describers import BACKENDS, DEFAULT_BACKEND, get_describer  # noqa: E402
+from description_cache import DEFAULT_CACHE_DB, open_cache  # noqa: E402
+from generate_descriptions import (  # noqa: E402
+    DEFAULT_IMAGE_TIMEOUT,
+    STOP_FLAG_FILE,
+    TIMEOUT_EXIT_CODE,
+    check_stop_requested,
+    describe_cached,
+    error_result,
+    find_all_files,
+    group_near_duplicates,
+    image_deadline,
+    inherited_result,
+)
+from image_prefetch import DEFAULT_PREFETCH_DEPTH, ImagePrefetcher  # noqa: E402
+from job_store import (  # noqa: E402
+    DEFAULT_JOBS_DB,
+    DONE,
+    FAILED,
+    JOURNAL_MODES,
+    PENDING,
+    RUNNING,
+    TIMED_OUT,
+    JobStore,
+    ago,
+    open_jobs,
+)
+from near_duplicates import (  # noqa: E402
+    DEFAULT_DUPLICATE_DISTANCE,
+    DEFAULT_DUPLICATE_WINDOW,
+    DEFAULT_EXIF_DB,
+)
+from result_log import ResultLog, migrate_legacy_json, result_log_path  # noqa: E402
+
+DEFAULT_PROMPT = "<image>Briefly describe this image in one or two sentences."
+
+# Images leased per claim, and how long a lease lasts without renewal
+DEFAULT_CHUNK_SIZE = 20
+DEFAULT_LEASE_SECONDS = 900
+
+# How often an idle worker checks for expired leases to pick up
+IDLE_POLL_SECONDS = 5
+
+# Finished images counted towards the status view's current rate
+RATE_WINDOW_MINUTES = 10
+
+
+def worker_id() -> str:
+    """Name of this worker in the job table: host and process id."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def collect(jobs: JobStore, output_dir: str) -> int:
+    """Append the results workers recorded to the result log; returns how many."""
+
+    def write(entries: list):
+        with ResultLog(result_log_path(output_dir)) as results:
+            for entry in entries:
+                results.append(entry)
+
+    return jobs.collect_results(write)
+
+
+def run_worker(args) -> int:
+    """
+    Claim, describe and record chunks of images until none are left to
+    lease. Returns the number of images this worker recorded.
+    """
+    name = worker_id()
+    jobs = open_jobs(args.jobs_db, args.journal_mode)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    all_files, base_path = find_all_files(args.directory)
+    jobs.add_files(str(path.relative_to(base_path)) for path in all_files)
+
+    prompt = args.prompt if "<image>" in args.prompt else f"<image>{args.prompt}"
+    describer = get_describer(
+        args.backend,
+        model=args.model,
+        latency=args.stub_latency,
+        max_edge=args.max_image_edge,
+    )
+    describer.load()
+    cache = open_cache(None if args.no_cache else args.cache_db)
+    print(f"Worker {name} ready ({describer.name})", flush=True)
+
+    claim_status = TIMED_OUT if args.retry_timed_out else PENDING
+    prefetcher = ImagePrefetcher(describer.prepare, depth=args.prefetch)
+    leased = []
+    recorded = 0
+
+    def on_timeout(rel_path: str):
+        # Runs on the watchdog thread; the job table connection belongs to
+        # the main thread
+        print(f"Timed out after {args.image_timeout:g}s: {rel_path}", flush=True)
+        with open_jobs(args.jobs_db) as timeout_jobs:
+            timeout_jobs.time_out(rel_path, args.image_timeout)
+            if args.retry_timed_out:
+                error = f"timed out after {args.image_timeout:g}s again on retry"
+                timeout_jobs.complete(
+                    name, rel_path, error_result(rel_path, error, describer.name)
+                )
+            timeout_jobs.release(name, leased, claim_status)
+        os._exit(TIMEOUT_EXIT_CODE)
+
+    try:
+        while not check_stop_requested():
+            leased = jobs.claim(name, args.chunk_size, args.lease_seconds, claim_status)
+            if not leased:
+                if jobs.leased_count() == 0:
+                    break
+                # Other workers still hold leases; if one of them dies, its
+                # images become claimable once the lease expires
+                time.sleep(min(IDLE_POLL_SECONDS, args.lease_seconds))
+                continue
+
+            paths = [base_path / rel_path for rel_path in leased]
+            members_of = {}
+            if args.near_duplicates and not args.retry_timed_out:
+                members_of = group_near_duplicates(
+                    jobs,
+                    paths,
+                    base_path,
+                    args.exif_db,
+                    args.duplicate_distance,
+                    args.duplicate_window,
+                )
+                inheriting = {m for members in members_of.values() for m in members}
+                paths = [path for path in paths if path not in inheriting]
+            for image_path, prepared in prefetcher.iterate(paths):
+                rel_path = str(image_path.relative_to(base_path))
+                if not jobs.start(rel_path, name):
+                    # The lease expired and another worker claimed or
+                    # finished the image meanwhile
+                    leased.remove(rel_path)
+                    continue
+                try:
+                    with image_deadline(
+                        args.image_timeout, lambda: on_timeout(rel_path)
+                    ):
+                        result = describe_cached(
+                            cache,
+                            describer,
+                            image_path,
+                            prefetcher.wait(prepared),
+                            rel_path,
+                            prompt,
+                            args.temp,
+                            args.max_tokens,
+                        )
+                except Exception as e:
+                    print(f"Error processing {rel_path}: {e}", flush=True)
+                    result = error_result(rel_path, e, describer.name)
+                if jobs.complete(name, rel_path, result, prompt):
+                    recorded += 1
+                leased.remove(rel_path)
+                members = [] if result["error"] else members_of.get(image_path, [])
+                for member in members:
+                    member_path = str(member.relative_to(base_path))
+                    entry = inherited_result(result, member_path)
+                    if jobs.complete(name, member_path, entry, prompt):
+                        recorded += 1
+                    leased.remove(member_path)
+                jobs.renew(name, leased, args.lease_seconds)
+                if check_stop_requested():
+                    break
+            else:
+                # Near-duplicates of a representative that failed go back to
+                # the queue, to be described on their own
+                jobs.release(name, leased, claim_status)
+                leased = []
+
+            if not args.no_collect:
+                collect(jobs, args.output_dir)
+            print(f"Worker {name}: {recorded} images recorded", flush=True)
+    finally:
+        # Whatever this worker did not get to goes back to the queue
+        jobs.release(name, leased, claim_status)
+        prefetcher.close()
+        jobs.close()
+        if cache:
+            print(f"Worker {name}: {cache.summary()}", flush=True)
+            cache.close()
+    return recorded
+
+
+def worker_command(args, retry: bool) -> list:
+    """The ``worker`` command line for ``work`` to start."""
+    cmd = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "worker",
+        args.directory,
+        "--jobs-db",
+        args.jobs_db,
+        "--output-dir",
+        args.output_dir,
+        "--backend",
+        args.backend,
+        "--prompt",
+        args.prompt,
+        "--temp",
+        str(args.temp),
+        "--prefetch",
+        str(args.prefetch),
+        "--chunk-size",
+        str(args.chunk_size),
+        "--lease-seconds",
+        str(args.lease_seconds),
+        "--image-timeout",
+        str(args.image_timeout),
+        "--max-tokens",
+        str(args.retry_max_tokens if retry else args.max_tokens),
+    ]
+    if args.model:
+        cmd += ["--model", args.model]
+    if args.journal_mode:
+        cmd += ["--journal-mode", args.journal_mode]
+    if args.stub_latency:
+        cmd += ["--stub-latency", args.stub_latency]
+    if args.no_collect:
+        cmd.append("--no-collect")
+    if args.no_cache:
+        cmd.append("--no-cache")
+    else:
+        cmd += ["--cache-db", args.cache_db]
+    if args.near_duplicates:
+        cmd += [
+            "--near-duplicates",
+            "--duplicate-distance",
+            str(args.duplicate_distance),
+            "--duplicate-window",
+            str(args.duplicate_window),
+            "--exif-db",
+            args.exif_db,
+        ]
+    if retry:
+        cmd.append("--retry-timed-out")
+        if args.retry_max_edge:
+            cmd += ["--max-image-edge", str(args.retry_max_edge)]
+    elif args.max_image_edge:
+        cmd += ["--max-image-edge", str(args.max_image_edge)]
+    return cmd
+
+
+def run_workers(args):
+    """
+    Keep --workers worker processes running until the queue is empty,
+    restarting any that stop on an image timeout, then do the retry pass.
+    """
+    os.makedirs(args.output_dir, exist_ok=True)
+    # Switch the journal mode before any worker holds the table open
+    open_jobs(args.jobs_db, args.journal_mode).close()
+    migrated = migrate_legacy_json(args.output_dir)
+    if migrated:
+        print(f"Copied {migrated:,} results from image_analysis.json to the log")
+
+    for retry in (False, True):
+        if retry:
+            with open_jobs(args.jobs_db) as jobs:
+                waiting = len(jobs.timed_out_files())
+            if not waiting or check_stop_requested():
+                break
+            print(f"Retrying {waiting:,} timed-out images", flush=True)
+
+        cmd = worker_command(args, retry)
+        workers = [subprocess.Popen(cmd) for _ in range(args.workers)]
+        while workers:
+            time.sleep(1)
+            for i, process in enumerate(workers):
+                code = process.poll()
+                if code is None:
+                    continue
+                if code == TIMEOUT_EXIT_CODE and not check_stop_requested():
+                    # The image it was stuck on is in the retry queue
+                    workers[i] = subprocess.Popen(cmd)
+                    continue
+                if code != 0:
+                    print(f"Worker {process.pid} exited with code {code}")
+                workers[i] = None
+            workers = [process for process in workers if process is not None]
+
+    with open_jobs(args.jobs_db) as jobs:
+        if not args.no_collect:
+            collect(jobs, args.output_dir)
+        print_status(jobs)
+
+
+def print_status(jobs: JobStore):
+    """Progress across every worker sharing the job table."""
+    counts = jobs.counts()
+    total = sum(counts.values())
+    completed = counts.get(DONE, 0) + counts.get(FAILED, 0)
+    stats = jobs.worker_stats(ago(RATE_WINDOW_MINUTES))
+
+    print("=" * 70)
+    print(f"WORK QUEUE - {jobs.path}")
+    print("=" * 70)
+    if total:
+        print(f"Completed:  {completed:,} / {total:,} ({completed / total * 100:.1f}%)")
+    print(
+        f"Pending:    {counts.get(PENDING, 0):,}   "
+        f"Running: {counts.get(RUNNING, 0):,} ({jobs.leased_count():,} leased)   "
+        f"Timed out: {counts.get(TIMED_OUT, 0):,}"
+    )
+
+    recent = sum(row[3] or 0 for row in stats)
+    if recent:
+        rate = recent / RATE_WINDOW_MINUTES * 60
+        remaining = total - completed
+        print(
+            f"Rate:       {rate:,.0f} images/hour over the last "
+            f"{RATE_WINDOW_MINUTES} minutes - {remaining / rate:.1f} hours left"
+        )
+
+    if stats:
+        print()
+        print(
+            f"{'Worker':<32}{'Done':>8}{'Failed':>8}"
+            f"{f'{RATE_WINDOW_MINUTES}min':>8}{'Leased':>8}  Last finished"
+        )
+        for worker, done, failed, recent, leased, last in stats:
+            print(
+                f"{worker:<32}{done or 0:>8,}{failed or 0:>8,}"
+                f"{recent or 0:>8,}{leased or 0:>8,}  {last or '-'}"
+            )
+
+
+def add_worker_options(parser: argparse.ArgumentParser):
+    parser.add_argument("directory", help="Directory containing images to process")
+    parser.add_argument(
+        "--output-dir",
+        default="outputs",
+        help="Directory for the result log (default: outputs)",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=BACKENDS,
+        default=DEFAULT_BACKEND,
+        help=f"Describer backend (default: {DEFAULT_BACKEND})",
+    )
+    parser.add_argument("--model", help="Model to load (default: per backend)")
+    parser.add_argument(
+        "--stub-latency",
+        help="Stub backend latency, e.g. fixed:0.5 or lognormal:1.2,0.4",
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=100,
+        help="Maximum tokens to generate per image (default: 100)",
+    )
+    parser.add_argument(
+        "--temp",
+        type=float,
+        default=0.0,
+        help="Temperature for generation (default: 0.0)",
+    )
+    parser.add_argument(
+        "--prompt",
+        default=DEFAULT_PROMPT,
+        help="Prompt for image description (default: brief one-sentence description)",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=DEFAULT_PREFETCH_DEPTH,
+        help="Images decoded and resized ahead of the model, on background "
+        f"threads (default: {DEFAULT_PREFETCH_DEPTH})",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help=f"Images leased per claim (default: {DEFAULT_CHUNK_SIZE})",
+    )
+    parser.add_argument(
+        "--lease-seconds",
+        type=float,
+        default=DEFAULT_LEASE_SECONDS,
+        help="Seconds a lease lasts without renewal; a dead worker's images are "
+        f"picked up after this (default: {DEFAULT_LEASE_SECONDS})",
+    )
+    parser.add_argument(
+        "--image-timeout",
+        type=float,
+        default=DEFAULT_IMAGE_TIMEOUT,
+        help="Seconds one image may take before it is moved to the retry queue, "
+        f"0 = no limit (default: {DEFAULT_IMAGE_TIMEOUT})",
+    )
+    parser.add_argument(
+        "--max-image-edge",
+        type=int,
+        help="Largest image side given to the model (default: the model's own)",
+    )
+    parser.add_argument(
+        "--cache-db",
+        default=DEFAULT_CACHE_DB,
+        help=f"Description cache shared by the workers (default: {DEFAULT_CACHE_DB})",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="Describe every image with the model"
+    )
+    parser.add_argument(
+        "--near-duplicates",
+        action="store_true",
+        help="Describe one image per group of near-duplicates (similar perceptual "
+        "hash, close capture time) in each chunk and copy its description to "
+        "the rest",
+    )
+    parser.add_argument(
+        "--duplicate-distance",
+        type=int,
+        default=DEFAULT_DUPLICATE_DISTANCE,
+        help="Most bits, of 64, in which near-duplicates' hashes may differ "
+        f"(default: {DEFAULT_DUPLICATE_DISTANCE})",
+    )
+    parser.add_argument(
+        "--duplicate-window",
+        type=float,
+        default=DEFAULT_DUPLICATE_WINDOW,
+        help="Most seconds between near-duplicates' capture times "
+        f"(default: {DEFAULT_DUPLICATE_WINDOW:g})",
+    )
+    parser.add_argument(
+        "--exif-db",
+        default=DEFAULT_EXIF_DB,
+        help="Database with the exif table, for capture times "
+        f"(default: {DEFAULT_EXIF_DB})",
+    )
+    parser.add_argument(
+        "--no-collect",
+        action="store_true",
+        help="Leave results in the job table for a later collect, e.g. when "
+        "this machine cannot reach the shared output directory",
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Describe images with several workers sharing a job table"
+    )
+    # Every command takes --jobs-db after its name
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        "--jobs-db",
+        default=DEFAULT_JOBS_DB,
+        help=f"Job table shared by the workers (default: {DEFAULT_JOBS_DB})",
+    )
+    common.add_argument(
+        "--journal-mode",
+        choices=JOURNAL_MODES,
+        help="Switch the job table to this journal mode; use delete when workers "
+        "on several machines share it (default: wal for a new table)",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    work_parser = commands.add_parser(
+        "work",
+        parents=[common],
+        help="Run several workers until every image is described",
+    )
+    add_worker_options(work_parser)
+    work_parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes on this machine, each loading the model (default: 1)",
+    )
+    work_parser.add_argument(
+        "--retry-max-tokens",
+        type=int,
+        default=DEFAULT_RETRY_MAX_TOKENS,
+        help="Maximum tokens when retrying timed-out images "
+        f"(default: {DEFAULT_RETRY_MAX_TOKENS})",
+    )
+    work_parser.add_argument(
+        "--retry-max-edge",
+        type=int,
+        default=DEFAULT_RETRY_MAX_EDGE,
+        help="Largest image side when retrying timed-out images, 0 = the "
+        f"model's own (default: {DEFAULT_RETRY_MAX_EDGE})",
+    )
+
+    worker_parser = commands.add_parser(
+        "worker", parents=[common], help="Run one worker in this process"
+    )
+    add_worker_options(worker_parser)
+    worker_parser.add_argument(
+        "--retry-timed-out",
+        action="store_true",
+        help="Claim images from the timeout retry queue instead of pending ones",
+    )
+
+    commands.add_parser(
+        "status", parents=[common], help="Show progress across all workers"
+    )
+
+    collect_parser = commands.add_parser(
+        "collect",
+        parents=[common],
+        help="Append results recorded by workers to the result log",
+    )
+    collect_parser.add_argument(
+        "--output-dir",
+        default="outputs",
+        help="Directory for the result log (default: outputs)",
+    )
+
+    args = parser.parse_args()
+
+    if args.command in ("work", "worker"):
+        if not os.path.isdir(args.directory):
+            print(f"Error: Directory not found: {args.directory}")
+            sys.exit(1)
+        if args.command == "work":
+            run_workers(args)
+        else:
+            run_worker(args)
+        if os.path.exists(STOP_FLAG_FILE):
+            print(f"Stopped: remove {STOP_FLAG_FILE} to continue")
+        return
+
+    if not os.path.exists(args.jobs_db):
+        print(f"Error: Job table not found: {args.jobs_db}")
+        sys.exit(1)
+
+    with open_jobs(args.jobs_db, args.journal_mode) as jobs:
+        if args.command == "collect":
+            os.makedirs(args.output_dir, exist_ok=True)
+            count = collect(jobs, args.output_dir)
+            log_path = result_log_path(args.output_dir)
+            print(f"Collected {count:,} results into {log_path}")
+        else:
+            print_status(jobs)
+
+
+if __name__ == "__main__":
+    main()